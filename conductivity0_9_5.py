@@ -7,15 +7,20 @@ Created on Thu Aug 10 11:42:46 2023
 
  Dependencies: 
  -------------
-     : numpy, scipy, matplotlib, pandas, pathlib, nrlmsise2, iri2, freqcol
+     : numpy, scipy, matplotlib, pandas, pathlib, nrlmsise2, iri2, freqcol,
+       pyigrf_clara, fieldline_utils
 """
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
+from scipy import sparse
 
 #import pyigrf_clara_0_4 as igrf
+import pyigrf_clara_0_6 as igrf
+import igrf_utils as iut
+import fieldline_utils as flu
 import freqcol_0_6 as fc
 import geopandas as gpd
 #import msise2
@@ -189,6 +194,174 @@ class gyrofrequency():
             
 
 
+class condutancia_linhas():
+    """
+    INTEGRA CONDUTIVIDADES AO LONGO DAS LINHAS DO CAMPO GEOMAGNÉTICO (IGRF).
+
+    Uma linha de campo sai de cada ponto (lat, lon) da base do cubo
+    (ht, lat, lon) e é seguida até o ponto conjugado na mesma altura
+    (flu.sample_field_lines). Os pontos amostrados dentro do cubo e os pesos
+    de interpolação trilinear (já multiplicados pelo comprimento de cada
+    passo) são calculados uma vez e guardados numa matriz esparsa self.W, com
+    duas linhas por linha de campo: a metade do hemisfério de partida (até o
+    apex) e a metade conjugada. Integrar um novo cubo de condutividade é então
+    um único produto matriz esparsa-vetor (ou matriz, um vetor por tempo).
+
+    Attributes
+    ----------
+        ht, lat, lon : ARRAY FLOAT
+            EIXOS DO CUBO DE CONDUTIVIDADE [km, graus].
+        W : scipy.sparse.csr_matrix
+            PESOS (2*nlinhas, ncubo) EM METROS.
+        linhas : DATAFRAME
+            POR PONTO DE PARTIDA (lat, lon): "lat_conjugado", "lon_conjugado"
+            (NaN SE A LINHA NÃO VOLTA) E "comprimento" [km].
+    """
+
+    def __init__(self,ht,lat,lon,ano,ds = 10.,deslocamento_lon = -180.,arquivo_shc = None):
+        """
+        CALCULA AS LINHAS DE CAMPO E OS PESOS DE INTEGRAÇÃO.
+
+        Parameters
+        ----------
+        ht : ARRAY FLOAT
+            ALTITUDES GEODÉTICAS DO CUBO [km]. AS LINHAS SAEM E CHEGAM EM
+            min(ht) E SÃO INTEGRADAS ATÉ max(ht).
+        lat : ARRAY FLOAT
+            LATITUDES GEODÉTICAS DO CUBO [graus]. FORA DELAS É USADO O VALOR DA BORDA.
+        lon : ARRAY FLOAT
+            LONGITUDES DO CUBO [graus], PERIÓDICAS EM 360.
+        ano : FLOAT
+            ANO DECIMAL DO CAMPO IGRF.
+        ds : FLOAT, optional
+            PASSO AO LONGO DAS LINHAS [km]. The default is 10.
+        deslocamento_lon : FLOAT, optional
+            LONGITUDE GEOGRÁFICA = lon + deslocamento_lon. The default is -180
+            (lon DE 0 A 360 A PARTIR DE -180, COMO NO Dfgrid DE teste2_tufo_final).
+        arquivo_shc : STRING, optional
+            ARQUIVO .shc DO MODELO. The default is None (igrf.IGRF_FILE).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.ht = np.unique(np.asarray(ht, dtype=np.float64))
+        self.lat = np.unique(np.asarray(lat, dtype=np.float64))
+        self.lon = np.unique(np.asarray(lon, dtype=np.float64))
+        self.deslocamento_lon = deslocamento_lon
+
+        print("Calculando as linhas de campo...")
+        coeffs = igrf.modelos.coeficientes(arquivo_shc).get(ano)[0]
+        nmax = igrf.modelos.get(arquivo_shc).parameters['nmax']
+
+        lat0, lon0 = np.meshgrid(self.lat, self.lon, indexing='ij')
+        alt, colat, _, _ = iut.gg_to_geo(np.full(lat0.shape, self.ht[0]), 90 - lat0)
+        amostras = flu.sample_field_lines(coeffs, alt, colat, lon0 + deslocamento_lon,
+                                          self.ht[0], self.ht[-1], ds=ds, nmax=nmax)
+
+        h, la, lo = self._geodeticas(amostras['points'])
+        colunas, pesos = self._pesos_trilineares(h, la, lo - deslocamento_lon)
+        linhas = 2*amostras['line'] + ~amostras['ascending'] # metade de partida e conjugada
+        # comprimento em km -> m, condutividade [S/m] * m = S
+        pesos = pesos * (1e3*amostras['weights'])[None]
+        self.W = sparse.csr_matrix((pesos.ravel(), (np.tile(linhas, 8), colunas.ravel())),
+                                   shape=(2*lat0.size, self.ht.size*self.lat.size*self.lon.size))
+        # pesos trilineares nulos saem da matriz: um ponto do cubo que falta
+        # (NaN) não pode contaminar uma linha que não o usa (0*NaN = NaN)
+        self.W.eliminate_zeros()
+
+        _, lat_c, lon_c = self._geodeticas(amostras['foot'].reshape(3, -1))
+        self.linhas = pd.DataFrame({'lat_conjugado': lat_c,
+                                    'lon_conjugado': np.mod(lon_c - deslocamento_lon, 360.),
+                                    'comprimento': amostras['length'].ravel()},
+                                   index=pd.MultiIndex.from_product([self.lat, self.lon],
+                                                                    names=['lat','lon']))
+        print("Done")
+
+    def _geodeticas(self,pontos):
+        """ALTURA, LATITUDE E LONGITUDE GEODÉTICAS DE PONTOS (r, theta, phi) GEOCÊNTRICOS."""
+        with np.errstate(invalid='ignore'):
+            h, colat = iut.geo_to_gg(pontos[0], pontos[1])
+        falhou = np.isnan(h) & ~np.isnan(pontos[0])
+        h = np.where(falhou, pontos[0] - flu.RE, h)
+        colat = np.where(falhou, pontos[1], colat)
+        return h, 90 - colat, pontos[2]
+
+    def _pesos_trilineares(self,h,lat,lon):
+        """
+        ÍNDICES NO CUBO ACHATADO (ht, lat, lon) E PESOS DE INTERPOLAÇÃO
+        TRILINEAR DOS PONTOS, ARRAYS (8, npontos).
+        """
+        def eixo(x, valores, periodo=None):
+            if periodo is not None:
+                # o intervalo entre o último valor e o primeiro + periodo também vale
+                valores = np.append(valores, valores[0] + periodo)
+                x = valores[0] + np.mod(x - valores[0], periodo)
+            else:
+                x = np.clip(x, valores[0], valores[-1])
+            i = np.clip(np.searchsorted(valores, x, side='right') - 1, 0, max(valores.size - 2, 0))
+            if valores.size < 2:
+                return i, i, np.zeros(x.size)
+            t = (x - valores[i])/(valores[i+1] - valores[i])
+            j = i + 1
+            if periodo is not None:
+                j = np.where(j == valores.size - 1, 0, j)
+            return i, j, t
+
+        ih, jh, th = eixo(h, self.ht)
+        il, jl, tl = eixo(lat, self.lat)
+        io, jo, to = eixo(lon, self.lon, 360.)
+        nl, no = self.lat.size, self.lon.size
+
+        colunas, pesos = [], []
+        for a, wa in ((ih, 1 - th), (jh, th)):
+            for b, wb in ((il, 1 - tl), (jl, tl)):
+                for c, wc in ((io, 1 - to), (jo, to)):
+                    colunas.append((a*nl + b)*no + c)
+                    pesos.append(wa*wb*wc)
+        return np.array(colunas), np.array(pesos)
+
+    def integra(self,cond):
+        """
+        INTEGRA UMA CONDUTIVIDADE AO LONGO DAS LINHAS DE CAMPO.
+
+        Parameters
+        ----------
+        cond : PANDA SERIES
+            CONDUTIVIDADE [S/m] COM MULTIINDEX QUE TEM OS NÍVEIS 'ht', 'lat' E
+            'lon' (COMO CondP E CondH). OS OUTROS NÍVEIS (EX.: 'time') SÃO
+            INTEGRADOS JUNTOS, UMA COLUNA POR VALOR. PONTOS DO CUBO QUE FALTAM
+            VIRAM NaN, MAS SÓ NAS LINHAS QUE OS USAM COM PESO NÃO NULO.
+
+        Returns
+        -------
+        condutancia : DATAFRAME
+            CONDUTÂNCIAS [S] POR (lat, lon) DE PARTIDA (E PELOS OUTROS NÍVEIS):
+            "local" (DO PONTO ATÉ O APEX), "conjugada" (DO APEX ATÉ O PONTO
+            CONJUGADO) E "total" (A LINHA INTEIRA).
+
+        """
+        eixos = ['ht','lat','lon']
+        outros = [n for n in cond.index.names if n not in eixos]
+        dados = cond.unstack(outros) if outros else cond.to_frame()
+        cubo = pd.MultiIndex.from_product([self.ht, self.lat, self.lon], names=eixos)
+        dados = dados.reorder_levels(eixos).reindex(cubo)
+
+        valores = self.W @ dados.to_numpy(dtype=np.float64)
+        local, conjugada = valores[0::2], valores[1::2]
+
+        resultado = []
+        for k, coluna in enumerate(dados.columns):
+            r = pd.DataFrame({'local': local[:, k], 'conjugada': conjugada[:, k],
+                              'total': local[:, k] + conjugada[:, k]},
+                             index=self.linhas.index)
+            resultado.append(r)
+        if not outros:
+            return resultado[0]
+        return pd.concat(resultado, keys=dados.columns, names=outros)
+
+
 class condiono_adachi():
     def __init__(self):
         self.me = 9.109389e-31 #Massa do elétron em repouso [kg]
@@ -397,6 +570,31 @@ class condiono_adachi():
         
         return self.CondP
        
+    def calc_condutancias(self,linhas,CondP = None,CondH = None):
+        """
+        CALCULA AS CONDUTÂNCIAS DE PEDERSEN E HALL INTEGRADAS AO LONGO DAS LINHAS DE CAMPO.
+
+        Parameters
+        ----------
+        linhas : condutancia_linhas
+            LINHAS DE CAMPO E PESOS DO CUBO DAS CONDUTIVIDADES.
+        CondP : PANDA SERIES, optional
+            CONDUTIVIDADE DE PEDERSEN [S/m]. The default is None (self.CondP).
+        CondH : PANDA SERIES, optional
+            CONDUTIVIDADE DE HALL [S/m]. The default is None (self.CondH).
+
+        Returns
+        -------
+        self.SigmaP, self.SigmaH : DATAFRAME
+            CONDUTÂNCIAS [S] "local", "conjugada" E "total" (VER condutancia_linhas.integra).
+
+        """
+        print("\n== Integrando as condutividades ao longo das linhas de campo")
+        self.SigmaP = linhas.integra(self.CondP if CondP is None else CondP)
+        self.SigmaH = linhas.integra(self.CondH if CondH is None else CondH)
+        print("Done")
+        return self.SigmaP, self.SigmaH
+
     def save_to_csv(data,filename):
         """
         SALVA OS DADOS GUARDADOS NUM DATAFRAME NUM ARQUIVO.
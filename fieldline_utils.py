@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Field-line tracing on top of igrf_utils.
+
+Many field lines are followed at once with an adaptive Dormand-Prince
+Runge-Kutta 5(4) scheme in geocentric Cartesian coordinates. Every stage
+evaluates igrf_utils.synth_values in one batch for all lines still active,
+so the cost per step does not depend on how many lines are traced.
+
+Functions return footpoints, the highest point (apex) and the arc length of
+each line, for mapping quantities along B (conjugate points, apex height,
+L-shell like parameters).
+
+"""
+
+import numpy as np
+import igrf_utils as iut
+
+# Earth's average radius used by igrf_utils
+RE = 6371.2
+
+# Dormand-Prince 5(4) tableau
+_A = [[],
+      [1/5],
+      [3/40, 9/40],
+      [44/45, -56/15, 32/9],
+      [19372/6561, -25360/2187, 64448/6561, -212/729],
+      [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+      [35/384, 0., 500/1113, 125/192, -2187/6784, 11/84]]
+_B5 = np.array([35/384, 0., 500/1113, 125/192, -2187/6784, 11/84, 0.])
+_B4 = np.array([5179/57600, 0., 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+
+
+def to_cartesian(radius, theta, phi):
+    """
+    Geocentric Cartesian coordinates (x, y, z) in km from radius [km],
+    colatitude and longitude [degrees], as an array of shape (3, ...).
+
+    """
+    th = np.deg2rad(theta)
+    ph = np.deg2rad(phi)
+    return np.stack(np.broadcast_arrays(radius*np.sin(th)*np.cos(ph),
+                                        radius*np.sin(th)*np.sin(ph),
+                                        radius*np.cos(th)))
+
+
+def to_spherical(x):
+    """
+    Radius [km], colatitude and longitude [degrees] of Cartesian points
+    ``x`` of shape (3, ...).
+
+    """
+    r = np.sqrt(x[0]**2 + x[1]**2 + x[2]**2)
+    theta = np.rad2deg(np.arccos(np.clip(x[2]/r, -1., 1.)))
+    phi = np.rad2deg(np.arctan2(x[1], x[0]))
+    return r, theta, phi
+
+
+def field_direction(coeffs, x, nmax=None):
+    """
+    Unit vector along B and field intensity at Cartesian points.
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion.
+    x : ndarray, shape (3, ...)
+        Geocentric Cartesian points in km.
+    nmax : int, positive, optional
+        Maximum degree (default is given by ``coeffs``).
+
+    Returns
+    -------
+    b : ndarray, shape (3, ...)
+        Cartesian unit vector of the field.
+    F : ndarray, shape (...)
+        Field intensity in nT.
+
+    """
+    r, theta, phi = to_spherical(x)
+    Br, Bt, Bp = iut.synth_values(coeffs, r, theta, phi, nmax=nmax)
+
+    th = np.deg2rad(theta)
+    ph = np.deg2rad(phi)
+    st, ct = np.sin(th), np.cos(th)
+    sp, cp = np.sin(ph), np.cos(ph)
+
+    # (B_r, B_theta, B_phi) -> (B_x, B_y, B_z)
+    B = np.stack([Br*st*cp + Bt*ct*cp - Bp*sp,
+                  Br*st*sp + Bt*ct*sp + Bp*cp,
+                  Br*ct - Bt*st])
+    F = np.sqrt(Br**2 + Bt**2 + Bp**2)
+    return B/F, F
+
+
+def _altitude(x):
+    """Geodetic altitude [km] of Cartesian points (spherical where geo_to_gg fails)."""
+    r, theta, _ = to_spherical(x)
+    with np.errstate(invalid='ignore'):
+        h, _ = iut.geo_to_gg(r, theta)
+    return np.where(np.isnan(h), r - RE, h)
+
+
+def trace_field_lines(coeffs, radius, theta, phi, direction=1, nmax=None,
+                      h_stop=0., tol=1e-3, step=10., max_step=1000.,
+                      r_max=20*RE, max_steps=20000):
+    """
+    Follow field lines from many starting points until they reach the
+    geodetic altitude ``h_stop``.
+
+    The lines are integrated along the arc length ``s`` of
+    ``dx/ds = direction * B/|B|`` with an adaptive Dormand-Prince 5(4)
+    scheme, one step size per line. The step that crosses ``h_stop`` is
+    shortened by secant estimates until the end point lies within ``tol``
+    of it. The apex is searched on the cubic Hermite interpolant of every
+    accepted step.
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion (one date).
+    radius, theta, phi : float or ndarray, shape (...)
+        Geocentric radius [km], colatitude and longitude [degrees] of the
+        starting points, broadcast together.
+    direction : {1, -1} or ndarray, shape (...)
+        Follow B (``1``, towards the northern footpoint for the present-day
+        field) or -B (``-1``).
+    nmax : int, positive, optional
+        Maximum degree (default is given by ``coeffs``).
+    h_stop : float, optional
+        Geodetic altitude [km] of the footpoints (default is 0).
+    tol : float, optional
+        Local error tolerance per step and footpoint accuracy in km
+        (default is 1e-3).
+    step, max_step : float, optional
+        Initial and largest step in km (defaults are 10 and 1000).
+    r_max : float, optional
+        Lines going beyond this radius [km] are left open (default 20 RE).
+    max_steps : int, optional
+        Maximum number of steps (default is 20000).
+
+    Returns
+    -------
+    lines : dict of ndarrays, shape (...)
+        ``'foot'`` : (3, ...) radius [km], colatitude and longitude [degrees]
+        of the footpoint, NaN where it was not reached;
+        ``'reached'`` : bool, footpoint reached;
+        ``'length'`` : arc length [km] from the start to the footpoint (or
+        to where the line was left);
+        ``'apex'`` : (3, ...) radius, colatitude and longitude of the
+        highest point of the traced segment;
+        ``'steps'`` : number of accepted steps.
+
+    """
+    coeffs = np.array(coeffs, dtype=np.float64)
+    x0 = to_cartesian(np.array(radius, dtype=np.float64),
+                      np.array(theta, dtype=np.float64),
+                      np.array(phi, dtype=np.float64))
+    shape = x0.shape[1:]
+    x = x0.reshape(3, -1).copy()
+    K = x.shape[1]
+
+    sigma = np.broadcast_to(np.array(direction, dtype=np.float64), shape).ravel().copy()
+    h = np.full(K, float(step))
+    length = np.zeros(K)
+    steps = np.zeros(K, dtype=int)
+    reached = np.zeros(K, dtype=bool)
+    active = np.ones(K, dtype=bool)
+
+    # apex: the start point until a higher one is found
+    apex = x.copy()
+    r_apex = np.sqrt((x**2).sum(axis=0))
+
+    alt = _altitude(x)
+    k1, _ = field_direction(coeffs, x, nmax)
+    k1 = k1*sigma
+
+    tt = np.linspace(0., 1., 17)[:, None, None]
+
+    for _ in range(max_steps):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+
+        xa = x[:, idx]
+        ha = h[idx]
+        sa = sigma[idx]
+
+        # Dormand-Prince stages (the first one is the last of the previous step)
+        k = [k1[:, idx]]
+        for i in range(1, 7):
+            xi = xa + ha*sum(a*kj for a, kj in zip(_A[i], k) if a != 0.)
+            ki, _ = field_direction(coeffs, xi, nmax)
+            k.append(ki*sa)
+        x5 = xa + ha*sum(b*kj for b, kj in zip(_B5, k) if b != 0.)
+        x4 = xa + ha*sum(b*kj for b, kj in zip(_B4, k) if b != 0.)
+        err = np.sqrt(((x5 - x4)**2).sum(axis=0))
+
+        alt5 = _altitude(x5)
+        ok = err <= tol
+        below = ok & (alt5 < h_stop - tol)
+        at_foot = ok & ~below & (alt5 <= h_stop + tol)
+
+        # crossing h_stop: shorten the step (secant estimate) and retry
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = (alt[idx] - h_stop)/(alt[idx] - alt5)
+        f = np.clip(np.nan_to_num(f), 0., 1.)
+        at_start = below & (alt[idx] - h_stop <= tol)
+
+        accept = ok & (~below | at_start)
+        new_x = np.where(at_start, xa, x5)
+        ds = np.where(at_start, 0., ha)
+
+        # apex on the cubic Hermite interpolant of the accepted steps
+        a_idx = idx[accept & ~at_start]
+        if a_idx.size:
+            sel = accept & ~at_start
+            p0, p1 = xa[:, sel], x5[:, sel]
+            m0, m1 = k[0][:, sel]*ha[sel], k[6][:, sel]*ha[sel]
+
+            def hermite(t):
+                return ((2*t**3 - 3*t**2 + 1)*p0 + (t**3 - 2*t**2 + t)*m0
+                        + (-2*t**3 + 3*t**2)*p1 + (t**3 - t**2)*m1)
+
+            rh = np.sqrt((hermite(tt)**2).sum(axis=1))
+            j = rh.argmax(axis=0)
+            # parabola through the largest sample and its neighbours
+            n = np.arange(j.size)
+            jm, jp = np.maximum(j-1, 0), np.minimum(j+1, tt.size-1)
+            curv = rh[jm, n] - 2*rh[j, n] + rh[jp, n]
+            dt = tt[1, 0, 0] - tt[0, 0, 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                shift = np.where(curv < 0, 0.5*dt*(rh[jm, n] - rh[jp, n])/curv, 0.)
+            t_best = np.clip(tt[j, 0, 0] + np.nan_to_num(shift), 0., 1.)
+            x_best = hermite(t_best)
+            r_best = np.sqrt((x_best**2).sum(axis=0))
+            better = r_best > r_apex[a_idx]
+            apex[:, a_idx[better]] = x_best[:, better]
+            r_apex[a_idx[better]] = r_best[better]
+
+        g = idx[accept]
+        x[:, g] = new_x[:, accept]
+        length[g] += ds[accept]
+        steps[g] += 1
+        alt[g] = np.where(at_start, alt[idx], alt5)[accept]
+        k1[:, g] = np.where(at_start, k[0], k[6])[:, accept]
+
+        done = idx[(at_foot | at_start)]
+        reached[done] = True
+        active[done] = False
+
+        r5 = np.sqrt((x5**2).sum(axis=0))
+        gone = idx[accept & (r5 > r_max)]
+        active[gone] = False
+
+        # next step size
+        with np.errstate(divide='ignore'):
+            fac = np.clip(0.9*(tol/np.maximum(err, 1e-300))**0.2, 0.2, 5.)
+        h[idx] = np.where(ok & below & ~at_start, ha*np.maximum(f, 1e-3),
+                          np.minimum(ha*fac, max_step))
+
+    foot = np.full((3, K), np.nan)
+    foot[:, reached] = np.stack(to_spherical(x[:, reached]))
+
+    return {'foot': foot.reshape((3,) + shape),
+            'reached': reached.reshape(shape),
+            'length': length.reshape(shape),
+            'apex': np.stack(to_spherical(apex)).reshape((3,) + shape),
+            'steps': steps.reshape(shape)}
+
+
+def field_line_quantities(coeffs, radius, theta, phi, nmax=None, h_stop=0.,
+                          **kwargs):
+    """
+    Trace field lines through the given points in both directions.
+
+    Parameters
+    ----------
+    coeffs, radius, theta, phi, nmax, h_stop :
+        As in :func:`trace_field_lines`.
+    **kwargs :
+        Passed on to :func:`trace_field_lines` (``tol``, ``step``, ...).
+
+    Returns
+    -------
+    lines : dict of ndarrays, shape (...)
+        ``'foot_north'`` and ``'foot_south'`` : (3, ...) footpoints along B
+        and along -B (radius [km], colatitude, longitude [degrees]);
+        ``'closed'`` : both footpoints reached;
+        ``'length'`` : arc length [km] between the footpoints;
+        ``'length_north'``, ``'length_south'`` : arc length from the point
+        to each footpoint;
+        ``'apex'`` : (3, ...) highest point of the line;
+        ``'apex_height'`` : apex radius minus the Earth's average radius [km].
+
+    """
+    radius, theta, phi = np.broadcast_arrays(np.array(radius, dtype=np.float64),
+                                             np.array(theta, dtype=np.float64),
+                                             np.array(phi, dtype=np.float64))
+    # both directions in one batch
+    both = trace_field_lines(coeffs, np.stack([radius, radius]),
+                             np.stack([theta, theta]), np.stack([phi, phi]),
+                             direction=np.array([1., -1.]).reshape((2,) + (1,)*radius.ndim),
+                             nmax=nmax, h_stop=h_stop, **kwargs)
+
+    up = both['apex'][0, 0] >= both['apex'][0, 1]
+    apex = np.where(up, both['apex'][:, 0], both['apex'][:, 1])
+
+    return {'foot_north': both['foot'][:, 0],
+            'foot_south': both['foot'][:, 1],
+            'closed': both['reached'][0] & both['reached'][1],
+            'length': both['length'][0] + both['length'][1],
+            'length_north': both['length'][0],
+            'length_south': both['length'][1],
+            'apex': apex,
+            'apex_height': apex[0] - RE}
+
+
+def _rk4_step(coeffs, x, ds, sigma, nmax):
+    """One classical Runge-Kutta step of length ``ds`` along sigma*B/|B|."""
+    k1 = field_direction(coeffs, x, nmax)[0]*sigma
+    k2 = field_direction(coeffs, x + 0.5*ds*k1, nmax)[0]*sigma
+    k3 = field_direction(coeffs, x + 0.5*ds*k2, nmax)[0]*sigma
+    k4 = field_direction(coeffs, x + ds*k3, nmax)[0]*sigma
+    return x + ds/6*(k1 + 2*k2 + 2*k3 + k4)
+
+
+def sample_field_lines(coeffs, radius, theta, phi, h_bottom, h_top, ds=10.,
+                       nmax=None, tol=1e-3, max_steps=20000):
+    """
+    Sample the parts of field lines that lie in the shell between the
+    geodetic altitudes ``h_bottom`` and ``h_top``.
+
+    Each line starts at the given point (normally at ``h_bottom``) going
+    upwards and is followed with fixed steps ``ds`` while it is inside the
+    shell. Where a line leaves through ``h_top`` the part above is jumped
+    over with :func:`trace_field_lines` and sampling resumes where it comes
+    back, until the line reaches ``h_bottom`` in the conjugate hemisphere.
+    Every step gives one sample at the middle of its chord, weighted by the
+    length of the step inside the shell (midpoint rule), so that
+    ``sum(weights*f(points))`` approximates the integral of ``f`` along the
+    line inside the shell.
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion (one date).
+    radius, theta, phi : float or ndarray, shape (...)
+        Geocentric radius [km], colatitude and longitude [degrees] of the
+        starting points, broadcast together.
+    h_bottom, h_top : float
+        Geodetic altitudes [km] of the bottom and top of the shell.
+    ds : float, optional
+        Step in km (default is 10).
+    nmax : int, positive, optional
+        Maximum degree (default is given by ``coeffs``).
+    tol : float, optional
+        Tolerance in km of the jumps above ``h_top`` (default is 1e-3).
+    max_steps : int, optional
+        Maximum number of fixed steps per line (default is 20000).
+
+    Returns
+    -------
+    samples : dict of ndarrays
+        ``'points'`` : (3, M) radius [km], colatitude and longitude
+        [degrees] of the samples;
+        ``'weights'`` : (M,) arc length [km] represented by each sample;
+        ``'line'`` : (M,) index of the line in the flattened starting points;
+        ``'ascending'`` : (M,) bool, sample between the start and the apex;
+        ``'foot'`` : (3, ...) conjugate point at ``h_bottom``, NaN where it
+        was not reached;
+        ``'length'`` : (...) arc length [km] from the start to the conjugate
+        point (or to where the line was left).
+
+    """
+    coeffs = np.array(coeffs, dtype=np.float64)
+    x0 = to_cartesian(np.array(radius, dtype=np.float64),
+                      np.array(theta, dtype=np.float64),
+                      np.array(phi, dtype=np.float64))
+    shape = x0.shape[1:]
+    x = x0.reshape(3, -1).copy()
+    K = x.shape[1]
+
+    # upwards at the start: the sign of the radial component of B
+    b, _ = field_direction(coeffs, x, nmax)
+    sigma = np.where((b*x).sum(axis=0) < 0, -1., 1.)
+
+    alt = _altitude(x)
+    length = np.zeros(K)
+    steps = np.zeros(K, dtype=int)
+    ascending = np.ones(K, dtype=bool)
+    reached = np.zeros(K, dtype=bool)
+    inside = np.ones(K, dtype=bool)    # sampled with fixed steps
+    above = np.zeros(K, dtype=bool)    # waiting for a jump above h_top
+
+    points, weights, lines, asc = [], [], [], []
+
+    while inside.any() or above.any():
+        while inside.any():
+            idx = np.flatnonzero(inside & (steps < max_steps))
+            inside[steps >= max_steps] = False
+            if idx.size == 0:
+                break
+
+            xa = x[:, idx]
+            xb = _rk4_step(coeffs, xa, ds, sigma[idx], nmax)
+            alt_b = _altitude(xb)
+            alt_a = alt[idx]
+
+            # part of the step inside the shell
+            out_top = alt_b > h_top
+            out_bottom = alt_b < h_bottom
+            with np.errstate(divide='ignore', invalid='ignore'):
+                f = np.where(out_top, (h_top - alt_a)/(alt_b - alt_a),
+                             np.where(out_bottom, (alt_a - h_bottom)/(alt_a - alt_b), 1.))
+            f = np.clip(np.nan_to_num(f), 0., 1.)
+            xe = xa + f*(xb - xa)
+
+            ra = np.sqrt((xa**2).sum(axis=0))
+            rb = np.sqrt((xb**2).sum(axis=0))
+            ascending[idx] &= rb >= ra
+
+            keep = f > 0
+            points.append(0.5*(xa + xe)[:, keep])
+            weights.append((f*ds)[keep])
+            lines.append(idx[keep])
+            asc.append(ascending[idx][keep])
+
+            x[:, idx] = np.where(out_bottom, xe, xb)
+            alt[idx] = np.where(out_bottom, h_bottom, alt_b)
+            length[idx] += np.where(out_bottom, f*ds, ds)
+            steps[idx] += 1
+
+            reached[idx[out_bottom]] = True
+            inside[idx[out_bottom | out_top]] = False
+            above[idx[out_top]] = True
+
+        idx = np.flatnonzero(above)
+        if idx.size:
+            # jump over the part above the shell
+            r, th, ph = to_spherical(x[:, idx])
+            jump = trace_field_lines(coeffs, r, th, ph, direction=sigma[idx],
+                                     nmax=nmax, h_stop=h_top, tol=tol)
+            back = jump['reached']
+            length[idx] += jump['length']
+            x[:, idx[back]] = to_cartesian(*jump['foot'][:, back])
+            alt[idx[back]] = _altitude(x[:, idx[back]])
+            ascending[idx] = False
+            above[idx] = False
+            inside[idx[back]] = True
+
+    foot = np.full((3, K), np.nan)
+    foot[:, reached] = np.stack(to_spherical(x[:, reached]))
+
+    points = np.concatenate(points, axis=1) if points else np.empty((3, 0))
+    return {'points': np.stack(to_spherical(points)),
+            'weights': np.concatenate(weights) if weights else np.empty(0),
+            'line': np.concatenate(lines) if lines else np.empty(0, dtype=int),
+            'ascending': np.concatenate(asc) if asc else np.empty(0, dtype=bool),
+            'foot': foot.reshape((3,) + shape),
+            'length': length.reshape(shape)}
@@ -15,6 +15,9 @@ Functions for computing main field, the non-linear coefficients of the field,
 """
 
 import os
+import json
+import hashlib
+import tempfile
 import numpy as np
 from numpy import degrees, radians
 from math import pi
@@ -44,7 +47,7 @@ def check_float(s):
         raise ValueError(f'Could not convert {s} to float.')
         
 
-def load_shcfile(filepath, leap_year=None):
+def load_shcfile(filepath, leap_year=None, cache=True):
     """
     Load shc-file and return coefficient arrays.
 
@@ -55,6 +58,17 @@ def load_shcfile(filepath, leap_year=None):
     leap_year : {True, False}, optional
         Take leap year in time conversion into account (default). Otherwise,
         use conversion factor of 365.25 days per year.
+    cache : {True, False} or str, optional
+        Keep a binary copy of the parsed values and memory-map it on later
+        loads instead of parsing the text again. With ``True`` (default) the
+        copy is written next to the shc-file (``<filepath>.npy`` and
+        ``<filepath>.json``); a directory name puts it there instead, e.g.
+        when the data directory is read-only (the copy is then named after
+        the file and a hash of its absolute path). The copy is reused only
+        while size, modification time or SHA-1 of the shc-file still match;
+        after a SHA-1 match the modification time is updated so that later
+        loads skip the hash again. If the directory is not writable, no copy
+        is kept and the file is parsed on every load.
 
     Returns
     -------
@@ -75,32 +89,132 @@ def load_shcfile(filepath, leap_year=None):
     """
     leap_year = True if leap_year is None else leap_year
 
-    with open(filepath, 'r') as f:
+    cache_dir = cache if isinstance(cache, str) else None
+    loaded = _load_shc_cache(filepath, cache_dir) if cache else None
+
+    if loaded is None:
+        data, parameters = _parse_shcfile(filepath)
+        if cache:
+            _save_shc_cache(filepath, data, parameters, cache_dir)
+    else:
+        data, parameters = loaded
+
+    time = data[:parameters['N']]
+    coeffs = data[parameters['N']:].reshape((-1, parameters['N']+2))
+    coeffs = np.squeeze(coeffs[:, 2:])  # discard columns with n and m
 
-        data = np.array([])
-        for line in f.readlines():
+    return igrf(time, coeffs, parameters)
+
+def _parse_shcfile(filepath):
+    """
+    Parse the text of a shc-file in a single pass.
+
+    Returns
+    -------
+    data : ndarray, shape (M,)
+        All numbers after the parameter line, in file order.
+    parameters : dict
+        Parameter line, see :func:`load_shcfile`.
+
+    """
+    values = None
+    fields = []
+    with open(filepath, 'r') as f:
+        for line in f:
 
             if line[0] == '#':
                 continue
 
-            read_line = np.fromstring(line, sep=' ')
-            if read_line.size == 7:
+            read_line = line.split()
+            if len(read_line) == 7:
                 name = os.path.split(filepath)[1]  # file name string
-                values = [name] + read_line.astype(np.int64).tolist()
+                values = [name] + [int(float(v)) for v in read_line]
 
             else:
-                data = np.append(data, read_line)
+                fields.extend(read_line)
 
-        # unpack parameter line
-        keys = ['SHC', 'nmin', 'nmax', 'N', 'order', 'step', 'start_year', 'end_year']
-        parameters = dict(zip(keys, values))
-        
-        time = data[:parameters['N']]
-        coeffs = data[parameters['N']:].reshape((-1, parameters['N']+2))
-        coeffs = np.squeeze(coeffs[:, 2:])  # discard columns with n and m
+    data = np.array(fields, dtype=np.float64)
 
+    # unpack parameter line
+    keys = ['SHC', 'nmin', 'nmax', 'N', 'order', 'step', 'start_year', 'end_year']
+    parameters = dict(zip(keys, values))
 
-    return igrf(time, coeffs, parameters)
+    return data, parameters
+
+def _shc_cache_paths(filepath, cache_dir=None):
+    if cache_dir is None:
+        return filepath + '.npy', filepath + '.json'
+    path = os.path.abspath(filepath)
+    name = '{0}-{1}'.format(os.path.split(path)[1],
+                            hashlib.sha1(path.encode()).hexdigest()[:12])
+    name = os.path.join(cache_dir, name)
+    return name + '.npy', name + '.json'
+
+def _file_sha1(filepath):
+    with open(filepath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _load_shc_cache(filepath, cache_dir=None):
+    """
+    Return ``(data, parameters)`` from the binary copy of a shc-file, or
+    ``None`` if there is no valid copy.
+    """
+    npy_path, json_path = _shc_cache_paths(filepath, cache_dir)
+    try:
+        st = os.stat(filepath)
+        with open(json_path, 'r') as f:
+            meta = json.load(f)
+        if meta['size'] != st.st_size:
+            return None
+        touched = meta['mtime_ns'] != st.st_mtime_ns
+        if touched:
+            # touched or copied: still valid if the content is the same
+            if meta['sha1'] != _file_sha1(filepath):
+                return None
+        data = np.load(npy_path, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if touched:
+        # remember the new modification time, so the next load skips the hash
+        meta['mtime_ns'] = st.st_mtime_ns
+        _write_json(json_path, meta)
+
+    parameters = meta['parameters']
+    parameters['SHC'] = os.path.split(filepath)[1]
+    return data, parameters
+
+def _save_shc_cache(filepath, data, parameters, cache_dir=None):
+    """Write the binary copy of a shc-file; silently skipped on I/O errors."""
+    npy_path, json_path = _shc_cache_paths(filepath, cache_dir)
+    try:
+        st = os.stat(filepath)
+        meta = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                'sha1': _file_sha1(filepath), 'parameters': parameters}
+
+        # write to temporary files and rename, so that concurrent processes
+        # never see a partial copy; the json is written last
+        folder = os.path.dirname(os.path.abspath(npy_path))
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp, npy_path)
+    except OSError:
+        return
+
+    _write_json(json_path, meta)
+
+def _write_json(json_path, meta):
+    """Atomically replace a json file; silently skipped on I/O errors."""
+    try:
+        folder = os.path.dirname(os.path.abspath(json_path))
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, json_path)
+    except OSError:
+        pass
 
 def check_lat_lon_bounds(latd, latm, lond, lonm):
     
@@ -141,6 +255,35 @@ def check_lat_lon_bounds(latd, latm, lond, lonm):
     
     return lat, lon
 
+def check_lat_lon_arrays(lat, lon):
+    """ Check the bounds of arrays of decimal latitudes and longitudes
+    (-90 to +90 and -360 to +360 degrees), the array counterpart of 
+    check_lat_lon_bounds
+    
+    Parameters
+    ----------
+    lat, lon : array_like of int or float
+    
+    Returns
+    -------
+    lat, lon : ndarray of float64
+    
+    Otherwise, an exception is raised
+    
+    """
+    try:
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f'Could not convert {lat} or {lon} to float.')
+    
+    if lat.size and not (np.all(lat >= -90) and np.all(lat <= 90)):
+        raise ValueError(f'Latitude {np.nanmin(lat)} or {np.nanmax(lat)} out of bounds.')
+    if lon.size and not (np.all(lon >= -360) and np.all(lon <= 360)):
+        raise ValueError(f'Longitude {np.nanmin(lon)} or {np.nanmax(lon)} out of bounds.')
+    
+    return lat, lon
+
 def gg_to_geo(h, gdcolat):
     """
     Compute geocentric colatitude and radius from geodetic colatitude and
@@ -195,7 +338,8 @@ def gg_to_geo(h, gdcolat):
     sd    = (a2-b2)*ctgd*stgd/(rho*rad)
     
     cthc  = ctgd*cd - stgd*sd           # Also: sthc = stgd*cd + ctgd*sd
-    thc   = np.rad2deg(np.arccos(cthc)) # arccos returns values in [0, pi]
+    # round-off can push |cthc| just above 1 at the poles
+    thc   = np.rad2deg(np.arccos(np.clip(cthc, -1., 1.))) # arccos returns values in [0, pi]
     
     return rad, thc, sd, cd
 
@@ -397,55 +541,8 @@ def synth_values(coeffs, radius, theta, phi, \
     theta = np.array(theta, dtype=np.float64)
     phi = np.array(phi, dtype=np.float64)
 
-    if np.amin(theta) <= 0.0 or np.amax(theta) >= 180.0:
-        if np.amin(theta) == 0.0 or np.amax(theta) == 180.0:
-            warnings.warn('The geographic poles are included.')
-        else:
-            raise ValueError('Colatitude outside bounds [0, 180].')
-
-    if nmin is None:
-        nmin = 1
-    else:
-        assert nmin > 0, 'Only positive nmin allowed.'
-
-    # handle optional argument: nmax
-    nmax_coeffs = int(np.sqrt(coeffs.shape[-1] + 1) - 1)  # degree
-    if nmax is None:
-        nmax = nmax_coeffs
-    else:
-        assert nmax > 0, 'Only positive nmax allowed.'
-
-    if nmax > nmax_coeffs:
-        warnings.warn('Supplied nmax = {0} and nmin = {1} is '
-                      'incompatible with number of model coefficients. '
-                      'Using nmax = {2} instead.'.format(
-                        nmax, nmin, nmax_coeffs))
-        nmax = nmax_coeffs
-
-    if nmax < nmin:
-        raise ValueError(f'Nothing to compute: nmax < nmin ({nmax} < {nmin}.)')
-
-    # handle grid option
-    grid = False if grid is None else grid
-
-    # manually broadcast input grid on surface
-    if grid:
-        theta = theta[..., None]  # first dimension is theta
-        phi = phi[None, ...]  # second dimension is phi
-
-    # get shape of broadcasted result
-    try:
-        b = np.broadcast(radius, theta, phi,
-                         np.broadcast_to(0, coeffs.shape[:-1]))
-    except ValueError:
-        print('Cannot broadcast grid shapes (excl. last dimension of coeffs):')
-        print(f'radius: {radius.shape}')
-        print(f'theta:  {theta.shape}')
-        print(f'phi:    {phi.shape}')
-        print(f'coeffs: {coeffs.shape[:-1]}')
-        raise
-
-    grid_shape = b.shape
+    nmax, nmin = _check_synth_args(coeffs, theta, nmax, nmin)
+    theta, phi, grid_shape = _broadcast_grid(radius, theta, phi, coeffs, grid)
 
     # initialize radial dependence given the source
     r_n = radius**(-(nmin+2))
@@ -498,6 +595,350 @@ def synth_values(coeffs, radius, theta, phi, \
  
     return B_radius, B_theta, B_phi
 
+
+def _check_synth_args(coeffs, theta, nmax, nmin):
+    """
+    Check the colatitudes and the degree range of a synthesis.
+
+    Shared by the synthesis routines. ``nmax`` defaults to the degree of
+    ``coeffs`` and is lowered to it with a warning if larger; with
+    ``coeffs=None`` (geometry only, as in :class:`synth_plan`) ``nmax`` must
+    be given. Returns ``(nmax, nmin)``.
+
+    """
+    if np.amin(theta) <= 0.0 or np.amax(theta) >= 180.0:
+        if np.amin(theta) == 0.0 or np.amax(theta) == 180.0:
+            warnings.warn('The geographic poles are included.')
+        else:
+            raise ValueError('Colatitude outside bounds [0, 180].')
+
+    if nmin is None:
+        nmin = 1
+    else:
+        assert nmin > 0, 'Only positive nmin allowed.'
+
+    if coeffs is None:
+        assert nmax is not None and nmax > 0, 'Only positive nmax allowed.'
+    else:
+        # handle optional argument: nmax
+        nmax_coeffs = int(np.sqrt(coeffs.shape[-1] + 1) - 1)  # degree
+        if nmax is None:
+            nmax = nmax_coeffs
+        else:
+            assert nmax > 0, 'Only positive nmax allowed.'
+
+        if nmax > nmax_coeffs:
+            warnings.warn('Supplied nmax = {0} and nmin = {1} is '
+                          'incompatible with number of model coefficients. '
+                          'Using nmax = {2} instead.'.format(
+                            nmax, nmin, nmax_coeffs))
+            nmax = nmax_coeffs
+
+    if nmax < nmin:
+        raise ValueError(f'Nothing to compute: nmax < nmin ({nmax} < {nmin}.)')
+
+    return nmax, nmin
+
+
+def _broadcast_grid(radius, theta, phi, coeffs=None, grid=None):
+    """
+    Apply the ``grid`` option to ``theta`` and ``phi`` and return them with
+    the broadcast shape of the result (including the leading dimensions of
+    ``coeffs`` if given).
+
+    """
+    # handle grid option
+    grid = False if grid is None else grid
+
+    # manually broadcast input grid on surface
+    if grid:
+        theta = theta[..., None]  # first dimension is theta
+        phi = phi[None, ...]  # second dimension is phi
+
+    # get shape of broadcasted result
+    shapes = [radius, theta, phi]
+    if coeffs is not None:
+        shapes.append(np.broadcast_to(0, coeffs.shape[:-1]))
+    try:
+        b = np.broadcast(*shapes)
+    except ValueError:
+        if coeffs is None:
+            print('Cannot broadcast grid shapes:')
+        else:
+            print('Cannot broadcast grid shapes (excl. last dimension of coeffs):')
+        print(f'radius: {radius.shape}')
+        print(f'theta:  {theta.shape}')
+        print(f'phi:    {phi.shape}')
+        if coeffs is not None:
+            print(f'coeffs: {coeffs.shape[:-1]}')
+        raise
+
+    return theta, phi, b.shape
+
+
+class synth_plan:
+    """
+    Geometry-dependent part of :func:`synth_values` for a fixed set of points.
+
+    The associated Legendre polynomials, the radial factors
+    :math:`r^{-(n+2)}`, the pole handling of the azimuthal component and the
+    ``cos(m*phi)``/``sin(m*phi)`` tables only depend on ``radius``, ``theta``
+    and ``phi``. They are computed once here, and :meth:`values` then
+    evaluates any number of coefficient vectors on the same points, e.g. the
+    main field, SV and epoch-start field of ``pyigrf_clara_0_6``.
+
+    Parameters
+    ----------
+    radius, theta, phi, nmin, grid :
+        As in :func:`synth_values`.
+    nmax : int, positive
+        Maximum degree of the expansion. Coefficient vectors passed to
+        :meth:`values` must have at least ``nmax(nmax+2)`` entries.
+
+    Examples
+    --------
+    .. code-block:: python
+
+      plan = iut.synth_plan(radius, theta, phi, 13)
+      Br, Bt, Bp = plan.values(coeffs)
+      Brs, Bts, Bps = plan.values(coeffs_sv)
+
+    """
+
+    def __init__(self, radius, theta, phi, nmax, nmin=None, grid=None):
+
+        radius = np.array(radius, dtype=np.float64) / 6371.2  # Earth's average radius
+        theta = np.array(theta, dtype=np.float64)
+        phi = np.array(phi, dtype=np.float64)
+
+        nmax, nmin = _check_synth_args(None, theta, nmax, nmin)
+        theta, phi, self.grid_shape = _broadcast_grid(radius, theta, phi, grid=grid)
+        self.nmin = nmin
+        self.nmax = nmax
+
+        # initialize radial dependence given the source
+        r_n = radius**(-(nmin+2))
+
+        # compute associated Legendre polynomials as (n, m, theta-points)-array
+        Pnm = legendre_poly(nmax, theta)
+
+        # save sinth for fast access
+        sinth = Pnm[1, 1]
+
+        # calculate cos(m*phi) and sin(m*phi) as (m, phi-points)-array
+        phi = radians(phi)
+        self.cmp = np.cos(np.multiply.outer(np.arange(nmax+1), phi))
+        self.smp = np.sin(np.multiply.outer(np.arange(nmax+1), phi))
+
+        # per degree n, list over order m of the factors multiplying the
+        # coefficients in B_radius, B_theta and B_phi
+        self.terms = []
+        for n in range(nmin, nmax+1):
+            terms_n = [((n+1) * Pnm[n, 0] * r_n, -Pnm[0, n+1] * r_n, None)]
+
+            for m in range(1, n+1):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    # handle poles using L'Hopital's rule
+                    div_Pnm = np.where(theta == 0., Pnm[m, n+1], Pnm[n, m] / sinth)
+                    div_Pnm = np.where(theta == degrees(pi), -Pnm[m, n+1], div_Pnm)
+
+                terms_n.append(((n+1) * Pnm[n, m] * r_n,
+                                -Pnm[m, n+1] * r_n,
+                                m * div_Pnm * r_n))
+
+            self.terms.append(terms_n)
+
+            r_n = r_n / radius  # equivalent to r_n = radius**(-(n+2))
+
+    @property
+    def nbytes(self):
+        """Memory held by the precomputed tables, in bytes."""
+        return (self.cmp.nbytes + self.smp.nbytes
+                + sum(t.nbytes for terms_n in self.terms for terms_m in terms_n
+                      for t in terms_m if t is not None))
+
+    def values(self, coeffs):
+        """
+        Evaluate the field components for one set of coefficients.
+
+        Parameters
+        ----------
+        coeffs : ndarray, shape (..., N)
+            Coefficients of the spherical harmonic expansion, as in
+            :func:`synth_values`. Leading dimensions must broadcast with the
+            grid of the plan.
+
+        Returns
+        -------
+        B_radius, B_theta, B_phi : ndarray, shape (...)
+            Radial, colatitude and azimuthal field components.
+
+        """
+        coeffs = np.array(coeffs, dtype=np.float64)
+
+        if coeffs.shape[-1] < self.nmax*(self.nmax+2):
+            raise ValueError(f'Plan needs {self.nmax*(self.nmax+2)} coefficients '
+                             f'(nmax = {self.nmax}), got {coeffs.shape[-1]}.')
+
+        try:
+            b = np.broadcast(np.broadcast_to(0, self.grid_shape),
+                             np.broadcast_to(0, coeffs.shape[:-1]))
+        except ValueError:
+            print('Cannot broadcast grid shapes (excl. last dimension of coeffs):')
+            print(f'grid:   {self.grid_shape}')
+            print(f'coeffs: {coeffs.shape[:-1]}')
+            raise
+
+        grid_shape = b.shape
+        cmp = self.cmp
+        smp = self.smp
+
+        # allocate arrays in memory
+        B_radius = np.zeros(grid_shape)
+        B_theta = np.zeros(grid_shape)
+        B_phi = np.zeros(grid_shape)
+
+        num = self.nmin**2 - 1
+        for n, terms_n in zip(range(self.nmin, self.nmax+1), self.terms):
+            t_r, t_t, _ = terms_n[0]
+            B_radius += t_r * coeffs[..., num]
+
+            B_theta += t_t * coeffs[..., num]
+
+            num += 1
+
+            for m in range(1, n+1):
+                t_r, t_t, t_p = terms_n[m]
+                gh_c = coeffs[..., num] * cmp[m] + coeffs[..., num+1] * smp[m]
+
+                B_radius += t_r * gh_c
+
+                B_theta += t_t * gh_c
+
+                B_phi += (t_p * (coeffs[..., num] * smp[m]
+                                 - coeffs[..., num+1] * cmp[m]))
+
+                num += 2
+
+        return B_radius, B_theta, B_phi
+
+    def design_matrix(self):
+        """
+        Design matrix of the plan: field components per unit coefficient.
+
+        The field is linear in the Gauss coefficients, so for the points of
+        the plan ``B_radius.ravel() = A[0] @ coeffs``, and likewise for
+        ``B_theta`` (``A[1]``) and ``B_phi`` (``A[2]``). The matrix is built
+        on the first call and kept in the plan.
+
+        Returns
+        -------
+        A : ndarray, shape (3, P, nmax(nmax+2))
+            Design matrix for B_radius, B_theta and B_phi, where ``P`` is the
+            number of points of the plan grid. Columns of degrees below
+            ``nmin`` are zero.
+
+        """
+        if getattr(self, '_design', None) is not None:
+            return self._design
+
+        ncoeff = self.nmax*(self.nmax+2)
+        npts = int(np.prod(self.grid_shape))
+        A = np.zeros((3, npts, ncoeff))
+
+        def col(a):
+            return np.broadcast_to(a, self.grid_shape).ravel()
+
+        cmp = self.cmp
+        smp = self.smp
+
+        num = self.nmin**2 - 1
+        for n, terms_n in zip(range(self.nmin, self.nmax+1), self.terms):
+            t_r, t_t, _ = terms_n[0]
+            A[0, :, num] = col(t_r)
+            A[1, :, num] = col(t_t)
+            num += 1
+
+            for m in range(1, n+1):
+                t_r, t_t, t_p = terms_n[m]
+                A[0, :, num] = col(t_r * cmp[m])
+                A[0, :, num+1] = col(t_r * smp[m])
+                A[1, :, num] = col(t_t * cmp[m])
+                A[1, :, num+1] = col(t_t * smp[m])
+                A[2, :, num] = col(t_p * smp[m])
+                A[2, :, num+1] = col(-t_p * cmp[m])
+                num += 2
+
+        self._design = A
+        return A
+
+    def values_many(self, coeffs):
+        """
+        Evaluate the field components for many coefficient sets at once.
+
+        All snapshots are computed with a single matrix product of the
+        design matrix (see :meth:`design_matrix`) with the coefficients.
+
+        Parameters
+        ----------
+        coeffs : ndarray, shape (N, K)
+            ``K`` coefficient sets as columns, i.e. the layout of
+            ``igrf.coeffs`` from :func:`load_shcfile`. Only the first
+            ``nmax(nmax+2)`` rows are used.
+
+        Returns
+        -------
+        B_radius, B_theta, B_phi : ndarray, shape (..., K)
+            Field components on the plan grid, last dimension over the
+            coefficient sets.
+
+        Examples
+        --------
+        .. code-block:: python
+
+          igrf = iut.load_shcfile('IGRF13.shc')
+          f = interpolate.interp1d(igrf.time, igrf.coeffs)
+          plan = iut.synth_plan(radius, theta, phi, 13)
+          Br, Bt, Bp = plan.values_many(f(np.arange(1900., 2025.)))
+
+        """
+        coeffs = np.asarray(coeffs, dtype=np.float64)
+        if coeffs.ndim == 1:
+            coeffs = coeffs[:, None]
+
+        ncoeff = self.nmax*(self.nmax+2)
+        if coeffs.shape[0] < ncoeff:
+            raise ValueError(f'Plan needs {ncoeff} coefficients '
+                             f'(nmax = {self.nmax}), got {coeffs.shape[0]}.')
+
+        A = self.design_matrix()
+        B = A.reshape(-1, ncoeff) @ coeffs[:ncoeff]
+        B = B.reshape((3,) + self.grid_shape + (coeffs.shape[1],))
+
+        return B[0], B[1], B[2]
+
+
+def design_matrix(radius, theta, phi, nmax, nmin=None, grid=None):
+    """
+    Design matrix of the spherical harmonic synthesis at fixed points.
+
+    Convenience wrapper around :meth:`synth_plan.design_matrix`; see there
+    for the layout. Use :meth:`synth_plan.values_many` to evaluate many
+    coefficient sets (e.g. many dates) with one matrix product.
+
+    Parameters
+    ----------
+    radius, theta, phi, nmax, nmin, grid :
+        As in :class:`synth_plan`.
+
+    Returns
+    -------
+    A : ndarray, shape (3, P, nmax(nmax+2))
+        Design matrix for B_radius, B_theta and B_phi at the ``P`` points.
+
+    """
+    return synth_plan(radius, theta, phi, nmax, nmin=nmin, grid=grid).design_matrix()
+
 def legendre_poly(nmax, theta):
     """
     Returns associated Legendre polynomials `P(n,m)` (Schmidt quasi-normalized)
@@ -560,6 +1001,650 @@ def legendre_poly(nmax, theta):
 
     return Pnm
 
+def legendre_poly_rows(nmax, theta):
+    """
+    Generator of the rows of :func:`legendre_poly`, one degree at a time.
+
+    Only the two previous degrees are kept for the recursion, so memory is
+    of order ``nmax * theta.size`` instead of ``nmax**2 * theta.size``.
+    Values are identical to those of :func:`legendre_poly`.
+
+    Parameters
+    ----------
+    nmax : int, positive
+        Maximum degree of the spherical expansion.
+    theta : ndarray, shape (...)
+        Colatitude in degrees :math:`[0^\\circ, 180^\\circ]`
+        of arbitrary shape.
+
+    Yields
+    ------
+    n : int
+        Degree, from 1 to ``nmax``.
+    P_n : ndarray, shape (nmax+2, ...)
+        `P(n,m)` := ``P_n[m, ...]`` for ``m <= n``. The array is reused by
+        the generator, copy it if it must be kept.
+    dP_n : ndarray, shape (nmax+1, ...)
+        `dP(n,m)` := ``dP_n[m, ...]``, derivative with respect to theta.
+
+    """
+
+    costh = np.cos(radians(theta))
+    sinth = np.sqrt(1-costh**2)
+
+    rootn = np.sqrt(np.arange(2 * nmax**2 + 1))
+
+    # rolling buffers for degrees n-2, n-1 and n
+    P_2 = np.zeros((nmax+2,) + costh.shape)
+    P_1 = np.zeros((nmax+2,) + costh.shape)
+    P_n = np.zeros((nmax+2,) + costh.shape)
+    dP_n = np.zeros((nmax+1,) + costh.shape)
+    P_1[0] = 1
+
+    # Recursion relations after Langel "The Main Field" (1987),
+    # eq. (27) and Table 2 (p. 256), ordered by degree
+    for n in range(1, nmax+1):
+        for m in range(n-1):
+            d = n * n - m * m
+            e = n + n - 1
+            P_n[m] = ((e * costh * P_1[m] - rootn[d-e] * P_2[m])
+                      / rootn[d])
+
+        Pnm_tmp = rootn[n+n-1] * P_1[n-1]
+        P_n[n-1] = costh * Pnm_tmp
+        if n == 1:
+            P_n[1] = sinth
+        else:
+            P_n[n] = sinth*Pnm_tmp / rootn[n+n]
+
+        # derivatives, they only need the current degree
+        if n == 1:
+            dP_n[0] = -P_n[1]
+            dP_n[1] = P_n[0]
+        else:
+            dP_n[0] = -np.sqrt((n*n + n) / 2) * P_n[1]
+            dP_n[1] = ((np.sqrt(2 * (n*n + n)) * P_n[0]
+                        - np.sqrt((n*n + n - 2)) * P_n[2]) / 2)
+
+            for m in range(2, n):
+                dP_n[m] = (0.5*(np.sqrt((n + m) * (n - m + 1)) * P_n[m-1]
+                           - np.sqrt((n + m + 1) * (n - m)) * P_n[m+1]))
+
+            dP_n[n] = np.sqrt(2 * n) * P_n[n-1] / 2
+
+        yield n, P_n, dP_n
+
+        P_2, P_1, P_n = P_1, P_n, P_2
+
+def synth_values_stream(coeffs, radius, theta, phi, \
+                        nmax=None, nmin=None, grid=None):
+    """
+    Same as :func:`synth_values`, with bounded memory for large grids.
+
+    The Legendre recursion is streamed degree by degree
+    (:func:`legendre_poly_rows`) and its terms are accumulated directly in
+    B_radius, B_theta and B_phi, so the full ``(nmax+1, nmax+2, ...)``
+    table of :func:`legendre_poly` is never held. Peak memory is a few
+    arrays of the grid size plus ``O(nmax)`` arrays of the shape of
+    ``theta`` and of ``phi`` (small when the grid is built by broadcasting,
+    e.g. theta ``(nlat, 1, nh)`` and phi ``(1, nlon, 1)``).
+
+    Parameters and returns are the same as :func:`synth_values`.
+
+    """
+
+    # ensure ndarray inputs
+    coeffs = np.array(coeffs, dtype=np.float64)
+    radius = np.array(radius, dtype=np.float64) / 6371.2  # Earth's average radius
+    theta = np.array(theta, dtype=np.float64)
+    phi = np.array(phi, dtype=np.float64)
+
+    nmax, nmin = _check_synth_args(coeffs, theta, nmax, nmin)
+
+    theta, phi, grid_shape = _broadcast_grid(radius, theta, phi, coeffs, grid)
+
+    # initialize radial dependence given the source
+    r_n = radius**(-(nmin+2))
+
+    # calculate cos(m*phi) and sin(m*phi) as (m, phi-points)-array
+    phi = radians(phi)
+    cmp = np.cos(np.multiply.outer(np.arange(nmax+1), phi))
+    smp = np.sin(np.multiply.outer(np.arange(nmax+1), phi))
+
+    # allocate arrays in memory
+    B_radius = np.zeros(grid_shape)
+    B_theta = np.zeros(grid_shape)
+    B_phi = np.zeros(grid_shape)
+
+    sinth = None
+    num = nmin**2 - 1
+    for n, P_n, dP_n in legendre_poly_rows(nmax, theta):
+        if n == 1:
+            sinth = P_n[1].copy()  # save sinth for the azimuthal component
+        if n < nmin:
+            continue
+
+        B_radius += (n+1) * P_n[0] * r_n * coeffs[..., num]
+
+        B_theta += -dP_n[0] * r_n * coeffs[..., num]
+
+        num += 1
+
+        for m in range(1, n+1):
+            gh_c = coeffs[..., num] * cmp[m] + coeffs[..., num+1] * smp[m]
+
+            B_radius += (n+1) * P_n[m] * r_n * gh_c
+
+            B_theta += -dP_n[m] * r_n * gh_c
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # handle poles using L'Hopital's rule
+                div_Pnm = np.where(theta == 0., dP_n[m], P_n[m] / sinth)
+                div_Pnm = np.where(theta == degrees(pi), -dP_n[m], div_Pnm)
+
+            B_phi += (m * div_Pnm * r_n
+                      * (coeffs[..., num] * smp[m]
+                         - coeffs[..., num+1] * cmp[m]))
+
+            num += 2
+
+        r_n = r_n / radius  # equivalent to r_n = radius**(-(n+2))
+
+    return B_radius, B_theta, B_phi
+
+def synth_values_radial(coeffs, radius, theta, phi, \
+                        nmax=None, nmin=None, nnodes=5):
+    """
+    Field components on columns of many radii (altitude levels).
+
+    For a fixed direction the contribution of degree ``n`` only scales with
+    :math:`r^{-(n+2)}`, so the angular sums over the order ``m`` are done once
+    per column and every level costs ``O(nmax)`` per point. Geodetic
+    altitude levels do not share exactly the same geocentric colatitude
+    (see :func:`gg_to_geo`); this shift is handled by evaluating the angular
+    sums at ``nnodes`` Chebyshev nodes spanning the colatitudes of each
+    column and interpolating between them. The shift is a small fraction of
+    a degree, so the interpolation error is far below the rounding of the
+    IGRF coefficients (about 1e-6 nT with the default 5 nodes).
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion.
+    radius : ndarray, shape (..., L)
+        Radius in kilometers. The last dimension is the level axis.
+    theta : ndarray, shape (..., L)
+        Geocentric colatitude in degrees at each level.
+    phi : ndarray, shape (..., 1)
+        Longitude in degrees, constant along the level axis.
+    nmax, nmin : int, positive, optional
+        As in :func:`synth_values`.
+    nnodes : int, positive, optional
+        Number of colatitude nodes per column (default is 5).
+
+    Returns
+    -------
+    B_radius, B_theta, B_phi : ndarray, shape (..., L)
+        Radial, colatitude and azimuthal field components.
+
+    """
+
+    # ensure ndarray inputs
+    coeffs = np.array(coeffs, dtype=np.float64)
+    radius = np.array(radius, dtype=np.float64) / 6371.2  # Earth's average radius
+    theta = np.array(theta, dtype=np.float64)
+    phi = np.array(phi, dtype=np.float64)
+
+    if coeffs.ndim != 1:
+        raise ValueError('Only one set of coefficients is supported.')
+
+    nmax, nmin = _check_synth_args(coeffs, theta, nmax, nmin)
+
+    if phi.ndim == 0:
+        phi = phi[None]
+    grid_shape = np.broadcast(radius, theta, phi).shape
+
+    # Chebyshev nodes spanning the colatitudes of each column
+    th_min = np.amin(theta, axis=-1, keepdims=True)
+    th_max = np.amax(theta, axis=-1, keepdims=True)
+    mid = (th_max + th_min) / 2
+    half = (th_max - th_min) / 2
+    flat = half == 0.
+
+    t = np.cos(pi * (2*np.arange(nnodes) + 1) / (2*nnodes))
+    theta_nodes = mid + half * t.reshape((nnodes,) + (1,)*theta.ndim)
+
+    # Lagrange weights of each level with respect to the nodes; columns
+    # with a single colatitude just take the first node
+    x = (theta - mid) / np.where(flat, 1., half)
+    weights = np.ones((nnodes,) + x.shape)
+    for k in range(nnodes):
+        for j in range(nnodes):
+            if j != k:
+                weights[k] *= (x - t[j]) / (t[k] - t[j])
+    weights = np.where(flat, (np.arange(nnodes) == 0).reshape(
+        (nnodes,) + (1,)*theta.ndim), weights)
+
+    # angular quantities on the nodes, level axis dropped
+    theta_nodes = theta_nodes[..., 0]
+    phi = radians(phi[..., 0])
+    cmp = np.cos(np.multiply.outer(np.arange(nmax+1), phi))
+    smp = np.sin(np.multiply.outer(np.arange(nmax+1), phi))
+
+    B_radius = np.zeros(grid_shape)
+    B_theta = np.zeros(grid_shape)
+    B_phi = np.zeros(grid_shape)
+
+    # initialize radial dependence given the source
+    r_n = radius**(-(nmin+2))
+
+    sinth = None
+    num = nmin**2 - 1
+    for n, P_n, dP_n in legendre_poly_rows(nmax, theta_nodes):
+        if n == 1:
+            sinth = P_n[1].copy()
+        if n < nmin:
+            continue
+
+        # angular sums over m of degree n, shape (nnodes, ...)
+        a_r = (n+1) * P_n[0] * coeffs[num]
+        a_t = -dP_n[0] * coeffs[num]
+        a_p = np.zeros_like(a_r)
+        num += 1
+
+        for m in range(1, n+1):
+            gh_c = coeffs[num] * cmp[m] + coeffs[num+1] * smp[m]
+
+            a_r = a_r + (n+1) * P_n[m] * gh_c
+            a_t = a_t + -dP_n[m] * gh_c
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # handle poles using L'Hopital's rule
+                div_Pnm = np.where(theta_nodes == 0., dP_n[m], P_n[m] / sinth)
+                div_Pnm = np.where(theta_nodes == degrees(pi), -dP_n[m], div_Pnm)
+
+            a_p = a_p + m * div_Pnm * (coeffs[num] * smp[m]
+                                       - coeffs[num+1] * cmp[m])
+            num += 2
+
+        # interpolate to the levels and apply the radial factor: one small
+        # matrix product (1, nnodes) x (nnodes, L) per column
+        g = np.moveaxis(weights * r_n, 0, -2)
+        B_radius += (np.moveaxis(a_r, 0, -1)[..., None, :] @ g)[..., 0, :]
+        B_theta += (np.moveaxis(a_t, 0, -1)[..., None, :] @ g)[..., 0, :]
+        B_phi += (np.moveaxis(a_p, 0, -1)[..., None, :] @ g)[..., 0, :]
+
+        r_n = r_n / radius  # equivalent to r_n = radius**(-(n+2))
+
+    return B_radius, B_theta, B_phi
+
+def synth_values_fft(coeffs, radius, theta, nlon, phi0=0., \
+                     nmax=None, nmin=None):
+    """
+    Field components on a regular global longitude grid, using the FFT.
+
+    For each latitude ring the Legendre terms are summed over the degree
+    into Fourier coefficients in longitude, which are then transformed to
+    all ``nlon`` longitudes with one inverse real FFT per ring. Cost is
+    ``O(nrings * nmax**2 + nrings * nlon * log(nlon))`` instead of
+    ``O(nrings * nlon * nmax**2)`` for :func:`synth_values`, which matters
+    for fine grids and for models of higher degree than IGRF.
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion.
+    radius : float or ndarray, shape (...)
+        Radius in kilometers of each ring.
+    theta : float or ndarray, shape (...)
+        Colatitude in degrees of each ring. ``radius`` and ``theta`` are
+        broadcast together, e.g. ``(nlat, 1)`` and ``(1, nh)`` for rings at
+        several altitudes.
+    nlon : int
+        Number of longitudes, equally spaced over 360 degrees. Must be
+        larger than ``2*nmax``.
+    phi0 : float, optional
+        First longitude in degrees (default is 0). The longitudes are
+        ``phi0 + 360*j/nlon``.
+    nmax, nmin : int, positive, optional
+        As in :func:`synth_values`.
+
+    Returns
+    -------
+    B_radius, B_theta, B_phi : ndarray, shape (..., nlon)
+        Radial, colatitude and azimuthal field components, longitude as the
+        last dimension.
+
+    """
+
+    # ensure ndarray inputs
+    coeffs = np.array(coeffs, dtype=np.float64)
+    radius = np.array(radius, dtype=np.float64) / 6371.2  # Earth's average radius
+    theta = np.array(theta, dtype=np.float64)
+
+    if coeffs.ndim != 1:
+        raise ValueError('Only one set of coefficients is supported.')
+
+    nmax, nmin = _check_synth_args(coeffs, theta, nmax, nmin)
+
+    if nlon <= 2*nmax:
+        raise ValueError(f'nlon = {nlon} aliases degree nmax = {nmax}, '
+                         f'use nlon > {2*nmax}.')
+
+    ring_shape = np.broadcast(radius, theta).shape
+
+    # cosine (a) and sine (b) Fourier coefficients per order m and ring
+    a_r = np.zeros((nmax+1,) + ring_shape)
+    b_r = np.zeros((nmax+1,) + ring_shape)
+    a_t = np.zeros((nmax+1,) + ring_shape)
+    b_t = np.zeros((nmax+1,) + ring_shape)
+    a_p = np.zeros((nmax+1,) + ring_shape)
+    b_p = np.zeros((nmax+1,) + ring_shape)
+
+    # initialize radial dependence given the source
+    r_n = radius**(-(nmin+2))
+
+    sinth = None
+    num = nmin**2 - 1
+    for n, P_n, dP_n in legendre_poly_rows(nmax, theta):
+        if n == 1:
+            sinth = P_n[1].copy()
+        if n < nmin:
+            continue
+
+        a_r[0] += (n+1) * P_n[0] * r_n * coeffs[num]
+        a_t[0] += -dP_n[0] * r_n * coeffs[num]
+        num += 1
+
+        for m in range(1, n+1):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # handle poles using L'Hopital's rule
+                div_Pnm = np.where(theta == 0., dP_n[m], P_n[m] / sinth)
+                div_Pnm = np.where(theta == degrees(pi), -dP_n[m], div_Pnm)
+
+            f_r = (n+1) * P_n[m] * r_n
+            f_t = -dP_n[m] * r_n
+            f_p = m * div_Pnm * r_n
+
+            a_r[m] += f_r * coeffs[num]
+            b_r[m] += f_r * coeffs[num+1]
+            a_t[m] += f_t * coeffs[num]
+            b_t[m] += f_t * coeffs[num+1]
+            a_p[m] += -f_p * coeffs[num+1]
+            b_p[m] += f_p * coeffs[num]
+
+            num += 2
+
+        r_n = r_n / radius  # equivalent to r_n = radius**(-(n+2))
+
+    # sum_m a_m cos(m phi) + b_m sin(m phi) as an inverse real FFT, with
+    # the shift of the first longitude as a phase
+    m = np.arange(nmax+1)
+    scale = np.where(m == 0, nlon, nlon / 2) * np.exp(1j * m * radians(phi0))
+    scale = scale.reshape((nmax+1,) + (1,)*len(ring_shape))
+
+    def to_grid(a, b):
+        spec = np.zeros((nlon//2 + 1,) + ring_shape, dtype=np.complex128)
+        spec[:nmax+1] = scale * (a - 1j*b)
+        return np.moveaxis(np.fft.irfft(spec, n=nlon, axis=0), 0, -1)
+
+    return to_grid(a_r, b_r), to_grid(a_t, b_t), to_grid(a_p, b_p)
+
+def _dlegendre_coeffs(n, m):
+    """
+    Coefficients of dP(n,m)/dtheta as a combination of P(n,k), k = m-1, m+1
+    (the relations used at the end of :func:`legendre_poly`), as a list of
+    ``(k, c)`` pairs.
+
+    """
+    if m == 0:
+        return [(1, -np.sqrt((n*n + n) / 2))]
+    if m == 1:
+        pairs = [(0, np.sqrt(2 * (n*n + n)) / 2)]
+        if n > 1:
+            pairs.append((2, -np.sqrt(n*n + n - 2) / 2))
+        return pairs
+    pairs = [(m-1, 0.5*np.sqrt((n + m) * (n - m + 1)))]
+    if m < n:
+        pairs.append((m+1, -0.5*np.sqrt((n + m + 1) * (n - m))))
+    return pairs
+
+def synth_values_grad(coeffs, radius, theta, phi, \
+                      nmax=None, nmin=None, grid=None):
+    """
+    Field components and their analytic derivatives in r, theta and phi.
+
+    Same synthesis as :func:`synth_values`, with the partial derivatives of
+    each component summed in the same loop over (n, m). The theta
+    derivatives use the derivatives ``dP(n,m)`` of :func:`legendre_poly`;
+    the second derivative is obtained by applying the same linear relation
+    between ``dP(n,m)`` and ``P(n,m+-1)`` to ``dP(n,m+-1)``, so it stays
+    finite at the poles.
+
+    Parameters
+    ----------
+    coeffs, radius, theta, phi, nmax, nmin, grid :
+        As in :func:`synth_values`.
+
+    Returns
+    -------
+    B_radius, B_theta, B_phi : ndarray, shape (...)
+        Radial, colatitude and azimuthal field components.
+    dB : ndarray, shape (3, 3, ...)
+        ``dB[i, j]`` is the partial derivative of component ``i`` (radius,
+        theta, phi) with respect to coordinate ``j``: radius in nT/km and
+        theta, phi in nT/rad (not divided by ``r`` or ``r sin(theta)``).
+
+    Notes
+    -----
+    The gradient of the field intensity follows from
+    ``dF[j] = (B_radius*dB[0, j] + B_theta*dB[1, j] + B_phi*dB[2, j]) / F``,
+    see :func:`grad_intensity`.
+
+    """
+
+    # ensure ndarray inputs
+    coeffs = np.array(coeffs, dtype=np.float64)
+    radius = np.array(radius, dtype=np.float64) / 6371.2  # Earth's average radius
+    theta = np.array(theta, dtype=np.float64)
+    phi = np.array(phi, dtype=np.float64)
+
+    nmax, nmin = _check_synth_args(coeffs, theta, nmax, nmin)
+
+    theta, phi, grid_shape = _broadcast_grid(radius, theta, phi, coeffs, grid)
+
+    # initialize radial dependence given the source
+    r_n = radius**(-(nmin+2))
+    # d/dr of radius**(-(n+2)), per km
+    dr = -1. / (radius * 6371.2)
+
+    # compute associated Legendre polynomials as (n, m, theta-points)-array
+    Pnm = legendre_poly(nmax, theta)
+
+    # save sinth and costh for fast access
+    sinth = Pnm[1, 1]
+    costh = Pnm[1, 0]
+
+    # calculate cos(m*phi) and sin(m*phi) as (m, phi-points)-array
+    phi = radians(phi)
+    cmp = np.cos(np.multiply.outer(np.arange(nmax+1), phi))
+    smp = np.sin(np.multiply.outer(np.arange(nmax+1), phi))
+
+    # allocate arrays in memory
+    B_radius = np.zeros(grid_shape)
+    B_theta = np.zeros(grid_shape)
+    B_phi = np.zeros(grid_shape)
+    dB = np.zeros((3, 3) + grid_shape)
+
+    num = nmin**2 - 1
+    for n in range(nmin, nmax+1):
+        for m in range(n+1):
+            P = Pnm[n, m]
+            dP = Pnm[m, n+1]
+            d2P = sum(c * Pnm[k, n+1] for k, c in _dlegendre_coeffs(n, m))
+
+            if m == 0:
+                gh_c = coeffs[..., num]
+                gh_s = 0.
+            else:
+                gh_c = coeffs[..., num] * cmp[m] + coeffs[..., num+1] * smp[m]
+                # phi derivative of gh_c, and -gh_s is the one of gh_s
+                gh_s = m * (coeffs[..., num+1] * cmp[m] - coeffs[..., num] * smp[m])
+
+            t_r = (n+1) * P * r_n
+            t_t = -dP * r_n
+
+            B_radius += t_r * gh_c
+            B_theta += t_t * gh_c
+
+            dB[0, 0] += (n+2) * dr * t_r * gh_c
+            dB[1, 0] += (n+2) * dr * t_t * gh_c
+            dB[0, 1] += (n+1) * dP * r_n * gh_c
+            dB[1, 1] += -d2P * r_n * gh_c
+
+            if m > 0:
+                dB[0, 2] += t_r * gh_s
+                dB[1, 2] += t_t * gh_s
+
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    # P/sin(theta) and its theta derivative, handling the
+                    # poles using L'Hopital's rule
+                    div_Pnm = np.where(theta == 0., dP, P / sinth)
+                    div_Pnm = np.where(theta == degrees(pi), -dP, div_Pnm)
+                    ddiv_Pnm = np.where(theta == 0., d2P / 2,
+                                        (dP*sinth - costh*P) / sinth**2)
+                    ddiv_Pnm = np.where(theta == degrees(pi), -d2P / 2, ddiv_Pnm)
+
+                # B_phi term is -m*div_Pnm*r_n*gh_s/m
+                t_p = m * div_Pnm * r_n
+                gh_p = -gh_s / m
+
+                B_phi += t_p * gh_p
+
+                dB[2, 0] += (n+2) * dr * t_p * gh_p
+                dB[2, 1] += m * ddiv_Pnm * r_n * gh_p
+                dB[2, 2] += t_p * m * gh_c
+
+                num += 2
+            else:
+                num += 1
+
+        r_n = r_n / radius  # equivalent to r_n = radius**(-(n+2))
+
+    return B_radius, B_theta, B_phi, dB
+
+def grad_intensity(B_radius, B_theta, B_phi, dB):
+    """
+    Field intensity F and its partial derivatives from the output of
+    :func:`synth_values_grad`.
+
+    Returns
+    -------
+    F : ndarray, shape (...)
+        Field intensity.
+    dF : ndarray, shape (3, ...)
+        dF/dr in nT/km and dF/dtheta, dF/dphi in nT/rad.
+
+    """
+    F = np.sqrt(B_radius**2 + B_theta**2 + B_phi**2)
+    dF = (B_radius*dB[0] + B_theta*dB[1] + B_phi*dB[2]) / F
+    return F, dF
+
+def power_spectrum(coeffs, radius=6371.2, nmax=None):
+    """
+    Lowes-Mauersberger spatial power spectrum of the internal field.
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion.
+    radius : float or ndarray, shape (...)
+        Radius in kilometers at which the spectrum is evaluated.
+    nmax : int, positive, optional
+        Maximum degree (default is given by ``coeffs``).
+
+    Returns
+    -------
+    R_n : ndarray, shape (nmax, ...)
+        Mean square field over the sphere of given radius due to each degree
+        ``n = 1..nmax``, in nT^2.
+
+    """
+    coeffs = np.array(coeffs, dtype=np.float64)
+    ratio = 6371.2 / np.array(radius, dtype=np.float64)
+    if nmax is None:
+        nmax = int(np.sqrt(coeffs.shape[-1] + 1) - 1)
+
+    # sum of the squared coefficients of degree n: indices n**2-1 .. (n+1)**2-2
+    S_n = np.array([np.sum(coeffs[n*n-1:(n+1)**2-1]**2) for n in range(1, nmax+1)])
+    n = np.arange(1, nmax+1).reshape((nmax,) + (1,)*ratio.ndim)
+
+    return (n+1) * ratio**(2*n+4) * S_n.reshape(n.shape)
+
+def truncation_degree(coeffs, radius, tol, nmax=None, norm='max'):
+    """
+    Smallest degree whose truncation error stays below ``tol``.
+
+    Leaving out degrees ``n > N`` changes the field by at most
+
+    ``E_max(N) = sum_{n>N} (a/r)**(n+2) * sqrt((n+1)*(2n+1)*S_n)``
+
+    at any point of the sphere of radius ``r``, where ``S_n`` is the sum of
+    the squared degree-n coefficients (the Schmidt functions satisfy
+    ``sum_m P(n,m)**2 = 1``, so this bound is exact, not statistical).
+    With ``norm='rms'`` the root mean square error over the sphere from the
+    power spectrum, ``sqrt(sum_{n>N} R_n)``, is used instead. Both decrease
+    with radius, so a grid is safe with its smallest radius.
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion.
+    radius : float or ndarray, shape (...)
+        Radius in kilometers (e.g. one per altitude).
+    tol : float
+        Error bound in nT.
+    nmax : int, positive, optional
+        Maximum degree of the model (default is given by ``coeffs``).
+    norm : {'max', 'rms'}, optional
+        Pointwise bound (default) or spherical root mean square.
+
+    Returns
+    -------
+    nmax_tol : ndarray of int, shape (...)
+        Smallest degree meeting the bound (at most ``nmax``).
+    bound : ndarray, shape (...)
+        Truncation error for ``nmax_tol`` in nT, i.e. the bound achieved.
+
+    """
+    coeffs = np.array(coeffs, dtype=np.float64)
+    radius = np.array(radius, dtype=np.float64)
+    if nmax is None:
+        nmax = int(np.sqrt(coeffs.shape[-1] + 1) - 1)
+
+    if norm == 'max':
+        ratio = 6371.2 / radius
+        S_n = np.array([np.sum(coeffs[n*n-1:(n+1)**2-1]**2) for n in range(1, nmax+1)])
+        n = np.arange(1, nmax+1).reshape((nmax,) + (1,)*radius.ndim)
+        e_n = ratio**(n+2) * np.sqrt((n+1)*(2*n+1)*S_n.reshape(n.shape))
+    elif norm == 'rms':
+        e_n = power_spectrum(coeffs, radius, nmax)
+    else:
+        raise ValueError(f'Unknown norm {norm}, use "max" or "rms".')
+
+    # error of truncating at N = 0..nmax: sum of the terms of degrees > N
+    tail = np.concatenate([np.cumsum(e_n[::-1], axis=0)[::-1],
+                           np.zeros((1,) + radius.shape)])
+    if norm == 'rms':
+        tail = np.sqrt(tail)
+
+    # first N (at least 1) with tail <= tol
+    ok = tail[1:] <= tol
+    nmax_tol = np.argmax(ok, axis=0) + 1
+    bound = np.take_along_axis(tail, nmax_tol[None], axis=0)[0]
+
+    return nmax_tol, bound
+
 def xyz2dhif(x, y, z):
     """Calculate D, H, I and F from (X, Y, Z)
       
@@ -624,4 +1709,149 @@ def xyz2dhif_sv(x, y, z, xdot, ydot, zdot):
     ddot = r2d((xdot*y - ydot*x)/h2)*60
     idot = r2d((hdot*z - h*zdot)/f2)*60
     
-    return ddot, hdot, idot, fdot
\ No newline at end of file
+    return ddot, hdot, idot, fdot
+
+# Rows of the output of xyz2dhif_fused and field_components, in the order
+# of the tuple returned by the pyigrf routines
+DHIF_ROWS = ('D', 'I', 'H', 'F', 'X', 'Y', 'Z',
+             'Ddot', 'Idot', 'Hdot', 'Fdot', 'Xdot', 'Ydot', 'Zdot')
+
+
+def xyz2dhif_fused(out, xm=None, ym=None, zm=None):
+    """Calculate D, I, H, F and their secular variation in place
+
+    Does the work of xyz2dhif and xyz2dhif_sv in one pass over
+    preallocated arrays: the results go straight into the rows of ``out``
+    and only three scratch arrays are allocated, instead of the temporaries
+    of each expression.
+
+    Parameters
+    ---------------
+    out : ndarray, shape (14, ...)
+        Rows in the order of DHIF_ROWS. On input rows 4-6 hold X, Y, Z
+        (nT) and rows 11-13 Xdot, Ydot, Zdot (nT/year); the other rows
+        are overwritten.
+    xm, ym, zm : ndarray, shape (...), optional
+        Main field (nT) the SV of D, H, I and F is taken relative to, e.g.
+        at the start of the five year epoch (default is X, Y, Z).
+
+    Returns
+    ------
+    out : ndarray, shape (14, ...)
+        D (degrees), I (degrees), H (nT), F (nT), X, Y, Z (nT),
+        Ddot (arcmin/year), Idot (arcmin/year), Hdot (nT/year),
+        Fdot (nT/year), Xdot, Ydot, Zdot (nT/year).
+
+    """
+    # row views (0-d arrays, not scalars, for a single point)
+    x, y, z = out[4, ...], out[5, ...], out[6, ...]
+    xdot, ydot, zdot = out[11, ...], out[12, ...], out[13, ...]
+    dec, inc, hoz, eff = out[0, ...], out[1, ...], out[2, ...], out[3, ...]
+    ddot, idot, hdot, fdot = out[7, ...], out[8, ...], out[9, ...], out[10, ...]
+    xm = x if xm is None else xm
+    ym = y if ym is None else ym
+    zm = z if zm is None else zm
+
+    # main field
+    np.multiply(x, x, out=hoz)
+    np.multiply(y, y, out=eff)
+    hoz += eff
+    np.multiply(z, z, out=eff)
+    eff += hoz
+    np.sqrt(eff, out=eff)
+    np.sqrt(hoz, out=hoz)
+    np.arctan2(y, x, out=dec)
+    np.arctan2(z, hoz, out=inc)
+    np.multiply(dec, 180/pi, out=dec)
+    np.multiply(inc, 180/pi, out=inc)
+
+    # secular variation, relative to (xm, ym, zm)
+    work = np.empty((3,) + out.shape[1:])
+    h2, f2, t = work[0, ...], work[1, ...], work[2, ...]
+    np.multiply(xm, xm, out=h2)
+    np.multiply(ym, ym, out=t)
+    h2 += t
+    np.multiply(zm, zm, out=f2)
+    f2 += h2
+
+    np.multiply(xm, xdot, out=hdot)
+    np.multiply(ym, ydot, out=t)
+    hdot += t
+    np.multiply(zm, zdot, out=fdot)
+    fdot += hdot
+
+    np.multiply(xdot, ym, out=ddot)
+    np.multiply(ydot, xm, out=t)
+    ddot -= t
+    ddot /= h2
+    ddot *= 60*180/pi
+
+    # h2 -> h, hdot = (x xdot + y ydot)/h
+    np.sqrt(h2, out=h2)
+    hdot /= h2
+    np.multiply(hdot, zm, out=idot)
+    np.multiply(h2, zdot, out=t)
+    idot -= t
+    idot /= f2
+    idot *= 60*180/pi
+
+    np.sqrt(f2, out=f2)
+    fdot /= f2
+
+    return out
+
+
+def field_components(B_radius, B_theta, B_phi, B_radius_sv, B_theta_sv,
+                     B_phi_sv, B_radius_m, B_theta_m, B_phi_m, sd=None,
+                     cd=None, out=None):
+    """Calculate all 14 field and SV components from spherical components
+
+    The main field, the SV and the main field at the start of the epoch,
+    given as geocentric (B_radius, B_theta, B_phi), are rearranged to
+    (X, Y, Z), rotated to geodetic coordinates if ``sd`` and ``cd`` are
+    given, and passed to xyz2dhif_fused, all written into ``out``.
+
+    Parameters
+    ---------------
+    B_radius, B_theta, B_phi : ndarray, shape (...)
+        Main field components (nT).
+    B_radius_sv, B_theta_sv, B_phi_sv : ndarray, shape (...)
+        Secular variation of the components (nT/year).
+    B_radius_m, B_theta_m, B_phi_m : ndarray, shape (...)
+        Main field components (nT) at the start of the epoch.
+    sd, cd : ndarray, shape (...), optional
+        Sine and cosine of the angle between geodetic and geocentric
+        latitude, as returned by gg_to_geo (default is no rotation).
+    out : ndarray, shape (14, ...), optional
+        Array for the result (default is a new array).
+
+    Returns
+    ------
+    out : ndarray, shape (14, ...)
+        Rows in the order of DHIF_ROWS (see xyz2dhif_fused).
+
+    """
+    shape = np.broadcast_shapes(np.shape(B_radius), np.shape(B_radius_sv),
+                                np.shape(B_radius_m), np.shape(sd), np.shape(cd))
+    if out is None:
+        out = np.empty((14,) + shape)
+
+    def rotate(br, bt, bp, x, y, z):
+        # X = -B_theta, Y = B_phi, Z = -B_radius, then the geodetic rotation
+        # X' = X cd + Z sd, Z' = Z cd - X sd
+        np.negative(bt, out=x)
+        np.negative(br, out=z)
+        np.copyto(y, bp)
+        if sd is not None:
+            t = np.multiply(x, sd)
+            x *= cd
+            x -= np.multiply(br, sd)
+            z *= cd
+            z -= t
+
+    rotate(B_radius, B_theta, B_phi, out[4, ...], out[5, ...], out[6, ...])
+    rotate(B_radius_sv, B_theta_sv, B_phi_sv, out[11, ...], out[12, ...], out[13, ...])
+    m = np.empty((3,) + shape)
+    rotate(B_radius_m, B_theta_m, B_phi_m, m[0, ...], m[1, ...], m[2, ...])
+
+    return xyz2dhif_fused(out, m[0, ...], m[1, ...], m[2, ...])
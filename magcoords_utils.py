@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Magnetic coordinates from IGRF coefficients by table lookup.
+
+The field is synthesized (and the field lines traced) only on the nodes of
+a regular geodetic latitude/longitude grid, one table per date and
+altitude. Converting any number of points at that date and altitude is then
+a bilinear interpolation of the tables.
+
+Coordinates provided:
+
+* centred dipole (geomagnetic) latitude and longitude, computed directly
+  from the degree-1 coefficients;
+* quasi-dipole latitude, ``cos(qd_lat)**2 = r/r_apex``, and apex longitude
+  (centred dipole longitude of the apex), from the apex of the IGRF field
+  line through the point;
+* modified apex latitude for a reference height, from the apex height;
+* dip latitude, ``tan(dip_lat) = tan(I)/2``, and modified dip latitude
+  (modip), ``tan(modip) = I/sqrt(cos(lat))``, where I is the inclination.
+
+"""
+
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from scipy import interpolate
+
+import igrf_utils as iut
+import fieldline_utils as flu
+
+RE = flu.RE
+
+
+def dipole_pole(coeffs):
+    """
+    Colatitude and longitude [degrees] of the north geomagnetic pole (the
+    boreal pole of the centred dipole axis) from the degree-1 coefficients
+    ``g10, g11, h11``.
+
+    """
+    g10, g11, h11 = coeffs[0], coeffs[1], coeffs[2]
+    m = np.sqrt(g10**2 + g11**2 + h11**2)
+    theta = np.rad2deg(np.arccos(-g10/m))
+    phi = np.rad2deg(np.arctan2(-h11, -g11))
+    return theta, phi
+
+
+def dipole_coords(coeffs, theta, phi):
+    """
+    Centred dipole colatitude and longitude [degrees] of points given by
+    geocentric colatitude ``theta`` and longitude ``phi`` [degrees].
+
+    The dipole longitude is zero on the meridian through the south
+    geographic pole, as usual for geomagnetic coordinates.
+
+    """
+    theta_p, phi_p = np.deg2rad(dipole_pole(coeffs))
+    x = flu.to_cartesian(1., theta, phi)
+
+    # rotation around z by phi_p, then around y by theta_p
+    cp, sp = np.cos(phi_p), np.sin(phi_p)
+    ct, st = np.cos(theta_p), np.sin(theta_p)
+    x1 = cp*x[0] + sp*x[1]
+    y1 = -sp*x[0] + cp*x[1]
+    xm = ct*x1 - st*x[2]
+    zm = st*x1 + ct*x[2]
+
+    _, theta_m, phi_m = flu.to_spherical(np.stack([xm, y1, zm]))
+    return theta_m, phi_m
+
+
+def _magnetic_nodes(coeffs, height, lat, lon, nmax=None, **kwargs):
+    """Magnetic quantities at geodetic points (lat, lon) at geodetic ``height``."""
+    radius, theta, sd, cd = iut.gg_to_geo(np.full(lat.shape, float(height)), 90 - lat)
+
+    Br, Bt, Bp = iut.synth_values(coeffs, radius, theta, lon, nmax=nmax)
+    # geodetic north and vertical components
+    X = -Bt*cd - Br*sd
+    Z = Bt*sd - Br*cd
+    H = np.sqrt(X**2 + Bp**2)
+    inc = np.arctan2(Z, H)
+
+    dip_lat = np.rad2deg(np.arctan(0.5*np.tan(inc)))
+    modip = np.rad2deg(np.arctan2(inc, np.sqrt(np.cos(np.deg2rad(lat)))))
+
+    lines = flu.field_line_quantities(coeffs, radius, theta, lon, nmax=nmax,
+                                      h_stop=min(0., float(height)), **kwargs)
+    r_a, theta_a, phi_a = lines['apex']
+    theta_m, phi_m = dipole_coords(coeffs, theta_a, phi_a)
+    # lines left open: continue from the highest point as a dipole line
+    open_ = ~lines['closed']
+    r_a = np.where(open_, r_a/np.sin(np.deg2rad(theta_m))**2, r_a)
+
+    qd = np.rad2deg(np.arccos(np.sqrt(np.clip(radius/r_a, 0., 1.))))
+    qd = np.where(Z < 0, -qd, qd)
+
+    return {'qd_lat': qd,
+            'apex_lon': phi_m,
+            'apex_height': r_a - RE,
+            'dip_lat': dip_lat,
+            'modip': modip}
+
+
+class MagneticTable:
+    """
+    Lookup table of magnetic coordinates at one date and geodetic altitude.
+
+    Parameters
+    ----------
+    coeffs : ndarray, shape (N,)
+        Coefficients of the spherical harmonic expansion at the date.
+    height : float
+        Geodetic altitude [km] of the table.
+    lat_step, lon_step : float, optional
+        Spacing [degrees] of the geodetic latitude and longitude nodes
+        (defaults are 2 and 4). Must divide 180 and 360 respectively.
+    nmax : int, positive, optional
+        Maximum degree (default is given by ``coeffs``).
+    values : dict of ndarrays, optional
+        Previously computed node values (see :meth:`save`); the nodes are
+        not recomputed.
+
+    Attributes
+    ----------
+    lat, lon : ndarray
+        Nodes of the table, latitude from -90 to 90 and longitude from -180
+        to 180 (both ends included).
+    values : dict of ndarrays, shape (nlat, nlon)
+        ``'qd_lat'``, ``'apex_lon'``, ``'apex_height'``, ``'dip_lat'`` and
+        ``'modip'`` at the nodes.
+
+    """
+
+    FIELDS = ('qd_lat', 'apex_lon', 'apex_height', 'dip_lat', 'modip')
+
+    def __init__(self, coeffs, height, lat_step=2., lon_step=4., nmax=None,
+                 values=None):
+        self.coeffs = np.array(coeffs, dtype=np.float64)
+        self.height = float(height)
+        self.lat_step = float(lat_step)
+        self.lon_step = float(lon_step)
+
+        # the lookup in __call__ assumes nodes exactly every lat_step/lon_step
+        nlat = 180/self.lat_step
+        nlon = 360/self.lon_step
+        if not (np.isclose(nlat, round(nlat)) and np.isclose(nlon, round(nlon))):
+            raise ValueError(f'lat_step = {self.lat_step} and lon_step = '
+                             f'{self.lon_step} must divide 180 and 360.')
+
+        self.lat = np.linspace(-90., 90., int(round(nlat)) + 1)
+        self.lon = np.linspace(-180., 180., int(round(nlon)) + 1)
+
+        if values is None:
+            # the poles are moved slightly so that the longitude is defined
+            lat = np.clip(self.lat, -90 + 1e-6, 90 - 1e-6)
+            lat, lon = np.meshgrid(lat, self.lon[:-1], indexing='ij')
+            values = _magnetic_nodes(self.coeffs, self.height, lat, lon, nmax)
+            # periodic copy of the first meridian
+            values = {k: np.concatenate([v, v[:, :1]], axis=1)
+                      for k, v in values.items()}
+        self.values = {k: np.asarray(values[k], dtype=np.float64) for k in self.FIELDS}
+
+        phi = np.deg2rad(self.values['apex_lon'])
+        self._nodes = np.stack([self.values[k] for k in self.FIELDS if k != 'apex_lon']
+                               + [np.sin(phi), np.cos(phi)], axis=-1).reshape(-1, len(self.FIELDS) + 1)
+
+    def save(self, filepath):
+        """Write the nodes to a .npz file."""
+        np.savez(filepath, coeffs=self.coeffs, height=self.height,
+                 lat_step=self.lat_step, lon_step=self.lon_step, **self.values)
+
+    @classmethod
+    def load(cls, filepath):
+        """Read a table written by :meth:`save`."""
+        with np.load(filepath) as f:
+            return cls(f['coeffs'], float(f['height']), float(f['lat_step']),
+                       float(f['lon_step']), values={k: f[k] for k in cls.FIELDS})
+
+    def __call__(self, lat, lon, h_ref=None):
+        """
+        Interpolate the magnetic coordinates at geodetic points.
+
+        Parameters
+        ----------
+        lat, lon : float or ndarray, shape (...)
+            Geodetic latitude and longitude [degrees], broadcast together.
+        h_ref : float, optional
+            Reference height [km] of the modified apex latitude (not
+            computed by default).
+
+        Returns
+        -------
+        coords : dict of ndarrays, shape (...)
+            ``'qd_lat'``, ``'apex_lon'``, ``'apex_height'``, ``'dip_lat'``,
+            ``'modip'`` and, with ``h_ref``, ``'apex_lat'`` (zero where the
+            apex is below ``h_ref``).
+
+        """
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=np.float64),
+                                       np.asarray(lon, dtype=np.float64))
+        lon = np.mod(lon + 180., 360.) - 180.
+
+        fi = np.clip((lat + 90.)/self.lat_step, 0, self.lat.size - 1)
+        fj = np.clip((lon + 180.)/self.lon_step, 0, self.lon.size - 1)
+        i = np.minimum(fi.astype(int), self.lat.size - 2)
+        j = np.minimum(fj.astype(int), self.lon.size - 2)
+        ti, tj = (fi - i)[..., None], (fj - j)[..., None]
+
+        # one gather per corner of all the fields (rows of the node table)
+        nodes = self._nodes
+        k = i*self.lon.size + j
+        v = ((1 - ti)*((1 - tj)*nodes[k] + tj*nodes[k + 1])
+             + ti*((1 - tj)*nodes[k + self.lon.size] + tj*nodes[k + self.lon.size + 1]))
+
+        names = [f for f in self.FIELDS if f != 'apex_lon']
+        coords = {f: v[..., n] for n, f in enumerate(names)}
+        # longitudes through their sine and cosine (no jump at +-180)
+        coords['apex_lon'] = np.rad2deg(np.arctan2(v[..., -2], v[..., -1]))
+
+        if h_ref is not None:
+            ratio = (RE + h_ref)/(RE + coords['apex_height'])
+            apex_lat = np.rad2deg(np.arccos(np.sqrt(np.clip(ratio, 0., 1.))))
+            coords['apex_lat'] = np.copysign(apex_lat, coords['qd_lat'])
+        return coords
+
+
+class MagneticTables:
+    """
+    Magnetic coordinate tables of a model, built on demand per date and
+    altitude and kept in memory (least recently used) and, optionally, on
+    disk.
+
+    Parameters
+    ----------
+    model : igrf_utils.igrf
+        Model as returned by :func:`igrf_utils.load_shcfile` (times in
+        decimal years).
+    cache_dir : str, optional
+        Directory for the .npz copies of the tables (default is None, memory
+        only).
+    lat_step, lon_step : float, optional
+        Node spacing of the tables [degrees] (defaults are 2 and 4).
+    maxsize : int, optional
+        Number of tables kept in memory (default is 64).
+
+    """
+
+    def __init__(self, model, cache_dir=None, lat_step=2., lon_step=4., maxsize=64):
+        self.model = model
+        self.nmax = model.parameters['nmax']
+        self.cache_dir = cache_dir
+        self.lat_step = float(lat_step)
+        self.lon_step = float(lon_step)
+        self.maxsize = maxsize
+        self._f = interpolate.interp1d(model.time, model.coeffs, fill_value='extrapolate')
+        self._tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        sha = hashlib.sha1(np.ascontiguousarray(model.coeffs, dtype=np.float64).tobytes())
+        sha.update(np.ascontiguousarray(model.time, dtype=np.float64).tobytes())
+        self._model_id = sha.hexdigest()[:16]
+
+    def _filepath(self, key):
+        name = json.dumps([self._model_id, self.lat_step, self.lon_step] + list(key))
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(name.encode()).hexdigest() + '.npz')
+
+    def get(self, date, height):
+        """Table at decimal year ``date`` and geodetic altitude ``height`` [km]."""
+        key = (round(float(date), 6), round(float(height), 6))
+        table = self._tables.get(key)
+        if table is not None:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return table
+
+        self.misses += 1
+        filepath = self._filepath(key) if self.cache_dir is not None else None
+        if filepath is not None and os.path.exists(filepath):
+            table = MagneticTable.load(filepath)
+        else:
+            table = MagneticTable(self._f(key[0]), key[1], self.lat_step,
+                                  self.lon_step, self.nmax)
+            if filepath is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp = filepath[:-4] + '.%d.tmp.npz' % os.getpid()
+                table.save(tmp)
+                os.replace(tmp, filepath)
+
+        self._tables[key] = table
+        if len(self._tables) > self.maxsize:
+            self._tables.popitem(last=False)
+        return table
+
+    def convert(self, date, lat, lon, height, h_ref=None):
+        """
+        Magnetic coordinates of geodetic points at one date.
+
+        One table is used (and built if needed) per distinct altitude, so
+        that gridded data with a few altitude levels converts with a few
+        table builds and otherwise only interpolation.
+
+        Parameters
+        ----------
+        date : float
+            Decimal year.
+        lat, lon, height : float or ndarray, shape (...)
+            Geodetic latitude, longitude [degrees] and altitude [km] of the
+            points, broadcast together.
+        h_ref : float, optional
+            Reference height [km] of the modified apex latitude (see
+            :meth:`MagneticTable.__call__`).
+
+        Returns
+        -------
+        coords : dict of ndarrays, shape (...)
+            The table values and the centred dipole ``'dipole_lat'`` and
+            ``'dipole_lon'`` [degrees].
+
+        """
+        lat, lon, height = np.broadcast_arrays(np.asarray(lat, dtype=np.float64),
+                                               np.asarray(lon, dtype=np.float64),
+                                               np.asarray(height, dtype=np.float64))
+        iut.check_lat_lon_arrays(lat, lon)
+        shape = lat.shape
+        lat, lon, height = lat.ravel(), lon.ravel(), height.ravel()
+
+        coords = None
+        levels, inverse = np.unique(height, return_inverse=True)
+        for k, h in enumerate(levels):
+            sel = inverse == k
+            values = self.get(date, h)(lat[sel], lon[sel], h_ref)
+            if coords is None:
+                coords = {name: np.empty(lat.size) for name in values}
+            for name, v in values.items():
+                coords[name][sel] = v
+        if coords is None:
+            # no points: the same coordinates, empty
+            names = MagneticTable.FIELDS + (('apex_lat',) if h_ref is not None else ())
+            coords = {name: np.empty(0) for name in names}
+
+        _, theta, _, _ = iut.gg_to_geo(height, 90 - lat)
+        theta_m, phi_m = dipole_coords(self._f(float(date)), theta, lon)
+        coords['dipole_lat'] = 90 - theta_m
+        coords['dipole_lon'] = phi_m
+        return {name: v.reshape(shape) for name, v in coords.items()}
@@ -77,6 +77,16 @@ pyIGRF: code to synthesise magnetic field values from the 13th generation of the
  
 """
 
+import os
+import json
+import hashlib
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from scipy import interpolate
 import pandas as pd
 import numpy as np
@@ -85,15 +95,17 @@ import geopandas as gpd
 import matplotlib as mpl
 
 import igrf_utils as iut
+import fieldline_utils as flu
+import magcoords_utils as mcu
 import io_options_clara as ioo
 
 # import os.path
 # from os import path
 
-# Load in the file of coefficients
+# File of coefficients used by default. It is only read on first use, through
+# the `modelos` registry below (pyigrf_clara_0_6.igrf still works).
 
-IGRF_FILE = r'./IGRF13.shc'
-igrf = iut.load_shcfile(IGRF_FILE, None)
+IGRF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'IGRF13.shc')
 
 def string_para_float(dado):
     """
@@ -115,6 +127,776 @@ def string_para_float(dado):
     #print("\nDado:\n",dado)
     return dado
 
+class coeficientes_igrf():
+    """
+    Fornece os coeficientes do IGRF interpolados para um ano decimal, com
+    memoização.
+
+    O interpolador (interp1d) é criado uma única vez por modelo e, para cada
+    ano pedido, guarda os três vetores usados em _calc_igrf: campo principal,
+    variação secular (SV) e campo principal no início da época de 5 anos.
+    Chamadas repetidas para o mesmo ano não fazem nenhuma interpolação.
+    O cache é limitado a `maxsize` anos; o menos usado recentemente é
+    descartado primeiro.
+
+    Attributes
+    ----------
+        modelo : iut.igrf
+            COEFICIENTES LIDOS POR iut.load_shcfile.
+        maxsize : INT
+            NÚMERO MÁXIMO DE ANOS GUARDADOS.
+        hits, misses : INT
+            ESTATÍSTICAS DE USO DO CACHE.
+    """
+
+    def __init__(self,modelo,maxsize = 64):
+        self.modelo = modelo
+        self.maxsize = maxsize
+        self._f = interpolate.interp1d(modelo.time, modelo.coeffs, fill_value='extrapolate')
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,date):
+        """
+        RETORNA OS COEFICIENTES PARA O ANO DECIMAL date.
+
+        Parameters
+        ----------
+        date : FLOAT
+            Ano decimal.
+
+        Returns
+        -------
+        coeffs : ARRAY FLOAT
+            Coeficientes do campo principal em date.
+        coeffs_sv : ARRAY FLOAT
+            Coeficientes da SV [nT/ano] da época de 5 anos que contém date.
+        coeffsm : ARRAY FLOAT
+            Coeficientes do campo principal no início dessa época.
+
+        """
+        date = float(date)
+        valores = self._cache.get(date)
+        if valores is not None:
+            self.hits += 1
+            self._cache.move_to_end(date)
+            return valores
+
+        self.misses += 1
+        f = self._f
+        coeffs = f(date)
+
+        # For the SV, find the 5 year period in which the date lies and compute
+        # the SV within that period. IGRF has constant SV between each 5 year period
+        epoch = (date-1900)//5
+        epoch_start = epoch * 5
+        coeffs_sv = f(1900+epoch_start+1) - f(1900+epoch_start)
+        coeffsm = f(1900+epoch_start)
+
+        valores = (coeffs, coeffs_sv, coeffsm)
+        for v in valores:
+            v.setflags(write=False) # compartilhados entre chamadas
+        self._cache[date] = valores
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+        return valores
+
+    def clear(self):
+        """Esvazia o cache."""
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+class registro_modelos():
+    """
+    Registro dos modelos (arquivos .shc) usados no processo.
+
+    Cada arquivo é lido por iut.load_shcfile só na primeira vez em que é
+    pedido e fica guardado junto com o seu coeficientes_igrf. Vários arquivos
+    podem ser usados lado a lado; são identificados pelo caminho absoluto.
+
+    Attributes
+    ----------
+        tempos_carga : DICT
+            TEMPO DE LEITURA [s] DE CADA ARQUIVO CARREGADO.
+    """
+
+    def __init__(self):
+        self._modelos = {}
+        self._coefs = {}
+        self._tabelas = {}
+        self.tempos_carga = {}
+        self._lock = threading.Lock()
+
+    def caminho(self,arquivo = None):
+        """Caminho absoluto do arquivo (IGRF_FILE se arquivo for None)."""
+        return os.path.abspath(IGRF_FILE if arquivo is None else arquivo)
+
+    def _carrega(self,caminho):
+        with self._lock:
+            if caminho not in self._modelos:
+                t0 = time.perf_counter()
+                modelo = iut.load_shcfile(caminho, None)
+                self.tempos_carga[caminho] = time.perf_counter() - t0
+                self._coefs[caminho] = coeficientes_igrf(modelo)
+                self._modelos[caminho] = modelo
+
+    def get(self,arquivo = None):
+        """
+        RETORNA O MODELO (iut.igrf) DO ARQUIVO, LENDO-O SE NECESSÁRIO.
+
+        Parameters
+        ----------
+        arquivo : STRING, optional
+            ARQUIVO .shc. The default is IGRF_FILE.
+        """
+        caminho = self.caminho(arquivo)
+        if caminho not in self._modelos:
+            self._carrega(caminho)
+        return self._modelos[caminho]
+
+    def coeficientes(self,arquivo = None):
+        """RETORNA O coeficientes_igrf DO ARQUIVO, LENDO-O SE NECESSÁRIO."""
+        caminho = self.caminho(arquivo)
+        if caminho not in self._modelos:
+            self._carrega(caminho)
+        return self._coefs[caminho]
+
+    def tabelas_magneticas(self,arquivo = None,cache_dir = None):
+        """
+        RETORNA AS TABELAS DE COORDENADAS MAGNÉTICAS (mcu.MagneticTables) DO
+        ARQUIVO, MONTADAS SOB DEMANDA POR ANO E ALTURA.
+
+        Parameters
+        ----------
+        arquivo : STRING, optional
+            ARQUIVO .shc. The default is IGRF_FILE.
+        cache_dir : STRING, optional
+            PASTA ONDE AS TABELAS SÃO GUARDADAS EM DISCO (.npz). The default
+            is None (SÓ EM MEMÓRIA).
+        """
+        caminho = self.caminho(arquivo)
+        modelo = self.get(caminho)
+        chave = (caminho, None if cache_dir is None else os.path.abspath(cache_dir))
+        with self._lock:
+            if chave not in self._tabelas:
+                self._tabelas[chave] = mcu.MagneticTables(modelo,cache_dir = chave[1])
+        return self._tabelas[chave]
+
+    def carregados(self):
+        """LISTA DOS ARQUIVOS JÁ CARREGADOS."""
+        return list(self._modelos)
+
+modelos = registro_modelos()
+
+def __getattr__(name):
+    # Compatibilidade com o antigo carregamento na importação:
+    # pyigrf_clara_0_6.igrf e .coef_igrf dão o modelo padrão
+    if name == 'igrf':
+        return modelos.get()
+    if name == 'coef_igrf':
+        return modelos.coeficientes()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class campo_epocas():
+    """
+    Campo do IGRF nas épocas do modelo para um conjunto fixo de pontos.
+
+    Os coeficientes do IGRF são lineares por partes no tempo entre as épocas
+    de 5 anos, então o campo (X, Y, Z) em qualquer data é a combinação linear
+    exata dos campos nas duas épocas vizinhas, e a SV é a diferença entre elas
+    dividida pelo intervalo. Cada época é sintetizada no máximo uma vez (sob
+    demanda) e todas as datas seguintes saem por interpolação.
+
+    Attributes
+    ----------
+        modelo : iut.igrf
+            COEFICIENTES LIDOS POR iut.load_shcfile.
+        plano : iut.synth_plan
+            GEOMETRIA DOS PONTOS (None se radial = True).
+        sd, cd : ARRAY FLOAT
+            FATORES DE ROTAÇÃO PARA COORDENADAS GEODÉTICAS (de iut.gg_to_geo).
+        truncamento : DICT
+            GRAU E ERRO DE TRUNCAMENTO [nT] DE CADA ÉPOCA JÁ SINTETIZADA
+            (SÓ COM tolerancia).
+        nbytes : INT
+            MEMÓRIA DAS ÉPOCAS E DOS PLANOS JÁ CALCULADOS (CRESCE SOB DEMANDA).
+    """
+
+    def __init__(self,modelo,alt,colat,lon,sd,cd,radial = False,tolerancia = None):
+        """
+        Parameters
+        ----------
+        modelo : iut.igrf
+            Coeficientes do modelo.
+        alt : ARRAY FLOAT
+            Raio geocêntrico [km].
+        colat : ARRAY FLOAT
+            Colatitude geocêntrica em graus.
+        lon : ARRAY FLOAT
+            Longitude em graus.
+        sd, cd : ARRAY FLOAT
+            Fatores de rotação de iut.gg_to_geo.
+        radial : BOOL, optional
+            Se True, o último eixo de alt e colat é o eixo das altitudes e a
+            síntese usa iut.synth_values_radial (lon deve ter tamanho 1 nesse
+            eixo). Compensa quando há muitos níveis de altitude. The default is False.
+        tolerancia : FLOAT, optional
+            ERRO MÁXIMO [nT] ACEITO NO CAMPO PRINCIPAL: CADA ÉPOCA É SINTETIZADA
+            SÓ ATÉ O MENOR GRAU QUE O RESPEITA NO MENOR RAIO DOS PONTOS (VER
+            iut.truncation_degree). The default is None (GRAU MÁXIMO DO MODELO).
+        """
+        self.modelo = modelo
+        self.epocas = np.asarray(modelo.time, dtype=np.float64)
+        self.nmax = modelo.parameters['nmax']
+        self.tolerancia = tolerancia
+        # um grid sem pontos (p.ex. lim_lat igual à latitude inicial) não é sintetizado
+        self.vazio = np.size(alt) == 0 or np.size(colat) == 0 or np.size(lon) == 0
+        self.raio_min = np.inf if self.vazio else float(np.min(alt))
+        self.radial = radial
+        self.plano = None
+        self._planos = {}
+        self._geometria = (alt, colat, lon)
+        self.sd = sd
+        self.cd = cd
+        self._xyz = {}
+        self.truncamento = {}
+
+    @property
+    def nbytes(self):
+        return (sum(v.nbytes for xyz in self._xyz.values() for v in xyz)
+                + sum(plano.nbytes for plano in self._planos.values()))
+
+    def _sintese(self,coeffs,nmax):
+        alt, colat, lon = self._geometria
+        if self.radial:
+            return iut.synth_values_radial(coeffs, alt, colat, lon, nmax)
+        if nmax not in self._planos:
+            self._planos[nmax] = iut.synth_plan(alt, colat, lon, nmax)
+            if nmax == self.nmax:
+                self.plano = self._planos[nmax]
+        return self._planos[nmax].values(coeffs)
+
+    def _xyz_epoca(self,i):
+        """X, Y, Z geodéticos na época i (sintetizados uma única vez)."""
+        if i not in self._xyz and self.vazio:
+            alt, colat, lon = self._geometria
+            forma = np.broadcast_shapes(np.shape(alt), np.shape(colat), np.shape(lon))
+            self._xyz[i] = (np.zeros(forma),)*3
+            if self.tolerancia is not None:
+                self.truncamento[i] = (self.nmax, 0.)
+        if i not in self._xyz:
+            nmax = self.nmax
+            if self.tolerancia is not None:
+                nmax, erro = iut.truncation_degree(self.modelo.coeffs[:, i], self.raio_min,
+                                                   self.tolerancia, self.nmax)
+                nmax = int(nmax)
+                self.truncamento[i] = (nmax, float(erro))
+            Br, Bt, Bp = self._sintese(self.modelo.coeffs[:, i], nmax)
+            X = -Bt; Y = Bp; Z = -Br
+            t = X; X = X*self.cd + Z*self.sd;  Z = Z*self.cd - t*self.sd
+            self._xyz[i] = (X, Y, Z)
+        return self._xyz[i]
+
+    def get(self,date,out = None):
+        """
+        CALCULA O CAMPO E A SV NO ANO DECIMAL date.
+
+        Parameters
+        ----------
+        date : FLOAT
+            Ano decimal.
+        out : ARRAY FLOAT (14, ...), optional
+            ONDE ESCREVER O RESULTADO (EX.: O BLOCO componentes DE UM
+            resultado_campo). The default is None (UM ARRAY NOVO).
+
+        Returns
+        -------
+        out : ARRAY FLOAT (14, ...)
+            dec, inc, hoz, eff, X, Y, Z, decs, incs, hozs, effs, dX, dY, dZ,
+            com as mesmas unidades de _calc_igrf.
+
+        """
+        epocas = self.epocas
+        i = int(np.searchsorted(epocas, date, side='right')) - 1
+        if i < 0:
+            raise ValueError(f'Date {date} before first model epoch {epocas[0]}.')
+
+        # Segmento linear que contém a data (o último é extrapolado)
+        k = min(i, len(epocas) - 2)
+        dt = epocas[k+1] - epocas[k]
+        xyz0 = self._xyz_epoca(k)
+        xyz1 = self._xyz_epoca(k+1)
+        if out is None:
+            out = np.empty((14,) + np.broadcast_shapes(*(v.shape for v in xyz0 + xyz1)))
+
+        # SV constante dentro do segmento [nT/yr] nas linhas 11-13 e o campo
+        # nas linhas 4-6, escritos direto em out
+        w = date - epocas[k]
+        for linha, v0, v1 in zip((4, 5, 6), xyz0, xyz1):
+            sv = out[linha + 7]
+            np.subtract(v1, v0, out=sv)
+            sv /= dt
+            np.multiply(sv, w, out=out[linha])
+            out[linha] += v0
+
+        # The IGRF SV coefficients are relative to the main field components
+        # at the start of each five year epoch
+        return iut.xyz2dhif_fused(out, *self._xyz_epoca(i))
+
+    def truncamento_data(self,date):
+        """
+        GRAU MÁXIMO USADO E LIMITE DO ERRO DE TRUNCAMENTO [nT] DO CAMPO EM date.
+
+        O campo em date é uma combinação convexa das duas épocas vizinhas,
+        então o erro fica abaixo do maior erro delas (e o da SV abaixo da
+        soma dos dois dividida pelo intervalo). Retorna None sem tolerancia.
+        """
+        if self.tolerancia is None:
+            return None
+        i = int(np.searchsorted(self.epocas, date, side='right')) - 1
+        k = min(max(i, 0), len(self.epocas) - 2)
+        usados = [self.truncamento[j] for j in (k, k+1, i) if j in self.truncamento]
+        return {'nmax': max(u[0] for u in usados), 'erro': max(u[1] for u in usados)}
+
+class resultado_campo():
+    """
+    Valores do campo calculados em um conjunto de pontos, guardados por coluna.
+
+    As coordenadas (Altitude, Latitude, Longitude, Year) ficam num bloco
+    float64 (4, n) e as 14 componentes do campo e da SV noutro (14, n), então
+    cada coluna é um array contíguo e nenhum objeto é criado por ponto. A
+    conversão para DataFrame ou xarray usa as próprias linhas dos blocos, sem
+    copiar. A ordem das colunas é sempre a de colunas (a mesma da tupla de
+    _calc_igrf), para grids e perfis.
+
+    Attributes
+    ----------
+        coordenadas : ARRAY FLOAT shape (4, n)
+            ALTITUDE [km], LATITUDE, LONGITUDE [graus] E ANO DE CADA PONTO.
+        componentes : ARRAY FLOAT shape (14, n)
+            COMPONENTES NA ORDEM DE COMPONENTES.
+        forma : TUPLE
+            FORMA DOS PONTOS (POR EXEMPLO (nlat, nlon, nh) NUM GRID), OU (n,).
+        eixos : DICT
+            NOME E VALORES DE CADA EIXO DE forma (USADOS EM para_xarray).
+    """
+
+    COORDENADAS = ['Altitude','Latitude','Longitude','Year']
+    # mesma ordem das linhas de iut.DHIF_ROWS (escritas por iut.field_components)
+    COMPONENTES = ['Declination' , 'Inclination' , 'Horizontal_intensity' , 'Total_intensity','North_component','East_component','Vertical_component' , 'DeclinationSV' , 'InclinationSV' , 'HorizontalSV' , 'TotalSV' , 'NorthSV' , 'EastSV' , 'VerticalSV']
+    colunas = COORDENADAS + COMPONENTES
+
+    def __init__(self,coordenadas,componentes,forma = None,eixos = None):
+        self.coordenadas = np.ascontiguousarray(coordenadas, dtype=np.float64)
+        self.componentes = np.ascontiguousarray(componentes, dtype=np.float64)
+        if self.coordenadas.shape[0] != len(self.COORDENADAS) or self.componentes.shape[0] != len(self.COMPONENTES):
+            raise ValueError(f'Expected {len(self.COORDENADAS)} coordinate and {len(self.COMPONENTES)} '
+                             f'component rows, got {self.coordenadas.shape[0]} and {self.componentes.shape[0]}.')
+        if self.coordenadas.shape[1:] != self.componentes.shape[1:]:
+            raise ValueError(f'{self.coordenadas.shape[1]} coordinates for {self.componentes.shape[1]} points.')
+        n = self.coordenadas.shape[1]
+        self.forma = (n,) if forma is None else tuple(forma)
+        if int(np.prod(self.forma)) != n:
+            raise ValueError(f'Shape {self.forma} does not match {n} points.')
+        self.eixos = {'ponto': np.arange(n)} if eixos is None else dict(eixos)
+
+    @classmethod
+    def vazio(cls,forma,eixos = None):
+        """RESULTADO NÃO PREENCHIDO COM OS PONTOS DE forma."""
+        n = int(np.prod(forma))
+        return cls(np.empty((len(cls.COORDENADAS), n)), np.empty((len(cls.COMPONENTES), n)), forma, eixos)
+
+    def preenche(self,valores):
+        """
+        PREENCHE AS COLUNAS COM valores (NA ORDEM DE colunas), COM BROADCASTING
+        PARA forma. COM MENOS valores SÓ AS PRIMEIRAS COLUNAS SÃO PREENCHIDAS.
+        """
+        for linha, v in zip(self.tupla(), valores):
+            linha.reshape(self.forma)[...] = v
+        return self
+
+    def __len__(self):
+        return self.coordenadas.shape[1]
+
+    def __getitem__(self,coluna):
+        i = self.colunas.index(coluna)
+        if i < len(self.COORDENADAS):
+            return self.coordenadas[i]
+        return self.componentes[i - len(self.COORDENADAS)]
+
+    def tupla(self):
+        """AS 18 COLUNAS (VIEWS) NA ORDEM DE colunas."""
+        return tuple(self.coordenadas) + tuple(self.componentes)
+
+    def para_pandas(self):
+        """DATAFRAME COM AS COLUNAS DO RESULTADO, SEM COPIAR OS DADOS."""
+        return pd.DataFrame(dict(zip(self.colunas, self.tupla())), copy=False)
+
+    def para_xarray(self):
+        """xarray.Dataset COM UMA VARIÁVEL POR COLUNA NOS EIXOS DE forma, SEM COPIAR OS DADOS."""
+        try:
+            import xarray as xr
+        except ImportError:
+            raise ImportError('para_xarray needs the xarray package.')
+        dims = tuple(self.eixos)
+        return xr.Dataset({c: (dims, v.reshape(self.forma)) for c, v in zip(self.colunas, self.tupla())},
+                          coords={d: (d, np.asarray(v)) for d, v in self.eixos.items()})
+
+    @classmethod
+    def concatena(cls,resultados):
+        """JUNTA VÁRIOS RESULTADOS (DE QUALQUER CÁLCULO) NUM SÓ, PONTO A PONTO."""
+        resultados = list(resultados)
+        for r in resultados:
+            if r.colunas != cls.colunas:
+                raise ValueError(f'Columns {r.colunas} do not match {cls.colunas}.')
+        return cls(np.concatenate([r.coordenadas for r in resultados], axis=1),
+                   np.concatenate([r.componentes for r in resultados], axis=1))
+
+# Geometria dos pares (latitudes, altitudes) já usados, do mais antigo ao mais
+# recente. Não depende do modelo nem do ano, então é compartilhada por todos.
+_geometrias = OrderedDict()
+_GEOMETRIAS_MAX = 16
+
+def geometria(vLat,vH):
+    """
+    GEOMETRIA DE TODAS AS LATITUDES E ALTITUDES DE UMA VEZ, COM CACHE.
+
+    Calcula com iut.gg_to_geo o raio e a colatitude geocêntricos e os fatores
+    de rotação (sd, cd) e, com iut.geo_to_gg, a altitude (arredondada) e a
+    latitude geodéticas de volta, como em _calc_igrf. O resultado é guardado
+    por (vLat, vH), então um grid usado de novo, em outro ano ou com outro
+    modelo, não recalcula a geometria. Onde geo_to_gg falha (NaN, perto dos
+    polos) a altitude e a latitude de entrada são usadas. Os arrays
+    retornados são só leitura.
+
+    Nos polos (|lat| = 90) os componentes do campo do grid são os mesmos de
+    _calc_igrf, que também avisa 'The geographic poles are included'. Só as
+    coordenadas diferem: em -90 _calc_igrf devolve altitude e latitude NaN,
+    o grid devolve as de entrada.
+
+    Parameters
+    ----------
+    vLat : ARRAY FLOAT
+        Latitudes geodéticas em graus decimais, shape (nlat,).
+    vH : ARRAY FLOAT
+        Altitudes acima do elipsoide [km], shape (nh,).
+
+    Returns
+    -------
+    alt, colat, sd, cd, alt_gg, lat_gg : ARRAYS FLOAT shape (nlat, nh)
+
+    """
+    vLat = np.asarray(vLat, dtype=np.float64).ravel()
+    vH = np.asarray(vH, dtype=np.float64).ravel()
+    chave = (vLat.tobytes(), vH.tobytes())
+    if chave in _geometrias:
+        _geometrias.move_to_end(chave)
+        return _geometrias[chave]
+
+    alt, colat, sd, cd = iut.gg_to_geo(vH[None, :], 90 - vLat[:, None])
+    alt_gg, lat_gg = iut.geo_to_gg(alt, colat)
+    lat_gg = 90-lat_gg
+    # geo_to_gg dá NaN perto dos polos; a ida e volta é a identidade
+    falhou = np.isnan(alt_gg) | np.isnan(lat_gg)
+    alt_gg = np.where(falhou, vH[None, :], alt_gg)
+    lat_gg = np.where(falhou, vLat[:, None], lat_gg)
+    alt_gg = np.round(alt_gg, decimals=3)
+
+    valores = tuple(np.broadcast_to(v, (vLat.size, vH.size)) for v in (alt, colat, sd, cd, alt_gg, lat_gg))
+    for v in valores:
+        v.flags.writeable = False
+    _geometrias[chave] = valores
+    if len(_geometrias) > _GEOMETRIAS_MAX:
+        _geometrias.popitem(last=False)
+    return valores
+
+# Campos por época dos grids já usados em _calc_igrf_grid, do mais antigo ao
+# mais recente. Uma varredura de anos sobre o mesmo grid reaproveita as épocas.
+# Ficam no máximo _CAMPOS_GRID_MAX grids e _CAMPOS_GRID_MAX_BYTES de épocas e
+# planos (o grid mais recente é sempre mantido); limpa_campos_grid() esvazia.
+_campos_grid = OrderedDict()
+_CAMPOS_GRID_MAX = 4
+_CAMPOS_GRID_MAX_BYTES = 512*1024**2
+
+def limpa_campos_grid():
+    """APAGA OS CAMPOS POR ÉPOCA GUARDADOS DOS GRIDS (LIBERA A MEMÓRIA)."""
+    _campos_grid.clear()
+
+def _guarda_campos_grid(chave,valores):
+    """
+    GUARDA (OU MARCA COMO RECENTE) OS CAMPOS DE UM GRID E APAGA OS MENOS USADOS
+    ATÉ CABER NOS LIMITES. CHAMADO DEPOIS DE campo_epocas.get, QUANDO AS
+    ÉPOCAS NOVAS JÁ FORAM SINTETIZADAS.
+    """
+    _campos_grid[chave] = valores
+    _campos_grid.move_to_end(chave)
+    total = sum(v[0].nbytes for v in _campos_grid.values())
+    while len(_campos_grid) > 1 and (len(_campos_grid) > _CAMPOS_GRID_MAX
+                                     or total > _CAMPOS_GRID_MAX_BYTES):
+        _, v = _campos_grid.popitem(last=False)
+        total -= v[0].nbytes
+
+class grid_colunar():
+    """
+    Grid guardado em disco por colunas, que pode ser escrito aos poucos.
+
+    Cada coluna é um arquivo binário float64 (<coluna>.f8) dentro da pasta e
+    o manifesto grid.json guarda as colunas e o número de linhas já
+    completas. Novas linhas são acrescentadas ao fim dos arquivos e só
+    depois o manifesto é atualizado (de forma atômica), então um processo
+    interrompido deixa legíveis todas as fatias já terminadas. A leitura é
+    feita por memory map, sem carregar o grid na memória.
+
+    Attributes
+    ----------
+        pasta : STRING
+            PASTA DO GRID.
+        colunas : LIST
+            NOMES DAS COLUNAS.
+        linhas : INT
+            NÚMERO DE LINHAS COMPLETAS.
+    """
+
+    MANIFESTO = 'grid.json'
+
+    def __init__(self,pasta,colunas = None,extra = None):
+        """
+        Abre o grid da pasta ou cria um novo (vazio) se colunas for dado.
+
+        Parameters
+        ----------
+        pasta : STRING
+            PASTA DO GRID.
+        colunas : LIST, optional
+            NOMES DAS COLUNAS DE UM GRID NOVO. UM GRID EXISTENTE NA PASTA É
+            APAGADO. The default is None (abre o grid existente).
+        extra : DICT, optional
+            INFORMAÇÕES GUARDADAS NO MANIFESTO DE UM GRID NOVO (self.extra).
+            The default is None.
+        """
+        self.pasta = pasta
+        if colunas is None:
+            with open(os.path.join(pasta, self.MANIFESTO), 'r') as f:
+                manifesto = json.load(f)
+            self.colunas = manifesto['colunas']
+            self.linhas = manifesto['linhas']
+            self.extra = manifesto.get('extra', {})
+        else:
+            os.makedirs(pasta, exist_ok=True)
+            self.colunas = list(colunas)
+            self.linhas = 0
+            self.extra = {} if extra is None else dict(extra)
+            for coluna in self.colunas:
+                open(self._arquivo(coluna), 'wb').close()
+            self._salva_manifesto()
+
+    def _arquivo(self,coluna):
+        return os.path.join(self.pasta, coluna.replace('/', '_') + '.f8')
+
+    def _salva_manifesto(self):
+        fd, tmp = tempfile.mkstemp(dir=self.pasta, suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'colunas': self.colunas, 'linhas': self.linhas,
+                       'extra': self.extra}, f)
+        os.replace(tmp, os.path.join(self.pasta, self.MANIFESTO))
+
+    def append(self,valores):
+        """
+        ACRESCENTA UMA FATIA DE LINHAS AO GRID.
+        O manifesto (com self.extra) é atualizado depois dos dados.
+
+        Parameters
+        ----------
+        valores : TUPLE de ARRAYS
+            UM ARRAY POR COLUNA, NA ORDEM DE self.colunas, TODOS DO MESMO TAMANHO.
+        """
+        n = None
+        for coluna, v in zip(self.colunas, valores):
+            v = np.ascontiguousarray(v, dtype=np.float64)
+            n = v.size if n is None else n
+            if v.size != n:
+                raise ValueError(f'Column {coluna} has {v.size} rows, expected {n}.')
+            with open(self._arquivo(coluna), 'r+b') as f:
+                # descarta o que sobrou de uma fatia interrompida
+                f.truncate(self.linhas*8)
+                f.seek(self.linhas*8)
+                v.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+        self.linhas += n or 0
+        self._salva_manifesto()
+
+    def completo(self):
+        """True SE TODOS OS ARQUIVOS DE COLUNA TÊM AS LINHAS DO MANIFESTO."""
+        try:
+            return all(os.path.getsize(self._arquivo(c)) >= self.linhas*8 for c in self.colunas)
+        except OSError:
+            return False
+
+    def ler(self):
+        """
+        RETORNA O GRID COMO DATAFRAME, COM AS COLUNAS EM MEMORY MAP.
+        O memory map é copy-on-write (mode='c'): o DataFrame pode ser
+        alterado como um lido de CSV, mas as alterações ficam só na memória
+        e nunca voltam para os arquivos do grid. Colunas com outro dtype em
+        self.extra['dtypes'] (p.ex. o índice inteiro de um CSV) são
+        convertidas de volta, numa cópia.
+
+        Returns
+        -------
+        DATAFRAME
+            LINHAS COMPLETAS DO GRID.
+        """
+        dados = {}
+        for coluna in self.colunas:
+            if self.linhas:
+                dados[coluna] = np.memmap(self._arquivo(coluna), dtype=np.float64,
+                                          mode='c', shape=(self.linhas,))
+            else:
+                dados[coluna] = np.zeros(0)
+        for coluna, dtype in zip(self.colunas, self.extra.get('dtypes', ())):
+            if np.dtype(dtype) != np.float64:
+                dados[coluna] = dados[coluna].astype(dtype)
+        return pd.DataFrame(dados, copy=False)
+
+class cache_grids():
+    """
+    Cache em disco de grids já calculados, endereçado pelo conteúdo.
+
+    Cada grid fica num grid_colunar numa subpasta cujo nome é o sha1 da sua
+    especificação (hash do arquivo do modelo, ano, pontos do grid e tipo de
+    coordenada, ver IGRF._especificacao_grid), então um grid pedido de novo é
+    lido por memory map e um grid de outra especificação nunca é confundido
+    com ele. O índice indice.json guarda o tamanho e o último acesso de cada
+    grid; passando de max_bytes ou max_grids, os menos usados recentemente
+    são apagados. O cache só é usado quando passado explicitamente (ver
+    IGRF.get_grid), então nada é gravado em disco por padrão.
+
+    Attributes
+    ----------
+        pasta : STRING
+            PASTA DO CACHE.
+        max_bytes : INT
+            TAMANHO MÁXIMO DO CACHE EM BYTES.
+        max_grids : INT
+            NÚMERO MÁXIMO DE GRIDS NO CACHE.
+        hits, misses : INT
+            CONTADORES DE CONSULTAS.
+    """
+
+    INDICE = 'indice.json'
+
+    def __init__(self,pasta,max_bytes = 2*1024**3,max_grids = 32):
+        self.pasta = pasta
+        self.max_bytes = max_bytes
+        self.max_grids = max_grids
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def chave(especificacao):
+        """SHA1 DA ESPECIFICAÇÃO (JSON COM CHAVES ORDENADAS, SEM AS COLUNAS)."""
+        especificacao = {k: v for k, v in especificacao.items() if k != 'colunas'}
+        return hashlib.sha1(json.dumps(especificacao, sort_keys=True).encode()).hexdigest()
+
+    def _le_indice(self):
+        try:
+            with open(os.path.join(self.pasta, self.INDICE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _salva_indice(self,indice):
+        fd, tmp = tempfile.mkstemp(dir=self.pasta, suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(indice, f)
+        os.replace(tmp, os.path.join(self.pasta, self.INDICE))
+
+    def _apaga(self,chave):
+        pasta = os.path.join(self.pasta, chave)
+        if os.path.isdir(pasta):
+            for nome in os.listdir(pasta):
+                os.remove(os.path.join(pasta, nome))
+            os.rmdir(pasta)
+
+    def get(self,especificacao):
+        """
+        RETORNA O GRID DA ESPECIFICAÇÃO (DATAFRAME EM MEMORY MAP) OU None.
+        """
+        chave = self.chave(especificacao)
+        with self._lock:
+            indice = self._le_indice()
+            pasta = os.path.join(self.pasta, chave)
+            if chave in indice and os.path.isfile(os.path.join(pasta, grid_colunar.MANIFESTO)):
+                grid = grid_colunar(pasta)
+                if self.chave(grid.extra.get('especificacao', {})) == chave and grid.completo():
+                    indice[chave]['acesso'] = time.time()
+                    self._salva_indice(indice)
+                    self.hits += 1
+                    return grid.ler()
+            self.misses += 1
+            return None
+
+    def guarda(self,especificacao,valores,dtypes = None):
+        """
+        GUARDA UM GRID NO CACHE E O RETORNA LIDO DO DISCO.
+
+        Parameters
+        ----------
+        especificacao : DICT
+            ESPECIFICAÇÃO DO GRID (COM A LISTA 'colunas').
+        valores : TUPLE de ARRAYS
+            UM ARRAY POR COLUNA, NA ORDEM DE especificacao['colunas'].
+        dtypes : LIST, optional
+            DTYPES DAS COLUNAS, RESTAURADOS NA LEITURA (VER grid_colunar.ler).
+            The default is None (float64).
+
+        Returns
+        -------
+        DATAFRAME
+            GRID EM MEMORY MAP.
+        """
+        chave = self.chave(especificacao)
+        with self._lock:
+            os.makedirs(self.pasta, exist_ok=True)
+            # escreve numa pasta temporária e renomeia: um grid no cache está sempre completo
+            tmp = tempfile.mkdtemp(dir=self.pasta, prefix='.' + chave)
+            extra = {'especificacao': especificacao}
+            if dtypes is not None:
+                extra['dtypes'] = list(dtypes)
+            grid = grid_colunar(tmp, especificacao['colunas'], extra=extra)
+            grid.append(valores)
+            self._apaga(chave)
+            os.rename(tmp, os.path.join(self.pasta, chave))
+            grid.pasta = os.path.join(self.pasta, chave)
+
+            indice = self._le_indice()
+            indice[chave] = {'acesso': time.time(), 'bytes': grid.linhas*8*len(grid.colunas),
+                             'ano': especificacao.get('ano')}
+            self._evicta(indice, manter=chave)
+            self._salva_indice(indice)
+            return grid.ler()
+
+    def _evicta(self,indice,manter = None):
+        ordem = sorted((c for c in indice if c != manter), key=lambda c: indice[c]['acesso'])
+        total = sum(v['bytes'] for v in indice.values())
+        while ordem and (total > self.max_bytes or len(indice) > self.max_grids):
+            chave = ordem.pop(0)
+            total -= indice.pop(chave)['bytes']
+            self._apaga(chave)
+
+    def limpa(self):
+        """APAGA TODOS OS GRIDS DO CACHE."""
+        with self._lock:
+            for chave in self._le_indice():
+                self._apaga(chave)
+            if os.path.isdir(self.pasta):
+                self._salva_indice({})
+
 class IGRF():
     """
     CLASS with functions to facilitate the usage of the  Ciaran Beggan's 
@@ -167,20 +949,24 @@ class IGRF():
     
         set_name_saida(self, name_saida):
         _salva_dataframe(self,nomesaida,ResultStore)
-        get_grid(self,nomearq)
+        get_grid(self,nomearq = None,...,cache = None)
         _calc_igrf(self,parLat,parLon,parH,parAno)
         calc_grid(self,intervalo_h = 10,lim_h = 500,intervalo_lat=-5,lim_lat=-60,intervalo_lon=-5,lim_lon=-110)
         calc_perfilh(self,lim_h = 300,intervalo_h = 5)
         coord_centro(self,dado,nomearq = "centro_coord")
+        calc_trajetoria_centro(self,anos = None,alturas = None,...)
         create_matriz_IntensidadeTotal(self,DfGrid,h = 400)
         calc_gradiente(self,DfGrid)
         plot_grid(self,Dfgrid,h = 400)
         _nT_to_T_grid(self)
         _nT_to_T_perfil
-        
+
     """
-    
-    def __init__(self,lat,lon,h,ano,name_saida):
+
+    # Ordem das colunas do Dfgrid e do DfPerfilh (mesma ordem da tupla de _calc_igrf)
+    _colunas_grid = resultado_campo.colunas
+
+    def __init__(self,lat,lon,h,ano,name_saida,arquivo_shc = None,tolerancia = None):
         """
         Inicializa a classe IGRF.
         
@@ -196,6 +982,13 @@ class IGRF():
             ANO NO QUAL SERÁ CALCULADO OS VALORES DO CAMPO GEOMAGNÉTICO.
         name_saida : STRING
             NOME DO ARQUIVO DE SAÍDA SEM O FORMATO.
+        arquivo_shc : STRING, optional
+            ARQUIVO .shc COM OS COEFICIENTES DO MODELO. The default is IGRF_FILE.
+        tolerancia : FLOAT, optional
+            ERRO DE TRUNCAMENTO MÁXIMO [nT] DOS CÁLCULOS VETORIZADOS (GRID E
+            PERFIS): A SÉRIE É CORTADA NO MENOR GRAU QUE O RESPEITA EM CADA
+            GRID, E O LIMITE ATINGIDO FICA EM self.truncamento. The default is
+            None (SEMPRE O GRAU MÁXIMO DO MODELO).
 
         Returns
         -------
@@ -204,6 +997,9 @@ class IGRF():
         """
         self.set_name_saida(name_saida)        
         self.entrada_usuario = (lat,lon,h,ano)
+        self.arquivo_shc = arquivo_shc
+        self.tolerancia = tolerancia
+        self.truncamento = None
     
     def set_name_saida(self, name_saida):
         """
@@ -238,14 +1034,27 @@ class IGRF():
         ResultStore.to_csv(nomesaida+".csv",sep=",",header=True)
         print("pyigrf_clara_0_6 - _salva_dataframe : arquivo", nomesaida," aberto.\n")
     
-    def get_grid(self,nomearq):
+    def get_grid(self,nomearq = None,intervalo_h = 10,lim_h = 500,intervalo_lat=-5,lim_lat=-60,intervalo_lon=-5,lim_lon=-110,cache = None):
         """
         CRIA UM DATAFRAME A PARTIR DE UM ARQUIVO CSV COM VALORES PREVIAMENTE CALCULADOS.
 
+        Sem nomearq, o grid com os mesmos parâmetros de calc_grid é calculado
+        com _calc_igrf_grid. Se cache (um cache_grids) for dado, o grid é
+        antes procurado nele: se já foi calculado para o mesmo modelo, ano e
+        pontos, é lido do disco (memory map); senão é calculado e guardado no
+        cache. Um CSV é lido com read_csv; com cache ele também é guardado
+        (pelo sha1 do seu conteúdo, com os dtypes das colunas) e só é lido
+        com read_csv uma vez. Sem cache nada é gravado em disco.
+
         Parameters
         ----------
-        nomearq : STRING
-            NOME DO ARQUIVO ONDE ESTÃO OS DADOS.
+        nomearq : STRING, optional
+            NOME DO ARQUIVO ONDE ESTÃO OS DADOS (OU PASTA DE UM grid_colunar).
+            The default is None (CALCULA O GRID).
+        intervalo_h, lim_h, intervalo_lat, lim_lat, intervalo_lon, lim_lon : FLOAT, optional
+            GRID CALCULADO (OU PEDIDO AO CACHE), COMO EM calc_grid.
+        cache : cache_grids, optional
+            CACHE EM DISCO USADO. The default is None (SEM CACHE).
 
         Returns
         -------
@@ -254,7 +1063,37 @@ class IGRF():
 
         """        
         
-        self.Dfgrid = pd.read_csv(nomearq,sep=",")
+        if nomearq is None:
+            vLat = np.arange(self.entrada_usuario[0],lim_lat,intervalo_lat)
+            vLon = np.arange(self.entrada_usuario[1],lim_lon,intervalo_lon)
+            vH = np.arange(self.entrada_usuario[2],lim_h,intervalo_h)
+            if cache is None:
+                self.Dfgrid = self._calc_igrf_grid(vLat,vLon,vH,self.entrada_usuario[3]).para_pandas()
+                self._nT_to_T_grid()
+                return self.Dfgrid
+            especificacao = self._especificacao_grid(vLat,vLon,vH,self.entrada_usuario[3])
+            self.Dfgrid = cache.get(especificacao)
+            if self.Dfgrid is None:
+                valores = self._calc_igrf_grid(vLat,vLon,vH,self.entrada_usuario[3])
+                # B(T) como em _nT_to_T_grid
+                valores = valores.tupla() + (valores["Total_intensity"] * 10**-9,)
+                self.Dfgrid = cache.guarda(especificacao,valores)
+        elif os.path.isdir(nomearq):
+            # grid gravado por calc_grid(fatias_lat = ...)
+            self.Dfgrid = grid_colunar(nomearq).ler()
+        elif cache is None:
+            self.Dfgrid = pd.read_csv(nomearq,sep=",")
+        else:
+            with open(nomearq, 'rb') as f:
+                especificacao = {'csv': hashlib.sha1(f.read()).hexdigest()}
+            self.Dfgrid = cache.get(especificacao)
+            if self.Dfgrid is None:
+                self.Dfgrid = pd.read_csv(nomearq,sep=",")
+                if all(np.issubdtype(t, np.number) for t in self.Dfgrid.dtypes):
+                    especificacao['colunas'] = list(self.Dfgrid.columns)
+                    cache.guarda(especificacao,
+                                 tuple(self.Dfgrid[c].to_numpy() for c in self.Dfgrid.columns),
+                                 dtypes = [str(t) for t in self.Dfgrid.dtypes])
         return self.Dfgrid
     
     def _calc_igrf(self,parLat,parLon,parH,parAno):
@@ -341,50 +1180,34 @@ class IGRF():
     
             
         # Interpolate the geomagnetic coefficients to the desired date(s)
+        # (main field, SV of the 5 year epoch and main field at the epoch start)
         # -=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
-        f = interpolate.interp1d(igrf.time, igrf.coeffs, fill_value='extrapolate')
-        coeffs = f(date)    
+        coeffs, coeffs_sv, coeffsm = modelos.coeficientes(self.arquivo_shc).get(date)
+
+        # The three syntheses below share the same location, so the Legendre
+        # and longitude tables are computed once
+        plano = iut.synth_plan(alt, colat, lon,
+                               modelos.get(self.arquivo_shc).parameters['nmax'])
         
         # Compute the main field B_r, B_theta and B_phi value for the location(s) 
-        Br, Bt, Bp = iut.synth_values(coeffs.T, alt, colat, lon,
-                                  igrf.parameters['nmax'])
+        Br, Bt, Bp = plano.values(coeffs.T)
         
-        # For the SV, find the 5 year period in which the date lies and compute
-        # the SV within that period. IGRF has constant SV between each 5 year period
-        # We don't need to subtract 1900 but it makes it clearer:
-        epoch = (date-1900)//5    
-        epoch_start = epoch * 5
-        
-        # Add 1900 back on plus 1 year to account for SV in nT per year (nT/yr):
-        coeffs_sv = f(1900+epoch_start+1) - f(1900+epoch_start)   
-        Brs, Bts, Bps = iut.synth_values(coeffs_sv.T, alt, colat, lon,
-                                  igrf.parameters['nmax'])
+        # SV in nT per year (nT/yr) within the 5 year period of the date
+        Brs, Bts, Bps = plano.values(coeffs_sv.T)
         
         # Use the main field coefficients from the start of each five epoch
         # to compute the SV for Dec, Inc, Hor and Total Field (F) 
         # [Note: these are non-linear components of X, Y and Z so treat separately]
-        coeffsm = f(1900+epoch_start);
-        Brm, Btm, Bpm = iut.synth_values(coeffsm.T, alt, colat, lon,
-                                  igrf.parameters['nmax'])
-        
-        # Rearrange to X, Y, Z components 
-        X = -Bt; Y = Bp; Z = -Br
-        # For the SV
-        dX = -Bts; dY = Bps; dZ = -Brs 
-        Xm = -Btm; Ym = Bpm; Zm = -Brm
-        
-        # Rotate back to geodetic coords if needed
-        if (itype == 1):
-            t = X; X = X*cd + Z*sd;  Z = Z*cd - t*sd
-            t = dX; dX = dX*cd + dZ*sd;  dZ = dZ*cd - t*sd
-            t = Xm; Xm = Xm*cd + Zm*sd;  Zm = Zm*cd - t*sd
-            
-        # Compute the four non-linear components 
-        dec, hoz, inc, eff = iut.xyz2dhif(X,Y,Z)
+        Brm, Btm, Bpm = plano.values(coeffsm.T)
         
+        # Rearrange to X, Y, Z components, rotate back to geodetic coords if
+        # needed and compute the four non-linear components of the field and
+        # of the SV, all in one pass.
         # The IGRF SV coefficients are relative to the main field components 
         # at the start of each five year epoch e.g. 2010, 2015, 2020
-        decs, hozs, incs, effs = iut.xyz2dhif_sv(Xm, Ym, Zm, dX, dY, dZ)
+        geodetica = {'sd': sd, 'cd': cd} if itype == 1 else {}
+        dec, inc, hoz, eff, X, Y, Z, decs, incs, hozs, effs, dX, dY, dZ = iut.field_components(
+            Br, Bt, Bp, Brs, Bts, Bps, Brm, Btm, Bpm, **geodetica)
         
         #print("\n\nfunc_main: eff: ",eff,"\n")
             
@@ -393,10 +1216,283 @@ class IGRF():
         #print("_calc_igrf lat",lat)
         lat = 90-lat
         
-        return  np.round(alt, decimals=3), lat, lon, date, dec, inc, hoz, eff, X, Y, Z, decs, hozs,\
-            incs, effs, dX, dY, dZ
-                     
-    def calc_grid(self,intervalo_h = 10,lim_h = 500,intervalo_lat=-5,lim_lat=-60,intervalo_lon=-5,lim_lon=-110):
+        return  np.round(alt, decimals=3), lat, lon, date, dec, inc, hoz, eff, X, Y, Z, decs, incs,\
+            hozs, effs, dX, dY, dZ
+
+    def _valida_pontos(self,vLat,vLon,parAno):
+        """CONFERE OS LIMITES DE LATITUDE, LONGITUDE E DATA E RETORNA A DATA."""
+        iut.check_lat_lon_arrays(vLat,vLon)
+        date = iut.check_float(parAno)
+        if date < 1900 or date > 2030:
+            raise ValueError(f'Date {date} out of bounds [1900, 2030].')
+        return date
+
+    def _calc_igrf_perfis(self,vLat,vLon,vH,parAno):
+        """
+        CALCULA AS COMPONENTES DO CAMPO MAGNÉTICO EM PERFIS DE ALTITUDE.
+        Como _calc_igrf_grid, mas para colunas (vLat[i], vLon[i]) dadas aos
+        pares em vez do produto lat x lon: todas as colunas e altitudes são
+        avaliadas de uma vez, com a geometria em (ncol, nh).
+
+        Parameters
+        ----------
+        vLat : ARRAY FLOAT
+            Latitudes geodéticas das colunas em graus decimais.
+        vLon : ARRAY FLOAT
+            Longitudes das colunas em graus decimais (mesmo tamanho de vLat).
+        vH : ARRAY FLOAT
+            Altitudes acima do elipsoide [km].
+        parAno : FLOAT
+            Ano decimal.
+
+        Returns
+        -------
+        resultado_campo
+            Mesmos 18 valores e na mesma ordem que _calc_igrf, com forma
+            (ncol, nh): os pontos ordenados por coluna e depois por altitude.
+
+        """
+        vLat = np.asarray(vLat, dtype=np.float64).ravel()
+        vLon = np.asarray(vLon, dtype=np.float64).ravel()
+        vH = np.asarray(vH, dtype=np.float64)
+        if vLat.size != vLon.size:
+            raise ValueError(f'{vLat.size} latitudes and {vLon.size} longitudes given, expected pairs.')
+        date = self._valida_pontos(vLat,vLon,parAno)
+
+        shape = (vLat.size, vH.size)
+
+        chave = ('perfis', modelos.caminho(self.arquivo_shc), self.tolerancia, vLat.tobytes(), vLon.tobytes(), vH.tobytes())
+        if chave in _campos_grid:
+            campos, alt, lat, lon = _campos_grid[chave]
+        else:
+            # Geometria: raio e colatitude geocêntrica em (ncol, nh)
+            alt, colat, sd, cd, alt_gg, lat = geometria(vLat,vH)
+            lon = vLon[:, None]
+
+            campos = campo_epocas(modelos.get(self.arquivo_shc), alt, colat, lon, sd, cd,
+                                  radial = vH.size > 5, tolerancia = self.tolerancia)
+            alt = alt_gg
+
+        resultado = resultado_campo.vazio(shape, {'perfil': np.arange(shape[0]), 'Altitude': vH})
+        campos.get(date, out=resultado.componentes.reshape((14,) + shape))
+        self.truncamento = campos.truncamento_data(date)
+        _guarda_campos_grid(chave, (campos, alt, lat, lon))
+
+        # só as coordenadas: as componentes já estão no bloco
+        return resultado.preenche((alt, lat, lon, date))
+
+    def _calc_igrf_grid(self,vLat,vLon,vH,parAno):
+        """
+        CALCULA AS COMPONENTES DO CAMPO MAGNÉTICO EM TODO UM GRID DE UMA VEZ.
+        Versão vetorizada de _calc_igrf: o cubo (lat, lon, h) inteiro é
+        avaliado de uma vez, usando broadcasting. A colatitude geocêntrica e o
+        raio dependem só de (lat, h) e a longitude só de lon, então o Legendre
+        é calculado em (nlat, 1, nh) e não no cubo inteiro. O campo vem de um
+        campo_epocas guardado por grid, então outros anos no mesmo grid não
+        refazem a síntese.
+
+        Parameters
+        ----------
+        vLat : ARRAY FLOAT
+            Latitudes geodéticas em graus decimais.
+        vLon : ARRAY FLOAT
+            Longitudes em graus decimais.
+        vH : ARRAY FLOAT
+            Altitudes acima do elipsoide [km].
+        parAno : FLOAT
+            Ano decimal.
+
+        Returns
+        -------
+        resultado_campo
+            Mesmos 18 valores e na mesma ordem que _calc_igrf, com forma
+            (nlat, nlon, nh): os pontos ordenados como no laço de calc_grid
+            (lat, depois lon, depois h).
+
+        """
+        vLat = np.asarray(vLat, dtype=np.float64)
+        vLon = np.asarray(vLon, dtype=np.float64)
+        vH = np.asarray(vH, dtype=np.float64)
+        date = self._valida_pontos(vLat,vLon,parAno)
+
+        shape = (vLat.size, vLon.size, vH.size)
+
+        chave = (modelos.caminho(self.arquivo_shc), self.tolerancia, vLat.tobytes(), vLon.tobytes(), vH.tobytes())
+        if chave in _campos_grid:
+            campos, alt, lat, lon = _campos_grid[chave]
+        else:
+            # Geometria: raio e colatitude geocêntrica em (nlat, 1, nh)
+            alt, colat, sd, cd, alt_gg, lat = (v[:, None, :] for v in geometria(vLat,vH))
+            lon = vLon[None, :, None]
+
+            # com muitos níveis de altitude a síntese separável em raio compensa
+            campos = campo_epocas(modelos.get(self.arquivo_shc), alt, colat, lon, sd, cd,
+                                  radial = vH.size > 5, tolerancia = self.tolerancia)
+            alt = alt_gg
+
+        # Campo e SV por interpolação linear entre as épocas do modelo,
+        # escritos direto no bloco de componentes do resultado
+        resultado = resultado_campo.vazio(shape, {'Latitude': vLat, 'Longitude': vLon, 'Altitude': vH})
+        campos.get(date, out=resultado.componentes.reshape((14,) + shape))
+        self.truncamento = campos.truncamento_data(date)
+        _guarda_campos_grid(chave, (campos, alt, lat, lon))
+
+        # só as coordenadas: as componentes já estão no bloco
+        return resultado.preenche((alt, lat, lon, date))
+
+    def _calc_igrf_grid_paralelo(self,vLat,vLon,vH,parAno,processos,executor = None):
+        """
+        EXECUTA _calc_igrf_grid EM VÁRIOS PROCESSOS, POR FAIXAS DE LATITUDE.
+
+        Cada processo lê o modelo uma única vez (no inicializador) e escreve
+        a sua faixa direto num bloco de memória compartilhada, na mesma
+        posição que ela ocupa no resultado serial. O resultado é idêntico,
+        byte a byte, ao de _calc_igrf_grid, independente da ordem em que os
+        processos terminam. Os pontos ficam portanto na ordem do grid serial
+        (latitude, longitude, altitude), e não na ordem de going_to_multiindex
+        (Altitude, Latitude, Longitude), que ordena o DataFrame ela mesma.
+
+        Parameters
+        ----------
+        vLat, vLon, vH, parAno :
+            Como em _calc_igrf_grid.
+        processos : INT
+            NÚMERO DE PROCESSOS.
+        executor : ProcessPoolExecutor, optional
+            EXECUTOR JÁ CRIADO COM _inicia_processo, REUSADO ENTRE CHAMADAS
+            (VER _calc_grid_fatias). The default is None (CRIA UM).
+
+        Returns
+        -------
+        resultado_campo
+            Mesmo retorno de _calc_igrf_grid.
+
+        """
+        vLat = np.asarray(vLat, dtype=np.float64)
+        vLon = np.asarray(vLon, dtype=np.float64)
+        vH = np.asarray(vH, dtype=np.float64)
+
+        # sem pontos não há faixas: o caminho serial já trata o grid vazio
+        if vLat.size*vLon.size*vH.size == 0:
+            return self._calc_igrf_grid(vLat,vLon,vH,parAno)
+
+        por_lat = vLon.size*vH.size
+        npts = vLat.size*por_lat
+        faixas = [f for f in np.array_split(np.arange(vLat.size), min(vLat.size, 4*processos)) if f.size]
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(self._colunas_grid)*npts*8))
+        try:
+            with self._executor(processos) if executor is None else nullcontext(executor) as executor:
+                tarefas = [executor.submit(_calc_faixa, shm.name, npts, f[0]*por_lat,
+                                           vLat[f], vLon, vH, parAno) for f in faixas]
+                truncamentos = [tarefa.result() for tarefa in tarefas]
+            saida = np.ndarray((len(self._colunas_grid), npts), dtype=np.float64, buffer=shm.buf)
+            n = len(resultado_campo.COORDENADAS)
+            resultado = resultado_campo(saida[:n].copy(), saida[n:].copy(), (vLat.size, vLon.size, vH.size),
+                                        {'Latitude': vLat, 'Longitude': vLon, 'Altitude': vH})
+            del saida
+        finally:
+            shm.close()
+            shm.unlink()
+
+        if self.tolerancia is not None:
+            self.truncamento = {'nmax': max(t['nmax'] for t in truncamentos),
+                                'erro': max(t['erro'] for t in truncamentos)}
+        return resultado
+
+    def _executor(self,processos):
+        """PROCESSOS QUE JÁ LERAM O MODELO (_inicia_processo), PARA _calc_faixa."""
+        return ProcessPoolExecutor(processos, initializer=_inicia_processo,
+                                   initargs=(self.arquivo_shc,self.tolerancia))
+
+    def _especificacao_grid(self,vLat,vLon,vH,parAno,fatias_lat = None):
+        """
+        DESCREVE UM CÁLCULO DE GRID: MODELO, ANO, PONTOS, COORDENADAS E FATIAS.
+        Duas especificações iguais produzem o mesmo grid.
+        """
+        with open(modelos.caminho(self.arquivo_shc), 'rb') as f:
+            sha_modelo = hashlib.sha1(f.read()).hexdigest()
+        sha_grid = hashlib.sha1()
+        for v in (vLat, vLon, vH):
+            v = np.asarray(v, dtype=np.float64)
+            sha_grid.update(str(v.size).encode())
+            sha_grid.update(v.tobytes())
+        return {'modelo': sha_modelo, 'ano': float(parAno),
+                'lat': [float(vLat[0]), float(vLat[-1]), int(np.size(vLat))] if np.size(vLat) else [],
+                'lon': [float(vLon[0]), float(vLon[-1]), int(np.size(vLon))] if np.size(vLon) else [],
+                'h': [float(vH[0]), float(vH[-1]), int(np.size(vH))] if np.size(vH) else [],
+                'grid': sha_grid.hexdigest(), 'coordenadas': 'geodeticas',
+                'tolerancia': None if self.tolerancia is None else float(self.tolerancia),
+                'fatias_lat': None if fatias_lat is None else int(fatias_lat),
+                'colunas': self._colunas_grid + ["B(T)"]}
+
+    def _calc_grid_fatias(self,vLat,vLon,vH,parAno,pasta,fatias_lat,processos = 1,retomar = True):
+        """
+        CALCULA O GRID EM FATIAS DE LATITUDE, GRAVANDO CADA UMA NUM grid_colunar.
+
+        O manifesto do grid guarda a especificação do cálculo (hash do arquivo
+        do modelo, ano, pontos do grid e tamanho das fatias) e o número de
+        fatias completas. Se a pasta já tem um grid com a mesma especificação,
+        as fatias completas são mantidas e o cálculo continua da seguinte;
+        qualquer diferença (inclusive no arquivo .shc) recomeça do zero.
+
+        Parameters
+        ----------
+        vLat, vLon, vH, parAno :
+            Como em _calc_igrf_grid.
+        pasta : STRING
+            PASTA DO grid_colunar.
+        fatias_lat : INT
+            NÚMERO DE LATITUDES POR FATIA.
+        processos : INT, optional
+            PROCESSOS POR FATIA (VER _calc_igrf_grid_paralelo), CRIADOS UMA
+            VEZ E REUSADOS EM TODAS AS FATIAS. The default is 1.
+        retomar : BOOL, optional
+            SE True, REAPROVEITA AS FATIAS JÁ CALCULADAS NA PASTA. The default is True.
+
+        Returns
+        -------
+        DATAFRAME
+            GRID LIDO DO DISCO, COM AS MESMAS COLUNAS DO Dfgrid.
+
+        """
+        vLat = np.asarray(vLat, dtype=np.float64)
+        vLon = np.asarray(vLon, dtype=np.float64)
+        vH = np.asarray(vH, dtype=np.float64)
+        especificacao = self._especificacao_grid(vLat,vLon,vH,parAno,fatias_lat)
+        por_fatia = fatias_lat*vLon.size*vH.size
+
+        store = None
+        if retomar and os.path.isfile(os.path.join(pasta, grid_colunar.MANIFESTO)):
+            existente = grid_colunar(pasta)
+            feitas = existente.extra.get('fatias_completas', 0)
+            if (existente.extra.get('especificacao') == especificacao
+                    and existente.linhas == min(feitas*por_fatia, vLat.size*vLon.size*vH.size)
+                    and existente.completo()):
+                store = existente
+                print("pyigrf_clara - calc_grid : retomando,", feitas, "fatias já calculadas")
+            else:
+                print("pyigrf_clara - calc_grid : grid em", pasta, "é de outra especificação, recalculando")
+
+        if store is None:
+            store = grid_colunar(pasta, especificacao['colunas'],
+                                 extra = {'especificacao': especificacao, 'fatias_completas': 0})
+
+        with self._executor(processos) if processos > 1 else nullcontext() as executor:
+            for k in range(store.extra['fatias_completas'], -(-vLat.size//fatias_lat)):
+                fatia = vLat[k*fatias_lat:(k+1)*fatias_lat]
+                if processos > 1:
+                    valores = self._calc_igrf_grid_paralelo(fatia,vLon,vH,parAno,processos,executor)
+                else:
+                    valores = self._calc_igrf_grid(fatia,vLon,vH,parAno)
+                # B(T) como em _nT_to_T_grid
+                store.extra['fatias_completas'] = k + 1
+                store.append(valores.tupla() + (valores["Total_intensity"] * 10**-9,))
+                print("pyigrf_clara - calc_grid : latitudes", fatia[0], "a", fatia[-1], "salvas")
+
+        return store.ler()
+
+    def calc_grid(self,intervalo_h = 10,lim_h = 500,intervalo_lat=-5,lim_lat=-60,intervalo_lon=-5,lim_lon=-110,vetorizado = False,processos = 1,fatias_lat = None,retomar = True):
         """
         CRIA O GRID PARA OS INTERVALOS DE ALTURA, LATITUDE E LONGITUDE ESPECIFICADOS E SALVA OS DADOS NUM ARQUIVO. 
         
@@ -414,18 +1510,61 @@ class IGRF():
             INTERVALO ENTRE OS PONTOS DE LONGITUDE A SEREM CALCULADOS [decimal degree]. The default is -1.
         lim_lon : FLOAT, optional
             LONGITUDE MÁXIMA [decimal degree]. The default is -35.
+        vetorizado : BOOL, optional
+            SE True, CALCULA O GRID INTEIRO DE UMA VEZ COM _calc_igrf_grid EM
+            VEZ DE PONTO A PONTO. O Dfgrid RESULTANTE É O MESMO. The default is False.
+        processos : INT, optional
+            SE MAIOR QUE 1, O GRID VETORIZADO É DIVIDIDO EM FAIXAS DE LATITUDE
+            CALCULADAS EM PARALELO POR ESSE NÚMERO DE PROCESSOS (IMPLICA
+            vetorizado = True). The default is 1.
+        fatias_lat : INT, optional
+            SE DADO, O GRID VETORIZADO É CALCULADO EM FATIAS COM ESSE NÚMERO DE
+            LATITUDES E CADA FATIA É ACRESCENTADA A UM grid_colunar NA PASTA
+            name_saida + "_grid" ASSIM QUE FICA PRONTA, EM VEZ DO CSV. A MEMÓRIA
+            FICA LIMITADA AO TAMANHO DE UMA FATIA E O Dfgrid É LIDO DO DISCO
+            (MEMORY MAP). The default is None.
+        retomar : BOOL, optional
+            COM fatias_lat, SE A PASTA JÁ TEM UM CÁLCULO INTERROMPIDO DO MESMO
+            GRID (MESMO MODELO, ANO, PONTOS E FATIAS), CONTINUA DE ONDE PAROU.
+            The default is True.
 
         Returns
         -------
-        lgrid : DATAFRAME
+        self.Dfgrid : DATAFRAME
             DATAFRAME COM OS VALORES CALCULADOS NAS ALTURAS E COORDENADAS DADAS.
+            ATENÇÃO: ANTES O CAMINHO PONTO A PONTO (vetorizado = False)
+            RETORNAVA A LISTA DE TUPLAS lgrid; ELA CONTINUA EM self.lgrid.
 
         """
         lgrid = []
-        
+
         print("pyigrf_0_3 - calc_grid self.Dfgrid : starting to calculate grid")
         print(np.arange(self.entrada_usuario[0],lim_lat,intervalo_lat))
-        
+
+        if vetorizado or processos > 1 or fatias_lat:
+            vLat = np.arange(self.entrada_usuario[0],lim_lat,intervalo_lat)
+            vLon = np.arange(self.entrada_usuario[1],lim_lon,intervalo_lon)
+            vH = np.arange(self.entrada_usuario[2],lim_h,intervalo_h)
+            if fatias_lat:
+                self.Dfgrid = self._calc_grid_fatias(vLat,vLon,vH,self.entrada_usuario[3],
+                                                     self.name_saida + "_grid",fatias_lat,processos,retomar)
+                print("\npyigrf_clara - calc_grid : grid saved")
+                return self.Dfgrid
+            if processos > 1:
+                vgrid = self._calc_igrf_grid_paralelo(vLat,vLon,vH,self.entrada_usuario[3],processos)
+            else:
+                vgrid = self._calc_igrf_grid(vLat,vLon,vH,self.entrada_usuario[3])
+            self.Dfgrid = vgrid.para_pandas()
+            self._nT_to_T_grid()
+            if self.truncamento is not None:
+                print("pyigrf_clara - calc_grid : nmax",self.truncamento['nmax'],
+                      ", erro de truncamento <=",round(self.truncamento['erro'],3),"nT")
+
+            self._salva_dataframe(self.name_saida + "_grid",self.Dfgrid)
+            print("\npyigrf_clara - calc_grid : grid saved")
+
+            return self.Dfgrid
+
         for lat1 in np.arange(self.entrada_usuario[0],lim_lat,intervalo_lat):
             #print("\n\n lat1",lat1)
             for lon in np.arange(self.entrada_usuario[1],lim_lon,intervalo_lon):
@@ -440,7 +1579,8 @@ class IGRF():
                     
         #print("\n\ncalc_grid - grid :",len(grid))
         print("lgrid",lgrid)
-        self.Dfgrid = pd.DataFrame(lgrid,columns = ['Altitude','Latitude','Longitude','Year','Declination' , 'Inclination' , 'Horizontal_intensity' , 'Total_intensity','North_component','East_component','Vertical_component' , 'DeclinationSV' , 'InclinationSV' , 'HorizontalSV' , 'TotalSV' , 'NorthSV' , 'EastSV' , 'VerticalSV'] )
+        self.lgrid = lgrid
+        self.Dfgrid = pd.DataFrame(lgrid,columns = self._colunas_grid)
         self._nT_to_T_grid()
         
         #print("\nDfgrid:",self.Dfgrid)
@@ -451,7 +1591,7 @@ class IGRF():
         
         print("\npyigrf_clara - calc_grid : grid saved")
         
-        return lgrid
+        return self.Dfgrid
     
     
     def going_to_multiindex(self,df):
@@ -463,16 +1603,23 @@ class IGRF():
         return df.set_index(["Altitude",'Latitude','Longitude'])
         
                                 
-    def calc_perfilh(self,lat,lon,lim_h = 750,intervalo_h = 5):
+    def calc_perfilh(self,lat,lon,lim_h = 750,intervalo_h = 5,vetorizado = False):
         """
         Função que calcula os valores do campo magnético em um perfil de altitude.
 
         Parameters
         ----------
+        lat, lon : FLOAT (OU ARRAY FLOAT SE vetorizado = True)
+            COORDENADAS DO PERFIL EM GRAUS DECIMAIS. COM vetorizado, ARRAYS DO
+            MESMO TAMANHO DÃO UM PERFIL POR PAR (lat[i], lon[i]), UM APÓS O OUTRO.
         lim_h : INT, optional
             LIMITE SUPERIOR PARA O QUAL A ALTURA SERÁ CALCULADA. The default is 300.
         intervalo_h : INT, optional
             INTERVALOS PARA O QUAL OS VALORES SERÃO CALCULADOS. The default is 5.
+        vetorizado : BOOL, optional
+            SE True, CALCULA TODAS AS ALTITUDES (E PERFIS) DE UMA VEZ COM
+            _calc_igrf_perfis EM VEZ DE PONTO A PONTO. O DfPerfilh TEM O MESMO
+            FORMATO. The default is False.
 
         Returns
         -------
@@ -483,12 +1630,16 @@ class IGRF():
         lperfil = []
         print("pyigrf_clara - calc_perfilh: Calculando Perfil de Altura do Campo Magnético")
        
-        for i in np.arange(self.entrada_usuario[2],lim_h,intervalo_h): 
-            lperfil.append(self._calc_igrf(lat,lon,i,self.entrada_usuario[3])) #quando ele calcula ele já guarda no arquivo o valor daquele ponto
+        if vetorizado:
+            vH = np.arange(self.entrada_usuario[2],lim_h,intervalo_h)
+            self.DfPerfilh = self._calc_igrf_perfis(np.atleast_1d(lat),np.atleast_1d(lon),vH,self.entrada_usuario[3]).para_pandas()
+        else:
+            for i in np.arange(self.entrada_usuario[2],lim_h,intervalo_h): 
+                lperfil.append(self._calc_igrf(lat,lon,i,self.entrada_usuario[3])) #quando ele calcula ele já guarda no arquivo o valor daquele ponto
         
-        #print("pyigrf_clara - calc_perfilh : lperfil",lperfil[1])
+            #print("pyigrf_clara - calc_perfilh : lperfil",lperfil[1])
         
-        self.DfPerfilh = pd.DataFrame(lperfil,columns =['Latitude','Longitude','Altitude','Year','Declination' , 'Inclination' , 'Horizontal_intensity' , 'Total_intensity','North_component','East_component','Vertical_component' , 'DeclinationSV' , 'InclinationSV' , 'HorizontalSV' , 'TotalSV' , 'NorthSV' , 'EastSV' , 'VerticalSV'] )
+            self.DfPerfilh = pd.DataFrame(lperfil,columns = self._colunas_grid)
         self._nT_to_T_perfil()
         
         self._salva_dataframe(nomesaida,self.DfPerfilh) # Salva os valores num arquivo
@@ -566,6 +1717,429 @@ class IGRF():
         return linha_dataframe["Latitude"],linha_dataframe["Longitude"], linha_dataframe["Total_intensity"],linha_dataframe["Altitude"]
 
 
+    def calc_trajetoria_centro(self,anos = None,alturas = None,regiao = (-70,10,-120,60),passo = 5.,tol = 1e-8,max_iter = 30):
+        """
+        ACOMPANHA O CENTRO DA ANOMALIA MAGNÉTICA DO ATLÂNTICO SUL (MÍNIMO DE |B|) POR ANO E ALTURA.
+
+        Para cada ano e altura o mínimo é procurado primeiro num grid grosso
+        da região (_calc_igrf_grid, que reaproveita as épocas entre os anos) e
+        depois refinado pelo método de Newton sobre o campo analítico: o
+        gradiente de |B| vem de iut.synth_values_grad e a hessiana de
+        diferenças centrais desse gradiente. Todos os anos e alturas são
+        otimizados juntos, numa única síntese por iteração, em latitude
+        geodética e longitude na altura geodética pedida (o gradiente em r e
+        theta é levado à latitude geodética pela regra da cadeia). Ao contrário de
+        coord_centro, a precisão não depende do espaçamento do grid.
+
+        Parameters
+        ----------
+        anos : ARRAY FLOAT, optional
+            ANOS DECIMAIS. The default is None (1900 A 2025, DE ANO EM ANO).
+        alturas : ARRAY FLOAT, optional
+            ALTURAS GEODÉTICAS [km]. The default is None (A ALTURA INICIAL DA CLASSE).
+        regiao : TUPLE, optional
+            (LAT_MIN, LAT_MAX, LON_MIN, LON_MAX) DO GRID GROSSO [graus].
+            The default is (-70,10,-120,60).
+        passo : FLOAT, optional
+            ESPAÇAMENTO DO GRID GROSSO [graus]. The default is 5.
+        tol : FLOAT, optional
+            PASSO DE NEWTON [rad] ABAIXO DO QUAL A BUSCA PARA. The default is 1e-8.
+        max_iter : INT, optional
+            NÚMERO MÁXIMO DE ITERAÇÕES DE NEWTON. The default is 30.
+
+        Returns
+        -------
+        self.DfTrajetoria : DATAFRAME
+            UMA LINHA POR (ANO, ALTURA) COM "Year", "Altitude", "Latitude",
+            "Longitude" E "Total_intensity" [nT] DO CENTRO.
+
+        """
+        anos = np.arange(1900., 2026.) if anos is None else np.array([iut.check_float(a) for a in np.atleast_1d(anos)])
+        # datas conferidas uma vez, como em _valida_pontos
+        fora = (anos < 1900) | (anos > 2030)
+        if fora.any():
+            raise ValueError(f'Date {anos[fora][0]} out of bounds [1900, 2030].')
+        alturas = np.atleast_1d(np.asarray(self.entrada_usuario[2] if alturas is None else alturas, dtype=np.float64))
+        vLat = np.arange(regiao[0], regiao[1] + passo/2, passo)
+        vLon = np.arange(regiao[2], regiao[3] + passo/2, passo)
+        nh = alturas.size
+
+        # sementes: mínimo do grid grosso em cada ano e altura
+        A, H = (v.ravel() for v in np.meshgrid(anos, alturas, indexing='ij'))
+        lat = np.empty(A.size); lon = np.empty(A.size)
+        for i, ano in enumerate(anos):
+            F = self._calc_igrf_grid(vLat,vLon,alturas,ano)['Total_intensity'].reshape(vLat.size*vLon.size, nh)
+            il, io = np.unravel_index(F.argmin(axis=0), (vLat.size, vLon.size))
+            lat[i*nh:(i+1)*nh] = vLat[il]; lon[i*nh:(i+1)*nh] = vLon[io]
+
+        coeficientes = modelos.coeficientes(self.arquivo_shc)
+        coeffs = np.stack([coeficientes.get(a)[0] for a in A])
+        nmax = modelos.get(self.arquivo_shc).parameters['nmax']
+
+        # desvios para a hessiana: centro, +-lat e +-lon [rad]
+        e = 1e-5
+        desvios = np.array([[0, 0], [e, 0], [-e, 0], [0, e], [0, -e]])[:, :, None]
+        passo_max = np.deg2rad(2.)
+
+        # variáveis: latitude geodética e longitude [rad] na altura geodética H
+        x = np.deg2rad(np.stack([lat, lon]))
+        for it in range(max_iter):
+            pts = x[None] + desvios
+            lat_pts = np.rad2deg(pts[:, 0])
+            r, th, _, _ = iut.gg_to_geo(H[None], 90 - lat_pts)
+            # derivadas de r e theta [rad] em relação à latitude geodética [rad]
+            rp, thp, _, _ = iut.gg_to_geo(H[None], 90 - lat_pts - 1e-4)
+            rm, thm, _, _ = iut.gg_to_geo(H[None], 90 - lat_pts + 1e-4)
+            dr_dlat = (rp - rm)/np.deg2rad(2e-4)
+            dth_dlat = (thp - thm)/2e-4
+
+            Br, Bt, Bp, dB = iut.synth_values_grad(coeffs[None], r, th, np.rad2deg(pts[:, 1]), nmax)
+            F, dF = iut.grad_intensity(Br, Bt, Bp, dB)
+            g_lat = dF[0]*dr_dlat + dF[1]*dth_dlat
+            g_lon = dF[2]
+
+            g = np.stack([g_lat[0], g_lon[0]])
+            Hll = (g_lat[1] - g_lat[2])/(2*e)
+            Hoo = (g_lon[3] - g_lon[4])/(2*e)
+            Hlo = ((g_lon[1] - g_lon[2]) + (g_lat[3] - g_lat[4]))/(4*e)
+            det = Hll*Hoo - Hlo**2
+
+            # Newton onde a hessiana é positiva definida, senão descida pelo gradiente
+            newton = (det > 0) & (Hll > 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                d = np.where(newton, -np.stack([Hoo*g[0] - Hlo*g[1], Hll*g[1] - Hlo*g[0]])/det,
+                             -g/np.hypot(g[0], g[1])*passo_max)
+            d = np.nan_to_num(d)
+            norma = np.hypot(d[0], d[1])
+            d = d*np.minimum(1, passo_max/np.maximum(norma, 1e-300))
+            x = x + d
+            if norma.max() < tol:
+                break
+
+        lat = np.rad2deg(x[0])
+        lon = np.rad2deg(x[1])
+        r, th, _, _ = iut.gg_to_geo(H, 90 - lat)
+        F = iut.grad_intensity(*iut.synth_values_grad(coeffs, r, th, lon, nmax))[0]
+
+        lon = (lon + 180) % 360 - 180
+        self.DfTrajetoria = pd.DataFrame({'Year': A, 'Altitude': H, 'Latitude': lat,
+                                          'Longitude': lon, 'Total_intensity': F})
+        self._salva_dataframe(self.name_saida + "_trajetoria_centro",self.DfTrajetoria)
+        return self.DfTrajetoria
+
+    @staticmethod
+    def _componente_geodetica(coeffs,H,lat,lon,nmax,componente):
+        """VALOR DE UMA COMPONENTE (X, Y, Z, H, F [nT], D OU I [graus]) NA ALTURA E LATITUDE GEODÉTICAS."""
+        r, th, sd, cd = iut.gg_to_geo(H, 90 - lat)
+        Br, Bt, Bp = iut.synth_values(coeffs, r, th, lon, nmax=nmax)
+        X = -Bt*cd - Br*sd
+        Y = Bp
+        Z = Bt*sd - Br*cd
+        if componente == 'X':
+            return X
+        if componente == 'Y':
+            return Y
+        if componente == 'Z':
+            return Z
+        if componente == 'H':
+            return np.hypot(X, Y)
+        if componente == 'F':
+            return np.sqrt(X*X + Y*Y + Z*Z)
+        if componente == 'D':
+            return np.rad2deg(np.arctan2(Y, X))
+        return np.rad2deg(np.arctan2(Z, np.hypot(X, Y)))
+
+    def calc_isolinhas(self,componente = 'I',valor = 0.,anos = None,alturas = None,lons = None,faixa_lat = (-60,60),passo_lat = 1.,tol = 1e-4,max_iter = 60):
+        """
+        ACHA AS LATITUDES ONDE UMA COMPONENTE DO CAMPO TEM UM VALOR DADO AO LONGO DE MERIDIANOS.
+
+        Com componente = 'I' e valor = 0 (o padrão) é o equador magnético
+        (dip equator). Em cada meridiano, ano e altura a componente é
+        calculada numa varredura grossa em latitude (uma síntese por ano para
+        todos os meridianos e alturas) para achar os intervalos com troca de
+        sinal; cada raiz é então refinada pelo método da falsa posição
+        modificado (Illinois), que mantém o intervalo, com todas as raízes de
+        todos os anos e alturas numa única síntese por iteração. A precisão
+        não depende do espaçamento de um grid: o erro em latitude fica abaixo
+        de tol. Um meridiano pode ter mais de uma raiz (coluna "Ramo") ou
+        nenhuma dentro de faixa_lat.
+
+        Parameters
+        ----------
+        componente : STRING, optional
+            'D', 'I' [graus], 'X', 'Y', 'Z', 'H' OU 'F' [nT], GEODÉTICAS. The default is 'I'.
+        valor : FLOAT, optional
+            VALOR DA ISOLINHA. The default is 0.
+        anos : ARRAY FLOAT, optional
+            ANOS DECIMAIS. The default is None (O ANO DA CLASSE).
+        alturas : ARRAY FLOAT, optional
+            ALTURAS GEODÉTICAS [km]. The default is None (A ALTURA INICIAL DA CLASSE).
+        lons : ARRAY FLOAT, optional
+            LONGITUDES DOS MERIDIANOS [graus]. The default is None (-180 A 179, DE GRAU EM GRAU).
+        faixa_lat : TUPLE, optional
+            (LAT_MIN, LAT_MAX) DA BUSCA [graus]. The default is (-60,60).
+        passo_lat : FLOAT, optional
+            ESPAÇAMENTO DA VARREDURA GROSSA [graus]. RAÍZES MAIS PRÓXIMAS QUE
+            ISSO PODEM SE PERDER. The default is 1.
+        tol : FLOAT, optional
+            LARGURA DO INTERVALO [graus] ABAIXO DA QUAL A RAIZ É ACEITA. The default is 1e-4.
+        max_iter : INT, optional
+            NÚMERO MÁXIMO DE ITERAÇÕES DO REFINAMENTO. The default is 60.
+
+        Returns
+        -------
+        self.DfIsolinha : DATAFRAME
+            UMA LINHA POR RAIZ COM "Year", "Altitude", "Longitude", "Ramo"
+            (ORDEM DAS RAÍZES NO MERIDIANO, DO SUL PARA O NORTE) E "Latitude".
+
+        """
+        componente = componente.upper()
+        if componente not in ('D','I','X','Y','Z','H','F'):
+            raise ValueError(f'Componente {componente} desconhecida.')
+        anos = np.atleast_1d(np.asarray(self.entrada_usuario[3] if anos is None else anos, dtype=np.float64))
+        alturas = np.atleast_1d(np.asarray(self.entrada_usuario[2] if alturas is None else alturas, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(np.arange(-180., 180.) if lons is None else lons, dtype=np.float64))
+        vLat = np.arange(faixa_lat[0], faixa_lat[1] + passo_lat/2, passo_lat)
+
+        coeficientes = modelos.coeficientes(self.arquivo_shc)
+        nmax = modelos.get(self.arquivo_shc).parameters['nmax']
+
+        def desvio(f):
+            # a declinação é um ângulo: diferença em (-180, 180]
+            if componente == 'D':
+                return (f - valor + 180.) % 360. - 180.
+            return f - valor
+
+        # varredura grossa: intervalos com troca de sinal, para todos os anos
+        H, O, L = np.meshgrid(alturas, lons, vLat, indexing='ij')
+        anos_raiz, coeffs, h, lon, lat_a, lat_b, f_a, f_b = ([] for _ in range(8))
+        for ano in anos:
+            c = coeficientes.get(self._valida_pontos(vLat,lons,ano))[0]
+            f = desvio(self._componente_geodetica(c,H,L,O,nmax,componente))
+            troca = (f[..., :-1] < 0) != (f[..., 1:] < 0)
+            if componente == 'D':
+                troca &= np.abs(f[..., 1:] - f[..., :-1]) < 180. # não é o salto de +-180
+            ih, io, il = np.nonzero(troca)
+            anos_raiz.append(np.full(ih.size, ano))
+            coeffs.append(np.broadcast_to(c, (ih.size, c.size)))
+            h.append(alturas[ih]); lon.append(lons[io])
+            lat_a.append(vLat[il]); lat_b.append(vLat[il + 1])
+            f_a.append(f[ih, io, il]); f_b.append(f[ih, io, il + 1])
+        anos_raiz, coeffs, h, lon, a, b, fa, fb = (np.concatenate(v) for v in
+                                                   (anos_raiz, coeffs, h, lon, lat_a, lat_b, f_a, f_b))
+
+        # falsa posição modificada (Illinois), todas as raízes juntas
+        lado = np.zeros(a.size, dtype=int) # último extremo mantido: -1 = a, 1 = b
+        for it in range(max_iter):
+            abertas = np.abs(b - a) > tol
+            if not abertas.any():
+                break
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x = np.where(fb != fa, b - fb*(b - a)/(fb - fa), 0.5*(a + b))
+            x = np.where(abertas, np.clip(x, np.minimum(a, b), np.maximum(a, b)), x)
+            k = np.flatnonzero(abertas)
+            fx = np.zeros(a.size)
+            fx[k] = desvio(self._componente_geodetica(coeffs[k],h[k],x[k],lon[k],nmax,componente))
+
+            em_a = abertas & ((fx < 0) == (fa < 0)) # raiz entre x e b: substitui a
+            em_b = abertas & ~em_a
+            fb = np.where(em_a & (lado == 1), fb/2, fb)
+            fa = np.where(em_b & (lado == -1), fa/2, fa)
+            a = np.where(em_a, x, a); fa = np.where(em_a, fx, fa)
+            b = np.where(em_b, x, b); fb = np.where(em_b, fx, fb)
+            lado = np.where(em_a, 1, np.where(em_b, -1, lado))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lat = np.where(fb != fa, b - fb*(b - a)/(fb - fa), 0.5*(a + b))
+        lat = np.clip(lat, np.minimum(a, b), np.maximum(a, b))
+
+        self.DfIsolinha = pd.DataFrame({'Year': anos_raiz, 'Altitude': h, 'Longitude': lon, 'Latitude': lat})
+        self.DfIsolinha = self.DfIsolinha.sort_values(['Year','Altitude','Longitude','Latitude'], ignore_index=True)
+        self.DfIsolinha.insert(3, 'Ramo', self.DfIsolinha.groupby(['Year','Altitude','Longitude']).cumcount())
+
+        self._salva_dataframe(self.name_saida + "_isolinha_" + componente,self.DfIsolinha)
+        return self.DfIsolinha
+
+    def calc_gradiente(self,DfGrid):
+        """
+        CALCULA ANALITICAMENTE O GRADIENTE DE |B| E AS DERIVADAS DE B NOS PONTOS DE UM GRID.
+
+        As derivadas vêm de iut.synth_values_grad, na mesma síntese do campo
+        (sem diferenças finitas), nas coordenadas esféricas geocêntricas
+        (r, theta, phi) de cada ponto. São dadas como componentes físicas em
+        nT/km: d/dr, (1/r) d/dtheta e (1/(r sin(theta))) d/dphi. Nos polos
+        exatos a derivada em phi não é definida (NaN).
+
+        Parameters
+        ----------
+        DfGrid : DATAFRAME
+            GRID COM AS COLUNAS "Latitude", "Longitude", "Altitude" E "Year"
+            (COMO O Dfgrid DE calc_grid).
+
+        Returns
+        -------
+        self.DfGradiente : DATAFRAME
+            COORDENADAS DOS PONTOS, "Total_intensity" [nT], O GRADIENTE DE |B|
+            ("dF_dr", "dF_dtheta", "dF_dphi") E AS DERIVADAS DAS COMPONENTES
+            GEOCÊNTRICAS ("dBr_dr", "dBr_dtheta", ..., "dBphi_dphi"), EM nT/km.
+
+        """
+        lat = np.asarray(DfGrid["Latitude"], dtype=np.float64)
+        lon = np.asarray(DfGrid["Longitude"], dtype=np.float64)
+        h = np.asarray(DfGrid["Altitude"], dtype=np.float64)
+        anos = np.asarray(DfGrid["Year"], dtype=np.float64)
+        iut.check_lat_lon_arrays(lat,lon)
+
+        alt, colat, sd, cd = iut.gg_to_geo(h, 90 - lat)
+        nmax = modelos.get(self.arquivo_shc).parameters['nmax']
+
+        F = np.empty(lat.size)
+        dF = np.empty((3, lat.size))
+        dB = np.empty((3, 3, lat.size))
+        for ano in np.unique(anos):
+            k = anos == ano
+            coeffs = modelos.coeficientes(self.arquivo_shc).get(self._valida_pontos(lat[k],lon[k],ano))[0]
+            Br, Bt, Bp, dB[..., k] = iut.synth_values_grad(coeffs.T, alt[k], colat[k], lon[k], nmax)
+            F[k], dF[:, k] = iut.grad_intensity(Br, Bt, Bp, dB[..., k])
+
+        # componentes físicas: d/dr, (1/r) d/dtheta, (1/(r sin(theta))) d/dphi
+        with np.errstate(divide='ignore', invalid='ignore'):
+            escala = np.array([np.ones(lat.size), 1/alt, 1/(alt*np.sin(np.deg2rad(colat)))])
+        dF = dF * escala
+        dB = dB * escala[None]
+
+        dados = {'Altitude': h, 'Latitude': lat, 'Longitude': lon, 'Year': anos,
+                 'Total_intensity': F, 'dF_dr': dF[0], 'dF_dtheta': dF[1], 'dF_dphi': dF[2]}
+        for i, b in enumerate(('Br', 'Btheta', 'Bphi')):
+            for j, x in enumerate(('r', 'theta', 'phi')):
+                dados['d' + b + '_d' + x] = dB[i, j]
+        self.DfGradiente = pd.DataFrame(dados)
+
+        self._salva_dataframe(self.name_saida + "_gradiente",self.DfGradiente)
+        return self.DfGradiente
+
+    def calc_linhas_campo(self,lat,lon,h = None,ano = None,h_pe = 110.,tol = 1e-3):
+        """
+        SEGUE AS LINHAS DE CAMPO QUE PASSAM PELOS PONTOS DADOS ATÉ OS PÉS NOS DOIS HEMISFÉRIOS.
+
+        Todas as linhas são integradas juntas por flu.field_line_quantities
+        (Runge-Kutta adaptativo de Dormand-Prince 5(4) ao longo de B, uma
+        síntese em lote por estágio). Os pés são os pontos onde a linha
+        atinge a altura geodética h_pe; linhas que saem de 20 raios
+        terrestres ficam abertas (pés NaN).
+
+        Parameters
+        ----------
+        lat, lon : FLOAT OU ARRAY FLOAT
+            LATITUDES E LONGITUDES GEODÉTICAS [graus] DOS PONTOS DE PARTIDA.
+        h : FLOAT OU ARRAY FLOAT, optional
+            ALTURAS GEODÉTICAS [km]. The default is None (A ALTURA INICIAL DA CLASSE).
+        ano : FLOAT, optional
+            ANO DECIMAL. The default is None (O ANO DA CLASSE).
+        h_pe : FLOAT, optional
+            ALTURA GEODÉTICA DOS PÉS [km]. The default is 110.
+        tol : FLOAT, optional
+            ERRO LOCAL POR PASSO E PRECISÃO DOS PÉS [km]. The default is 1e-3.
+
+        Returns
+        -------
+        self.DfLinhas : DATAFRAME
+            UMA LINHA POR PONTO COM AS COORDENADAS DE PARTIDA, "Lat_norte",
+            "Lon_norte", "Lat_sul", "Lon_sul" (PÉS GEODÉTICOS), "Fechada",
+            "Apex_altura" (GEODÉTICA) [km], "Apex_lat", "Apex_lon" E
+            "Comprimento" [km].
+
+        """
+        if h is None:
+            h = self.entrada_usuario[2]
+        if ano is None:
+            ano = self.entrada_usuario[3]
+        lat, lon, h = np.broadcast_arrays(np.asarray(lat, dtype=np.float64).ravel(),
+                                          np.asarray(lon, dtype=np.float64).ravel(),
+                                          np.asarray(h, dtype=np.float64).ravel())
+        date = self._valida_pontos(lat,lon,ano)
+
+        coeffs = modelos.coeficientes(self.arquivo_shc).get(date)[0]
+        nmax = modelos.get(self.arquivo_shc).parameters['nmax']
+        alt, colat, _, _ = iut.gg_to_geo(h, 90 - lat)
+
+        linhas = flu.field_line_quantities(coeffs, alt, colat, lon, nmax=nmax,
+                                           h_stop=h_pe, tol=tol)
+
+        def geodeticas(pe):
+            with np.errstate(invalid='ignore'):
+                h_gg, colat_gg = iut.geo_to_gg(pe[0], pe[1])
+            return h_gg, 90 - colat_gg, pe[2]
+
+        _, lat_n, lon_n = geodeticas(linhas['foot_north'])
+        _, lat_s, lon_s = geodeticas(linhas['foot_south'])
+        h_a, lat_a, lon_a = geodeticas(linhas['apex'])
+
+        self.DfLinhas = pd.DataFrame({'Altitude': h, 'Latitude': lat, 'Longitude': lon, 'Year': date,
+                                      'Lat_norte': lat_n, 'Lon_norte': lon_n,
+                                      'Lat_sul': lat_s, 'Lon_sul': lon_s,
+                                      'Fechada': linhas['closed'],
+                                      'Apex_altura': h_a,
+                                      'Apex_lat': lat_a, 'Apex_lon': lon_a,
+                                      'Comprimento': linhas['length']})
+
+        self._salva_dataframe(self.name_saida + "_linhas_campo",self.DfLinhas)
+        return self.DfLinhas
+
+    def calc_coord_magneticas(self,DfGrid,h_ref = 110.,cache_dir = None):
+        """
+        CALCULA AS COORDENADAS MAGNÉTICAS DOS PONTOS DE UM GRID POR INTERPOLAÇÃO EM TABELAS.
+
+        Para cada ano e altura do grid é usada uma tabela de
+        modelos.tabelas_magneticas (calculada uma vez, com as linhas de campo
+        dos seus nós, e guardada em cache_dir se dado); os pontos são só
+        interpolados, sem síntese do campo ponto a ponto.
+
+        Parameters
+        ----------
+        DfGrid : DATAFRAME
+            GRID COM AS COLUNAS "Latitude", "Longitude", "Altitude" E "Year"
+            (COMO O Dfgrid DE calc_grid).
+        h_ref : FLOAT, optional
+            ALTURA DE REFERÊNCIA DA LATITUDE APEX MODIFICADA [km]. The default is 110.
+        cache_dir : STRING, optional
+            PASTA PARA GUARDAR AS TABELAS EM DISCO E REUSÁ-LAS EM OUTRAS
+            EXECUÇÕES. The default is None (SÓ EM MEMÓRIA).
+
+        Returns
+        -------
+        self.DfMagneticas : DATAFRAME
+            COORDENADAS DOS PONTOS E "QD_lat" (QUASE-DIPOLO), "Apex_lat",
+            "Apex_lon", "Apex_altura" [km], "Dip_lat", "Modip", "Dipolo_lat"
+            E "Dipolo_lon" [graus].
+
+        """
+        lat = np.asarray(DfGrid["Latitude"], dtype=np.float64)
+        lon = np.asarray(DfGrid["Longitude"], dtype=np.float64)
+        h = np.asarray(DfGrid["Altitude"], dtype=np.float64)
+        anos = np.asarray(DfGrid["Year"], dtype=np.float64)
+        tabelas = modelos.tabelas_magneticas(self.arquivo_shc,cache_dir)
+        print("pyigrf_clara - calc_coord_magneticas: Calculando Coordenadas Magnéticas")
+
+        nomes = {'qd_lat': 'QD_lat', 'apex_lat': 'Apex_lat', 'apex_lon': 'Apex_lon',
+                 'apex_height': 'Apex_altura', 'dip_lat': 'Dip_lat', 'modip': 'Modip',
+                 'dipole_lat': 'Dipolo_lat', 'dipole_lon': 'Dipolo_lon'}
+        dados = {'Altitude': h, 'Latitude': lat, 'Longitude': lon, 'Year': anos}
+        dados.update({n: np.empty(lat.size) for n in nomes.values()})
+        for ano in np.unique(anos):
+            k = anos == ano
+            # cada altura nova monta uma tabela (alguns segundos)
+            print("pyigrf_clara - calc_coord_magneticas : ano", ano, ",",
+                  np.unique(h[k]).size, "alturas")
+            coords = tabelas.convert(self._valida_pontos(lat[k],lon[k],ano),lat[k],lon[k],h[k],h_ref)
+            for c, n in nomes.items():
+                dados[n][k] = coords[c]
+        self.DfMagneticas = pd.DataFrame(dados)
+
+        self._salva_dataframe(self.name_saida + "_coord_magneticas",self.DfMagneticas)
+        print("Done")
+        return self.DfMagneticas
+
     def plot_grid(self,Dfgrid,h = 400):
         """
         PLOTA A INTENSIDADE DO CAMPO MAGNÉTICO NUMA DADA ALTURA SOBRE O MAPA DA TERRA.
@@ -623,6 +2197,31 @@ class IGRF():
     def _nT_to_T_perfil(self):
         self.DfPerfilh["B(T)"] = self.DfPerfilh["Total_intensity"] * 10**-9
         
+# ==== Processos de IGRF._calc_igrf_grid_paralelo
+
+_igrf_processo = None
+
+def _inicia_processo(arquivo_shc,tolerancia = None):
+    """Inicializador de cada processo: lê o modelo uma única vez."""
+    global _igrf_processo
+    modelos.get(arquivo_shc)
+    _igrf_processo = IGRF(0,0,0,2000,"",arquivo_shc,tolerancia)
+
+def _calc_faixa(nome_shm,npts,inicio,vLat,vLon,vH,parAno):
+    """Calcula uma faixa de latitudes, escreve no bloco compartilhado e retorna o truncamento usado."""
+    # o bloco é do processo principal, que o remove no final
+    shm = shared_memory.SharedMemory(name=nome_shm)
+    try:
+        saida = np.ndarray((len(IGRF._colunas_grid), npts), dtype=np.float64, buffer=shm.buf)
+        resultado = _igrf_processo._calc_igrf_grid(vLat,vLon,vH,parAno)
+        n = len(resultado_campo.COORDENADAS)
+        saida[:n, inicio:inicio+len(resultado)] = resultado.coordenadas
+        saida[n:, inicio:inicio+len(resultado)] = resultado.componentes
+        del saida
+    finally:
+        shm.close()
+    return _igrf_processo.truncamento
+
 ##======================================================
 #
 #PROGRAMA PRINCIPAL
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import conductivity0_9_5 as cond
+import fieldline_utils as flu
+import igrf_utils as iut
+import pyigrf_clara_0_6 as pc
+
+HT = np.arange(100., 401., 50.)
+LAT = np.arange(-30., 31., 15.)
+LON = np.arange(0., 360., 60.)
+
+
+@pytest.fixture(scope='module')
+def linhas():
+    return cond.condutancia_linhas(HT, LAT, LON, 2020.)
+
+
+def cubo(f):
+    indice = pd.MultiIndex.from_product([HT, LAT, LON], names=['ht', 'lat', 'lon'])
+    h = indice.get_level_values('ht').to_numpy()
+    return pd.Series(f(h), index=indice)
+
+
+def test_integra_contra_amostras(linhas):
+    # condutividade linear na altura: a interpolação trilinear é exata
+    sigma = lambda h: 1e-4*(1 + h/100.)
+    resultado = linhas.integra(cubo(sigma))
+
+    # a mesma integral direto das amostras de sample_field_lines
+    coeffs = pc.modelos.coeficientes().get(2020.)[0]
+    lat0, lon0 = np.meshgrid(LAT, LON, indexing='ij')
+    alt, colat, _, _ = iut.gg_to_geo(np.full(lat0.shape, HT[0]), 90 - lat0)
+    amostras = flu.sample_field_lines(coeffs, alt, colat, lon0 - 180., HT[0], HT[-1])
+    h, _, _ = linhas._geodeticas(amostras['points'])
+    termos = 1e3*amostras['weights']*sigma(np.clip(h, HT[0], HT[-1]))
+    local = np.bincount(amostras['line'][amostras['ascending']],
+                        termos[amostras['ascending']], minlength=lat0.size)
+    conjugada = np.bincount(amostras['line'][~amostras['ascending']],
+                            termos[~amostras['ascending']], minlength=lat0.size)
+
+    np.testing.assert_allclose(resultado['local'], local, rtol=1e-10)
+    np.testing.assert_allclose(resultado['conjugada'], conjugada, rtol=1e-10)
+    np.testing.assert_allclose(resultado['total'], local + conjugada, rtol=1e-10)
+
+
+def test_ponto_faltando(linhas):
+    completo = linhas.integra(cubo(lambda h: np.full(h.shape, 1e-4)))
+    falta = cubo(lambda h: np.full(h.shape, 1e-4))
+    # um nó da base: as linhas que partem dos nós vizinhos têm peso
+    # trilinear exatamente 0 nele
+    k = falta.index.get_loc((100., 15., 60.))
+    falta.iloc[k] = np.nan
+    parcial = linhas.integra(falta)
+
+    # só as linhas com peso não nulo no ponto que falta viram NaN
+    usa = np.asarray(linhas.W[:, k].todense()).ravel() != 0
+    valores = np.stack([parcial['local'], parcial['conjugada']], axis=1).ravel()
+    assert np.isnan(valores[usa]).all()
+    esperado = np.stack([completo['local'], completo['conjugada']], axis=1).ravel()
+    np.testing.assert_array_equal(valores[~usa], esperado[~usa])
+    assert usa.sum() < usa.size // 4
@@ -0,0 +1,19 @@
+import numpy as np
+
+import fieldline_utils as flu
+
+
+def test_linhas_dipolo():
+    # dipolo axial puro: r = r0 sin^2(theta)/sin^2(theta0), apex no equador
+    coeffs = np.array([-30000., 0., 0.])
+    r0 = flu.RE + 300.
+    theta = np.array([30., 45., 60., 75.])
+    linhas = flu.field_line_quantities(coeffs, r0, theta, 20.)
+
+    assert linhas['closed'].all()
+    np.testing.assert_allclose(linhas['apex'][0], r0/np.sin(np.deg2rad(theta))**2, rtol=1e-5)
+    np.testing.assert_allclose(linhas['apex'][1], 90., atol=1e-2)
+    # pés conjugados simétricos em relação ao equador, no mesmo meridiano
+    np.testing.assert_allclose(linhas['foot_north'][1] + linhas['foot_south'][1], 180., atol=1e-4)
+    np.testing.assert_allclose(linhas['foot_north'][2], 20., atol=1e-6)
+    np.testing.assert_allclose(linhas['foot_south'][2], 20., atol=1e-6)
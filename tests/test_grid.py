@@ -0,0 +1,317 @@
+import numpy as np
+import pytest
+
+import igrf_utils as iut
+import pyigrf_clara_0_6 as pc
+
+# grid pequeno: 3 latitudes, 3 longitudes e 2 altitudes
+GRID = dict(intervalo_h=50, lim_h=250, intervalo_lat=-10, lim_lat=-40,
+            intervalo_lon=-10, lim_lon=-80)
+
+
+@pytest.fixture
+def igrf(tmp_path, monkeypatch):
+    # calc_grid grava os CSVs (e as fatias) na pasta atual
+    monkeypatch.chdir(tmp_path)
+    return pc.IGRF(-10, -50, 150, 2020.5, 'teste')
+
+
+@pytest.fixture
+def grid_vetorizado(igrf):
+    return igrf.calc_grid(vetorizado=True, **GRID).copy()
+
+
+def test_vetorizado_igual_ao_serial(igrf, grid_vetorizado):
+    serial = igrf.calc_grid(**GRID)
+    assert list(serial.columns) == list(grid_vetorizado.columns)
+    assert len(serial) == 18
+    # a lista de tuplas do caminho ponto a ponto continua disponível
+    assert len(igrf.lgrid) == 18
+    for coluna in serial.columns:
+        a = serial[coluna].to_numpy()
+        b = grid_vetorizado[coluna].to_numpy()
+        escala = max(np.abs(a).max(), 1e-300)
+        assert np.abs(a - b).max() <= 1e-10*escala, coluna
+
+
+def test_paralelo_identico(igrf, grid_vetorizado):
+    paralelo = igrf.calc_grid(processos=2, **GRID)
+    for coluna in grid_vetorizado.columns:
+        assert np.array_equal(paralelo[coluna].to_numpy(),
+                              grid_vetorizado[coluna].to_numpy()), coluna
+
+
+@pytest.mark.parametrize('processos', [1, 2])
+def test_fatias_identico(igrf, grid_vetorizado, processos):
+    fatias = igrf.calc_grid(fatias_lat=2, processos=processos, retomar=False, **GRID)
+    assert list(fatias.columns) == list(grid_vetorizado.columns)
+    for coluna in grid_vetorizado.columns:
+        assert np.array_equal(fatias[coluna].to_numpy(),
+                              grid_vetorizado[coluna].to_numpy()), coluna
+
+    # memory map copy-on-write: alterar o DataFrame não muda os arquivos
+    fatias.loc[0, 'Total_intensity'] = 0.
+    relido = pc.grid_colunar('teste_grid').ler()
+    assert relido['Total_intensity'][0] == grid_vetorizado['Total_intensity'][0]
+
+
+def test_fatias_retomada(igrf, grid_vetorizado, monkeypatch):
+    igrf.calc_grid(fatias_lat=2, retomar=False, **GRID)
+
+    # simula uma interrupção depois da primeira fatia (2 latitudes)
+    store = pc.grid_colunar('teste_grid')
+    store.linhas = 2*3*2
+    store.extra['fatias_completas'] = 1
+    store._salva_manifesto()
+
+    chamadas = []
+    calc = igrf._calc_igrf_grid
+    monkeypatch.setattr(igrf, '_calc_igrf_grid',
+                        lambda vLat, *args: chamadas.append(vLat) or calc(vLat, *args))
+    retomado = igrf.calc_grid(fatias_lat=2, **GRID)
+
+    assert [list(v) for v in chamadas] == [[-30.]]
+    for coluna in grid_vetorizado.columns:
+        assert np.array_equal(retomado[coluna].to_numpy(),
+                              grid_vetorizado[coluna].to_numpy()), coluna
+
+
+def test_fatias_outra_especificacao(igrf):
+    igrf.calc_grid(fatias_lat=2, retomar=False, **GRID)
+    # outro ano: as fatias da pasta não servem e o grid é recalculado
+    igrf.entrada_usuario = igrf.entrada_usuario[:3] + (2010.,)
+    outro = igrf.calc_grid(fatias_lat=2, **GRID)
+    assert (outro['Year'] == 2010.).all()
+
+
+def _xyz_geodetico(coeffs, h, lat, lon):
+    r, th, sd, cd = iut.gg_to_geo(h, 90. - lat)
+    Br, Bt, Bp = iut.synth_values(coeffs, r, th, lon)
+    X, Z = -Bt, -Br
+    return X*cd + Z*sd, Bp, Z*cd - X*sd
+
+
+def test_colunas_sv(igrf):
+    # InclinationSV e HorizontalSV contra xyz2dhif_sv num ponto do grid
+    valores = igrf._calc_igrf_grid(np.array([-20.]), np.array([-60.]), np.array([200.]), 2020.5)
+    coeffs, coeffs_sv, coeffsm = pc.modelos.coeficientes().get(2020.5)
+    dX, dY, dZ = _xyz_geodetico(coeffs_sv, 200., -20., -60.)
+    ddot, hdot, idot, fdot = iut.xyz2dhif_sv(*_xyz_geodetico(coeffsm, 200., -20., -60.), dX, dY, dZ)
+
+    for coluna, esperado in [('DeclinationSV', ddot), ('InclinationSV', idot),
+                             ('HorizontalSV', hdot), ('TotalSV', fdot)]:
+        np.testing.assert_allclose(valores[coluna].ravel(), esperado, rtol=1e-9, err_msg=coluna)
+    assert list(pc.resultado_campo.COMPONENTES[7:11]) == ['DeclinationSV', 'InclinationSV', 'HorizontalSV', 'TotalSV']
+
+
+@pytest.mark.parametrize('tolerancia', [None, 100.])
+def test_grid_vazio(igrf, tolerancia):
+    # lim_lat igual à latitude inicial: nenhum ponto, como no caminho serial
+    igrf.tolerancia = tolerancia
+    vazio = dict(GRID, lim_lat=-10)
+    vetorizado = igrf.calc_grid(vetorizado=True, **vazio)
+    serial = igrf.calc_grid(**vazio)
+    assert len(vetorizado) == 0
+    assert list(vetorizado.columns) == list(serial.columns)
+
+
+def test_paralelo_vazio(igrf):
+    vazio = igrf.calc_grid(processos=2, **dict(GRID, lim_lat=-10))
+    assert len(vazio) == 0
+    assert list(vazio.columns) == list(igrf.calc_grid(**dict(GRID, lim_lat=-10)).columns)
+
+
+def test_get_grid_sem_cache(igrf, grid_vetorizado, tmp_path):
+    antes = sorted(p.name for p in tmp_path.iterdir())
+    grid = igrf.get_grid(**GRID)
+    # sem cache nada é gravado
+    assert sorted(p.name for p in tmp_path.iterdir()) == antes
+    for coluna in grid_vetorizado.columns:
+        assert np.array_equal(grid[coluna].to_numpy(), grid_vetorizado[coluna].to_numpy()), coluna
+
+
+def test_get_grid_cache(igrf, grid_vetorizado, tmp_path):
+    cache = pc.cache_grids(str(tmp_path / 'cache'))
+    primeiro = igrf.get_grid(cache=cache, **GRID)
+    segundo = igrf.get_grid(cache=cache, **GRID)
+    assert (cache.misses, cache.hits) == (1, 1)
+    for coluna in grid_vetorizado.columns:
+        assert np.array_equal(segundo[coluna].to_numpy(), grid_vetorizado[coluna].to_numpy()), coluna
+        assert np.array_equal(primeiro[coluna].to_numpy(), segundo[coluna].to_numpy()), coluna
+
+    # outro ano é outra especificação
+    igrf.entrada_usuario = igrf.entrada_usuario[:3] + (2010.,)
+    assert (igrf.get_grid(cache=cache, **GRID)['Year'] == 2010.).all()
+    assert cache.misses == 2
+
+
+def test_get_grid_csv(igrf, grid_vetorizado, tmp_path):
+    # calc_grid gravou teste_grid.csv; o índice inteiro do CSV é mantido
+    csv = igrf.get_grid('teste_grid.csv')
+    assert csv['Unnamed: 0'].dtype == np.int64
+    cache = pc.cache_grids(str(tmp_path / 'cache'))
+    igrf.get_grid('teste_grid.csv', cache=cache)
+    relido = igrf.get_grid('teste_grid.csv', cache=cache)
+    assert cache.hits == 1
+    assert (relido.dtypes == csv.dtypes).all()
+    np.testing.assert_array_equal(relido.to_numpy(), csv.to_numpy())
+
+
+def test_campos_epocas_interpolacao(igrf):
+    # campo entre épocas: combinação das épocas = síntese dos coeficientes interpolados
+    pc.limpa_campos_grid()
+    vLat, vLon, vH = np.array([-20., 10.]), np.array([-60., 30.]), np.array([0., 300.])
+    for ano in (1903.7, 2003.2, 2022.9):
+        valores = igrf._calc_igrf_grid(vLat, vLon, vH, ano)
+        coeffs = pc.modelos.coeficientes().get(ano)[0]
+        lat, lon, h = np.meshgrid(vLat, vLon, vH, indexing='ij')
+        X, Y, Z = _xyz_geodetico(coeffs, h, lat, lon)
+        for coluna, esperado in [('North_component', X), ('East_component', Y), ('Vertical_component', Z)]:
+            np.testing.assert_allclose(valores[coluna], esperado.ravel(), rtol=1e-9, atol=1e-7, err_msg=coluna)
+    # os três anos usaram os mesmos campos por época
+    assert len(pc._campos_grid) == 1
+
+
+def test_campos_grid_limites(igrf, monkeypatch):
+    pc.limpa_campos_grid()
+    vLat, vLon, vH = np.array([-20., -10.]), np.array([-60.]), np.array([100.])
+    antes = igrf._calc_igrf_grid(vLat, vLon, vH, 2003.2)
+    assert len(pc._campos_grid) == 1
+    assert next(iter(pc._campos_grid.values()))[0].nbytes > 0
+
+    # passando do limite de bytes só o grid mais recente fica
+    monkeypatch.setattr(pc, '_CAMPOS_GRID_MAX_BYTES', 1)
+    igrf._calc_igrf_grid(vLat, vLon, vH + 50., 2003.2)
+    assert len(pc._campos_grid) == 1
+
+    pc.limpa_campos_grid()
+    assert len(pc._campos_grid) == 0
+    depois = igrf._calc_igrf_grid(vLat, vLon, vH, 2003.2)
+    np.testing.assert_array_equal(depois.componentes, antes.componentes)
+
+
+def test_geometria():
+    vLat = np.array([-60., -12.5, 0., 33.3, 89.])
+    vH = np.array([0., 150., 400.])
+    alt, colat, sd, cd, alt_gg, lat_gg = pc.geometria(vLat, vH)
+    assert alt.shape == (5, 3)
+    assert pc.geometria(vLat, vH)[0] is alt
+    for i, lat in enumerate(vLat):
+        for j, h in enumerate(vH):
+            esperado = iut.gg_to_geo(h, 90 - lat)
+            np.testing.assert_allclose([alt[i, j], colat[i, j], sd[i, j], cd[i, j]],
+                                       esperado, rtol=1e-13, atol=1e-13)
+            h_gg, colat_gg = iut.geo_to_gg(*esperado[:2])
+            assert alt_gg[i, j] == np.round(h_gg, decimals=3)
+            assert lat_gg[i, j] == 90 - colat_gg
+
+
+@pytest.mark.filterwarnings('ignore:invalid value encountered in sqrt')
+def test_polos(igrf):
+    vLat = np.array([90., -90.])
+    with pytest.warns(UserWarning, match='poles'):
+        grid = igrf._calc_igrf_grid(vLat, np.array([30.]), np.array([100.]), 2020.5)
+    # coordenadas de entrada nos dois polos, sem NaN
+    np.testing.assert_array_equal(grid['Latitude'], vLat)
+    np.testing.assert_array_equal(grid['Altitude'], [100., 100.])
+
+    for k, lat in enumerate(vLat):
+        with pytest.warns(UserWarning, match='poles'):
+            serial = igrf._calc_igrf(lat, 30., 100., 2020.5)
+        for nome, calculado, valor in zip(iut.DHIF_ROWS, grid.componentes[:, k], serial[4:]):
+            assert np.isfinite(calculado), nome
+            np.testing.assert_allclose(calculado, valor, rtol=1e-12, atol=1e-9,
+                                       err_msg=nome)
+    # o caminho ponto a ponto perde as coordenadas no polo sul
+    assert np.isnan(serial[0]) and np.isnan(serial[1])
+
+
+def _iguais(a, b, rtol=1e-10):
+    assert list(a.columns) == list(b.columns)
+    for coluna in a.columns:
+        x = a[coluna].to_numpy()
+        y = b[coluna].to_numpy()
+        assert np.abs(x - y).max() <= rtol*max(np.abs(y).max(), 1e-300), coluna
+
+
+def test_perfilh_vetorizado(igrf):
+    serial = igrf.calc_perfilh(-12., -45., lim_h=300, intervalo_h=25).copy()
+    vetorizado = igrf.calc_perfilh(-12., -45., lim_h=300, intervalo_h=25, vetorizado=True)
+    assert len(serial) == 6
+    _iguais(vetorizado, serial)
+
+
+def test_perfilh_varios(igrf):
+    lat = np.array([-12., 20.])
+    lon = np.array([-45., 100.])
+    vetorizado = igrf.calc_perfilh(lat, lon, lim_h=300, intervalo_h=25, vetorizado=True).copy()
+    # um perfil depois do outro
+    for i in range(2):
+        serial = igrf.calc_perfilh(lat[i], lon[i], lim_h=300, intervalo_h=25)
+        _iguais(vetorizado.iloc[6*i:6*(i+1)].reset_index(drop=True), serial)
+
+
+def test_trajetoria_centro(igrf):
+    traj = igrf.calc_trajetoria_centro(anos=[1980., 2020.], alturas=[0., 400.])
+    assert len(traj) == 4
+    for linha in traj.itertuples():
+        # |B| do centro igual ao do caminho ponto a ponto
+        serial = igrf._calc_igrf(linha.Latitude, linha.Longitude, linha.Altitude, linha.Year)
+        np.testing.assert_allclose(linha.Total_intensity, serial[7], rtol=1e-10)
+
+        # nenhum ponto de um grid fino em volta tem |B| menor
+        vLat = linha.Latitude + np.arange(-1., 1.001, 0.05)
+        vLon = linha.Longitude + np.arange(-1., 1.001, 0.05)
+        F = igrf._calc_igrf_grid(vLat, vLon, np.array([linha.Altitude]), linha.Year)['Total_intensity']
+        assert F.min() >= linha.Total_intensity - 1e-6
+
+
+def test_isolinhas_equador(igrf):
+    lons = np.array([-60., 0., 100.])
+    iso = igrf.calc_isolinhas(anos=[2000., 2020.], alturas=[0., 300.], lons=lons)
+    # uma raiz por meridiano, ano e altura
+    assert len(iso) == 12
+    assert (iso['Ramo'] == 0).all()
+    for linha in iso.itertuples():
+        serial = igrf._calc_igrf(linha.Latitude, linha.Longitude, linha.Altitude, linha.Year)
+        # I muda uns 2 graus por grau de latitude perto do equador
+        assert abs(serial[5]) < 1e-3
+
+
+def test_isolinhas_declinacao(igrf):
+    iso = igrf.calc_isolinhas(componente='D', valor=-20., lons=[-40.], faixa_lat=(-40, 10))
+    assert len(iso) >= 1
+    for linha in iso.itertuples():
+        serial = igrf._calc_igrf(linha.Latitude, linha.Longitude, linha.Altitude, linha.Year)
+        assert abs(serial[4] + 20.) < 1e-3
+
+
+def test_grid_tolerancia(igrf, grid_vetorizado):
+    cortado = pc.IGRF(-10, -50, 150, 2020.5, 'cortado', tolerancia=50.)
+    grid = cortado.calc_grid(vetorizado=True, **GRID)
+    assert cortado.truncamento['nmax'] < 13
+    assert cortado.truncamento['erro'] <= 50.
+    # erro do vetor (X, Y, Z) em nT abaixo do limite informado
+    xyz = ['North_component', 'East_component', 'Vertical_component']
+    erro = np.linalg.norm((grid[xyz] - grid_vetorizado[xyz]).to_numpy(), axis=1)
+    assert 0. < erro.max() <= cortado.truncamento['erro']
+
+
+def test_cache_grids_evicta(tmp_path):
+    cache = pc.cache_grids(str(tmp_path / 'cache'), max_grids=2)
+    especificacoes = [{'ano': ano, 'colunas': ['a', 'b']} for ano in (2000., 2001., 2002.)]
+    for k, especificacao in enumerate(especificacoes):
+        guardado = cache.guarda(especificacao, (np.arange(5.) + k, np.ones(5)))
+        np.testing.assert_array_equal(guardado['a'], np.arange(5.) + k)
+        if k == 1:
+            # o acesso renova o primeiro; o segundo vira o mais antigo
+            assert cache.get(especificacoes[0]) is not None
+
+    assert cache.get(especificacoes[1]) is None
+    np.testing.assert_array_equal(cache.get(especificacoes[0])['a'], np.arange(5.))
+    np.testing.assert_array_equal(cache.get(especificacoes[2])['a'], np.arange(5.) + 2)
+    assert len([p for p in (tmp_path / 'cache').iterdir() if p.is_dir()]) == 2
+
+    cache.limpa()
+    assert all(cache.get(e) is None for e in especificacoes)
+    assert [p.name for p in (tmp_path / 'cache').iterdir()] == [pc.cache_grids.INDICE]
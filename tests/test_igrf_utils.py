@@ -0,0 +1,290 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import igrf_utils as iut
+
+
+@pytest.fixture
+def campo():
+    rng = np.random.default_rng(0)
+    xyz = rng.normal(0., 30000., (3, 50))
+    sv = rng.normal(0., 100., (3, 50))
+    xyzm = xyz - 5*sv
+    return xyz, sv, xyzm
+
+
+def test_xyz2dhif_fused(campo):
+    xyz, sv, xyzm = campo
+    out = np.empty((14, 50))
+    out[4:7] = xyz
+    out[11:14] = sv
+    iut.xyz2dhif_fused(out, *xyzm)
+    linhas = dict(zip(iut.DHIF_ROWS, out))
+
+    dec, hoz, inc, eff = iut.xyz2dhif(*xyz)
+    ddot, hdot, idot, fdot = iut.xyz2dhif_sv(*xyzm, *sv)
+    esperado = {'D': dec, 'I': inc, 'H': hoz, 'F': eff,
+                'Ddot': ddot, 'Idot': idot, 'Hdot': hdot, 'Fdot': fdot,
+                'X': xyz[0], 'Y': xyz[1], 'Z': xyz[2],
+                'Xdot': sv[0], 'Ydot': sv[1], 'Zdot': sv[2]}
+    for nome, valor in esperado.items():
+        np.testing.assert_allclose(linhas[nome], valor, rtol=1e-12, atol=1e-9, err_msg=nome)
+
+
+def test_xyz2dhif_fused_um_ponto(campo):
+    xyz, sv, _ = campo
+    out = np.empty(14)
+    out[4:7] = xyz[:, 0]
+    out[11:14] = sv[:, 0]
+    iut.xyz2dhif_fused(out)
+    ddot, hdot, idot, fdot = iut.xyz2dhif_sv(*xyz[:, 0], *sv[:, 0])
+    np.testing.assert_allclose(out[7:11], [ddot, idot, hdot, fdot], rtol=1e-12)
+
+
+IGRF_FILE = os.path.join(os.path.dirname(__file__), '..', 'IGRF13.shc')
+
+
+@pytest.fixture
+def shc(tmp_path):
+    caminho = str(tmp_path / 'IGRF13.shc')
+    shutil.copy(IGRF_FILE, caminho)
+    return caminho
+
+
+def _conta_sha1(monkeypatch):
+    chamadas = []
+    sha1 = iut._file_sha1
+
+    def conta(caminho):
+        chamadas.append(caminho)
+        return sha1(caminho)
+    monkeypatch.setattr(iut, '_file_sha1', conta)
+    return chamadas
+
+
+def _mapeado(modelo):
+    return isinstance(modelo.time, np.memmap)
+
+
+def _iguais(modelo, outro):
+    np.testing.assert_array_equal(modelo.time, outro.time)
+    np.testing.assert_array_equal(modelo.coeffs, outro.coeffs)
+
+
+def test_shc_cache_igual(shc):
+    texto = iut.load_shcfile(shc, cache=False)
+    assert not os.path.exists(shc + '.json')
+    iut.load_shcfile(shc)
+    assert os.path.exists(shc + '.json')
+    copia = iut.load_shcfile(shc)
+    assert _mapeado(copia)
+    _iguais(copia, texto)
+    assert copia.parameters == texto.parameters
+
+
+def test_shc_cache_tocado(shc, monkeypatch):
+    iut.load_shcfile(shc)
+    st = os.stat(shc)
+    os.utime(shc, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    chamadas = _conta_sha1(monkeypatch)
+    assert _mapeado(iut.load_shcfile(shc))
+    assert len(chamadas) == 1
+    # the refreshed meta makes the next load skip the hash
+    assert _mapeado(iut.load_shcfile(shc))
+    assert len(chamadas) == 1
+
+
+def test_shc_cache_alterado(shc):
+    original = iut.load_shcfile(shc)
+    st = os.stat(shc)
+    with open(shc) as f:
+        texto = f.read()
+    # same size, different content
+    with open(shc, 'w') as f:
+        f.write(texto.replace('-29404.8', '-29404.9', 1))
+    os.utime(shc, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    alterado = iut.load_shcfile(shc)
+    assert not _mapeado(alterado)
+    assert np.count_nonzero(alterado.coeffs != original.coeffs) == 1
+
+
+def test_shc_cache_pasta(shc, tmp_path, monkeypatch):
+    pasta = str(tmp_path / 'copias')
+    texto = iut.load_shcfile(shc, cache=False)
+    iut.load_shcfile(shc, cache=pasta)
+    assert not os.path.exists(shc + '.json')
+    assert len(os.listdir(pasta)) == 2
+
+    chamadas = _conta_sha1(monkeypatch)
+    copia = iut.load_shcfile(shc, cache=pasta)
+    assert _mapeado(copia)
+    assert not chamadas
+    _iguais(copia, texto)
+
+
+def test_shc_cache_somente_leitura(shc, tmp_path, monkeypatch):
+    # a folder that cannot be created stands for a read-only directory
+    bloqueio = tmp_path / 'arquivo'
+    bloqueio.write_text('')
+    pasta = str(bloqueio / 'copias')
+    texto = iut.load_shcfile(shc, cache=False)
+    _iguais(iut.load_shcfile(shc, cache=pasta), texto)
+    assert not _mapeado(iut.load_shcfile(shc, cache=pasta))
+
+
+@pytest.fixture(scope='module')
+def coeffs():
+    modelo = iut.load_shcfile(IGRF_FILE, cache=False)
+    return modelo.coeffs[:, -2]
+
+
+@pytest.fixture(scope='module')
+def pontos():
+    rng = np.random.default_rng(1)
+    radius = 6371.2 + rng.uniform(0., 1000., 40)
+    theta = np.concatenate([[0., 180.], rng.uniform(0., 180., 38)])
+    phi = rng.uniform(-180., 360., 40)
+    return radius, theta, phi
+
+
+def _compara(obtido, esperado, rtol=1e-12):
+    for a, b in zip(obtido, esperado):
+        escala = np.abs(b).max()
+        np.testing.assert_allclose(a, b, rtol=0, atol=rtol*escala)
+
+
+@pytest.mark.filterwarnings('ignore:The geographic poles')
+@pytest.mark.parametrize('nmin', [None, 3])
+def test_synth_plan_values(coeffs, pontos, nmin):
+    plano = iut.synth_plan(*pontos, 13, nmin=nmin)
+    _compara(plano.values(coeffs), iut.synth_values(coeffs, *pontos, nmin=nmin))
+    # o mesmo plano serve para outros coeficientes
+    _compara(plano.values(2*coeffs), iut.synth_values(2*coeffs, *pontos, nmin=nmin))
+
+
+def test_synth_plan_grid(coeffs):
+    radius = 6671.2
+    theta = np.array([10., 75., 120.])
+    phi = np.array([0., 45., 190., 300.])
+    plano = iut.synth_plan(radius, theta, phi, 13, grid=True)
+    esperado = iut.synth_values(coeffs, radius, theta, phi, grid=True)
+    obtido = plano.values(coeffs)
+    assert obtido[0].shape == esperado[0].shape == (3, 4)
+    _compara(obtido, esperado)
+
+
+@pytest.mark.filterwarnings('ignore:The geographic poles')
+def test_synth_plan_poucos_coeficientes(coeffs, pontos):
+    plano = iut.synth_plan(*pontos, 13)
+    with pytest.raises(ValueError):
+        plano.values(coeffs[:100])
+
+
+@pytest.mark.filterwarnings('ignore:The geographic poles')
+def test_design_matrix(pontos):
+    modelo = iut.load_shcfile(IGRF_FILE, cache=False)
+    snapshots = modelo.coeffs[:, -4:]
+    A = iut.design_matrix(*pontos, 13)
+    assert A.shape == (3, 40, 195)
+
+    plano = iut.synth_plan(*pontos, 13)
+    Br, Bt, Bp = plano.values_many(snapshots)
+    assert Br.shape == (40, 4)
+    for k in range(snapshots.shape[1]):
+        esperado = iut.synth_values(snapshots[:, k], *pontos)
+        _compara((Br[:, k], Bt[:, k], Bp[:, k]), esperado)
+        _compara(A @ snapshots[:, k], esperado)
+
+
+@pytest.mark.filterwarnings('ignore:The geographic poles')
+@pytest.mark.parametrize('nmin', [None, 2])
+def test_synth_values_stream(coeffs, pontos, nmin):
+    _compara(iut.synth_values_stream(coeffs, *pontos, nmin=nmin),
+             iut.synth_values(coeffs, *pontos, nmin=nmin))
+
+
+def test_synth_values_stream_grade(coeffs):
+    # grade montada por broadcast, como em _calc_igrf_grid
+    theta = np.array([5., 60., 95., 170.])[:, None, None]
+    phi = np.array([0., 90., 200.])[None, :, None]
+    radius = 6371.2 + np.array([0., 250., 800.])[None, None, :]
+    obtido = iut.synth_values_stream(coeffs, radius, theta, phi)
+    assert obtido[0].shape == (4, 3, 3)
+    _compara(obtido, iut.synth_values(coeffs, radius, theta, phi))
+
+
+def test_synth_values_radial(coeffs):
+    lat = np.array([-75., -30., 0., 12.5, 60.])[:, None]
+    h = np.arange(0., 1001., 50.)[None, :]
+    radius, theta, _, _ = iut.gg_to_geo(h, 90 - lat)
+    phi = np.array([0., 45., 130., 250., 330.])[:, None]
+    obtido = iut.synth_values_radial(coeffs, radius, theta, phi)
+    esperado = iut.synth_values(coeffs, radius, theta, phi)
+    assert obtido[0].shape == (5, 21)
+    # interpolação de Chebyshev na colatitude: erro muito abaixo de 1e-4 nT
+    for a, b in zip(obtido, esperado):
+        np.testing.assert_allclose(a, b, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize('phi0', [0., -72.5])
+def test_synth_values_fft(coeffs, phi0):
+    radius = 6371.2 + np.array([0., 400.])[None, :]
+    theta = np.array([0.5, 33., 90., 147.])[:, None]
+    nlon = 72
+    obtido = iut.synth_values_fft(coeffs, radius, theta, nlon, phi0=phi0)
+    phi = phi0 + 360.*np.arange(nlon)/nlon
+    esperado = iut.synth_values(coeffs, radius[..., None], theta[..., None], phi)
+    assert obtido[0].shape == (4, 2, nlon)
+    _compara(obtido, esperado)
+
+
+def test_synth_values_fft_poucas_longitudes(coeffs):
+    with pytest.raises(ValueError):
+        iut.synth_values_fft(coeffs, 6371.2, 45., 26)
+
+
+def test_synth_values_grad(coeffs):
+    rng = np.random.default_rng(2)
+    pos = np.array([6371.2 + rng.uniform(0., 1000., 20),
+                    rng.uniform(5., 175., 20), rng.uniform(0., 360., 20)])
+    *B, dB = iut.synth_values_grad(coeffs, *pos)
+    _compara(B, iut.synth_values(coeffs, *pos))
+    F, dF = iut.grad_intensity(*B, dB)
+    np.testing.assert_allclose(F, np.sqrt(sum(b**2 for b in B)))
+
+    # diferenças centradas: radius em km, theta e phi em graus (-> rad)
+    for j, h in enumerate((1e-2, 1e-4, 1e-4)):
+        d = np.zeros((3, 1))
+        d[j] = h
+        mais = np.array(iut.synth_values(coeffs, *(pos + d)))
+        menos = np.array(iut.synth_values(coeffs, *(pos - d)))
+        passo = 2*(h if j == 0 else np.radians(h))
+        for i in range(3):
+            numerico = (mais[i] - menos[i]) / passo
+            np.testing.assert_allclose(dB[i, j], numerico, rtol=0,
+                                       atol=1e-5*np.abs(numerico).max())
+        numerico = (np.linalg.norm(mais, axis=0) - np.linalg.norm(menos, axis=0)) / passo
+        np.testing.assert_allclose(dF[j], numerico, rtol=0,
+                                   atol=1e-5*np.abs(numerico).max())
+
+
+@pytest.mark.filterwarnings('ignore:The geographic poles')
+@pytest.mark.parametrize('norm', ['max', 'rms'])
+def test_truncation_degree(coeffs, pontos, norm):
+    radius = pontos[0].min()
+    completo = np.array(iut.synth_values(coeffs, *pontos))
+    graus = []
+    for tol in (1., 10., 100., 1000.):
+        nmax_tol, bound = iut.truncation_degree(coeffs, radius, tol, norm=norm)
+        assert bound <= tol
+        graus.append(int(nmax_tol))
+        if norm == 'max':
+            # limite pontual: vale em cada ponto com raio >= radius
+            cortado = np.array(iut.synth_values(coeffs, *pontos, nmax=graus[-1]))
+            assert np.linalg.norm(completo - cortado, axis=0).max() <= bound
+    assert graus == sorted(graus, reverse=True) and graus[-1] < graus[0]
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pytest
+
+import igrf_utils as iut
+import magcoords_utils as mcu
+
+IGRF_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'IGRF13.shc')
+
+
+@pytest.fixture(scope='module')
+def modelo():
+    return iut.load_shcfile(IGRF_FILE)
+
+
+def test_convert_vazio(modelo):
+    tabelas = mcu.MagneticTables(modelo)
+    coords = tabelas.convert(2020., np.zeros((0, 3)), np.zeros((0, 3)), 100., h_ref=110.)
+    assert set(coords) == set(mcu.MagneticTable.FIELDS) | {'apex_lat', 'dipole_lat', 'dipole_lon'}
+    assert all(v.shape == (0, 3) for v in coords.values())
+    assert tabelas.misses == 0
+
+
+@pytest.fixture(scope='module')
+def tabelas(modelo, tmp_path_factory):
+    # nós grossos: cada tabela traça uma linha de campo por nó
+    return mcu.MagneticTables(modelo, cache_dir=str(tmp_path_factory.mktemp('tabelas')),
+                              lat_step=10., lon_step=20.)
+
+
+@pytest.fixture(scope='module')
+def tabela(tabelas):
+    return tabelas.get(2020., 110.)
+
+
+def test_tabela_nos(tabela):
+    # os nós são os valores calculados diretamente
+    direto = mcu._magnetic_nodes(tabela.coeffs, 110., np.array([-20., 30.]), np.array([40., -100.]))
+    for nome in mcu.MagneticTable.FIELDS:
+        np.testing.assert_allclose(direto[nome], tabela.values[nome][[7, 12], [11, 4]],
+                                   rtol=1e-12, atol=1e-9, err_msg=nome)
+
+    lat, lon = np.meshgrid(tabela.lat[1:-1], tabela.lon, indexing='ij')
+    coords = tabela(lat, lon)
+    for nome in mcu.MagneticTable.FIELDS:
+        esperado = tabela.values[nome][1:-1]
+        if nome == 'apex_lon':
+            diferenca = (coords[nome] - esperado + 180.) % 360. - 180.
+            np.testing.assert_allclose(diferenca, 0., atol=1e-9)
+        else:
+            np.testing.assert_allclose(coords[nome], esperado, rtol=1e-12, atol=1e-9, err_msg=nome)
+
+
+def test_tabela_interpola(tabela):
+    # no meio de uma célula: média dos quatro cantos
+    coords = tabela(-15., 30.)
+    for nome in ('qd_lat', 'apex_height', 'dip_lat', 'modip'):
+        cantos = tabela.values[nome][7:9, 10:12]
+        np.testing.assert_allclose(coords[nome], cantos.mean(), rtol=1e-12, err_msg=nome)
+    # a longitude continua de -180 a 180
+    a = tabela(5., 179.999)['apex_lon']
+    b = tabela(5., -179.999)['apex_lon']
+    assert abs((a - b + 180.) % 360. - 180.) < 1e-2
+
+
+def test_tabelas_disco(modelo, tabelas, tabela, monkeypatch):
+    assert tabelas.get(2020., 110.) is tabela
+    assert tabelas.hits >= 1
+    assert len(os.listdir(tabelas.cache_dir)) == 1
+
+    # outra instância lê a tabela do disco, sem traçar as linhas de novo
+    monkeypatch.setattr(mcu, '_magnetic_nodes', None)
+    outras = mcu.MagneticTables(modelo, cache_dir=tabelas.cache_dir,
+                                lat_step=10., lon_step=20.)
+    lida = outras.get(2020., 110.)
+    assert outras.misses == 1
+    for nome in mcu.MagneticTable.FIELDS:
+        np.testing.assert_array_equal(lida.values[nome], tabela.values[nome])
+
+
+def test_convert(tabelas, tabela):
+    lat = np.array([[-33.3, 0.], [12., 71.]])
+    lon = np.array([[-45., 10.], [200., -170.]])
+    coords = tabelas.convert(2020., lat, lon, 110., h_ref=110.)
+    esperado = tabela(lat, lon, h_ref=110.)
+    for nome, valor in esperado.items():
+        assert coords[nome].shape == (2, 2)
+        np.testing.assert_array_equal(coords[nome], valor)
+    assert np.all(np.abs(coords['dipole_lat']) <= 90.)
+
+
+def test_passo_invalido(modelo):
+    with pytest.raises(ValueError):
+        mcu.MagneticTable(modelo.coeffs[:, -2], 110., lat_step=7.)
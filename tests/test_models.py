@@ -0,0 +1,68 @@
+import shutil
+
+import numpy as np
+import pytest
+from scipy import interpolate
+
+import pyigrf_clara_0_6 as pc
+
+
+@pytest.fixture(scope='module')
+def modelo():
+    return pc.modelos.get()
+
+
+@pytest.mark.parametrize('date', [1903.2, 1965.3, 2020.5, 2023.9])
+def test_coeficientes_igual_interp1d(modelo, date):
+    coef = pc.coeficientes_igrf(modelo)
+    # o cálculo feito em _calc_igrf antes da memoização
+    f = interpolate.interp1d(modelo.time, modelo.coeffs, fill_value='extrapolate')
+    epoch_start = (date-1900)//5 * 5
+    esperado = (f(date), f(1900+epoch_start+1) - f(1900+epoch_start), f(1900+epoch_start))
+
+    for obtido in (coef.get(date), coef.get(date)):
+        for a, b in zip(obtido, esperado):
+            np.testing.assert_array_equal(a, b)
+    assert (coef.hits, coef.misses) == (1, 1)
+
+
+def test_coeficientes_limite(modelo):
+    coef = pc.coeficientes_igrf(modelo, maxsize=2)
+    coeffs = coef.get(2000.)[0]
+    assert not coeffs.flags.writeable
+    coef.get(2001.)
+    coef.get(2002.)
+    coef.get(2000.)
+    assert (coef.hits, coef.misses) == (0, 4)
+    coef.clear()
+    assert (coef.hits, coef.misses) == (0, 0)
+
+
+def test_registro_carrega_uma_vez(tmp_path, monkeypatch):
+    shutil.copy(pc.IGRF_FILE, tmp_path / 'outro.shc')
+    registro = pc.registro_modelos()
+    leituras = []
+    load = pc.iut.load_shcfile
+    monkeypatch.setattr(pc.iut, 'load_shcfile',
+                        lambda caminho, *args: leituras.append(caminho) or load(caminho, *args))
+
+    assert registro.carregados() == []
+    padrao = registro.get()
+    assert registro.get(pc.IGRF_FILE) is padrao
+    assert registro.coeficientes() is registro.coeficientes(pc.IGRF_FILE)
+    # o mesmo arquivo por um caminho relativo
+    monkeypatch.chdir(tmp_path)
+    outro = registro.get('outro.shc')
+    assert registro.get(str(tmp_path / 'outro.shc')) is outro
+    assert outro is not padrao
+    assert leituras == [pc.IGRF_FILE, str(tmp_path / 'outro.shc')]
+    assert registro.carregados() == leituras
+    assert set(registro.tempos_carga) == set(leituras)
+    np.testing.assert_array_equal(outro.coeffs, padrao.coeffs)
+
+
+def test_modelo_padrao_do_modulo():
+    assert pc.igrf is pc.modelos.get()
+    assert pc.coef_igrf is pc.modelos.coeficientes()
+    with pytest.raises(AttributeError):
+        pc.nao_existe